@@ -0,0 +1,31 @@
+// Keep a pandas to_html table current from the server-sent events of api/<status>/events/live
+function liveTable(tableId, url, topic, key) {
+    var source = new EventSource(url);
+    source.addEventListener(topic, function (event) {
+        var delta = JSON.parse(event.data);
+        var table = document.getElementById(tableId);
+        var body = table.tBodies[0];
+        var headers = Array.prototype.map.call(table.tHead.rows[0].cells, function (cell) {
+            return cell.textContent.trim();
+        });
+        var keyIndex = headers.indexOf(key);
+        var rows = {};
+        Array.prototype.forEach.call(body.rows, function (row) {
+            if (row.cells.length > keyIndex) {
+                rows[row.cells[keyIndex].textContent] = row;
+            }
+        });
+        delta.changed.forEach(function (record) {
+            var row = rows[record[key]] || body.insertRow();
+            headers.forEach(function (header, i) {
+                var cell = row.cells[i] || row.insertCell();
+                cell.textContent = record[header] === null ? '' : record[header];
+            });
+        });
+        delta.removed.forEach(function (removed) {
+            if (rows[removed]) {
+                body.removeChild(rows[removed]);
+            }
+        });
+    });
+}
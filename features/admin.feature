@@ -10,4 +10,9 @@ Feature: Check the integrity of the Django application
   #Scenario: django-admin check should work
   #  Given a django application
   #  When I run check
-  #  Then there should be no failures
\ No newline at end of file
+  #  Then there should be no failures
+
+  Scenario: The hot Price and Bar queries should not scan whole tables
+    Given a django application
+    When I explain the hot queries
+    Then no hot query should use a sequential scan
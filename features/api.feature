@@ -52,3 +52,27 @@ Feature: The back-end API should provide everything that the front-end needs
       | json |
       | {"model": "Price", "meta": "", "data": [{"value": 1587.20, "source": "Reyl", "time": "2019-09-01", "as_of": "2019-09-01", "symbol": "TPH9 Index", "resolution": "1d", "asset_type": "index_future"}]} |
 
+
+  Scenario: Live feed clients only receive the rows which changed
+    Given a live feed of two signals
+    When a client follows the live feed
+    And the "SPX.INDEX" signal changes
+    Then the first event has 2 "signals" rows
+    And the next event only has the "SPX.INDEX" row
+
+  Scenario: Live feed streams end after their maximum duration and ask clients to reconnect
+    Given a live feed of two signals
+    When a client follows the live feed for at most 0.5 seconds
+    Then the stream ends with a reconnection delay and 2 "signals" rows
+
+  Scenario: The live signals stream does not push an old snapshot
+    Given a signal snapshot of "SPX,TOPIX" from 2 hours ago
+    And the signals computed on request have a "SPX.INDEX" gross signal of 0.006
+    When a client follows the live signals
+    Then the first event has the "SPX.INDEX" gross signal "0.60%"
+
+  Scenario: Stream live events
+    Given a user
+    And a valid JWT token
+    When the live events are requested
+    Then the response is an event stream with "signals,contracts" events
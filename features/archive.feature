@@ -0,0 +1,31 @@
+Feature: Historical prices can be read from the parquet archive
+  Backtests should be able to read years of prices without going through the ORM
+
+  Scenario Outline: the archive returns the same rows as the database
+    Given a file called "<file_name>"
+    And no "<model_class>" items in the database
+    When I parse and save the file
+    And I sync the "<model_class>" archive
+    Then reading "<model_class>" rows for "<symbol>" from the archive matches the database
+
+    Examples:
+    | file_name | model_class | symbol |
+    | daily_price_test.csv | Price | JPMUEAA LN Equity |
+    | 5m_price_test.csv    | Bar   | ESM20 Index       |
+
+  Scenario: syncing twice does not export the same rows again
+    Given a file called "daily_price_test.csv"
+    When I parse and save the file
+    And I sync the "Price" archive
+    And I sync the "Price" archive
+    Then no rows are exported by the last sync
+
+  Scenario: rows updated after a sync replace their archived version
+    Given a file called "daily_price_test.csv"
+    And no "Price" items in the database
+    When I parse and save the file
+    And I sync the "Price" archive
+    And the "JPMUEAA LN Equity" prices are revised
+    And I sync the "Price" archive
+    Then only the revised rows are exported by the last sync
+    And the archived "JPMUEAA LN Equity" prices match the database
@@ -7,3 +7,52 @@ Feature: We should be able to easily cache stuff
     When the function is called
     Then the result is in the cache at first but then expires
 
+
+  Scenario: The local tier serves repeated calls from memory
+    Given a function that is decorated with "cache_result" and a local tier
+    When the function is called twice
+    Then the second call is a local cache hit
+
+  Scenario: The local tier evicts the least recently used values by size
+    Given a local cache limited to "1000" bytes
+    When I store "3" values of "400" bytes and read the first one back
+    Then the local cache holds "2" values and the second one was evicted
+
+  Scenario: Concurrent callers of an expired entry compute it once
+    Given a slow function that is decorated with "cache_result"
+    When "8" callers ask for the same result at once
+    Then the function was computed "1" times
+
+  Scenario: Recomputing one entry does not hold up entries sharing its lock stripe
+    Given two cache keys in the same lock stripe
+    When the first key is locked for a recompute
+    Then the second key can be locked straight away
+    And no lock is left once both are released
+
+  Scenario: An expired entry is served stale while it is refreshed in the background
+    Given a slow function that is decorated with "cache_result" and stale while revalidate
+    When the function is called and its entry expires
+    Then the next call returns the stale value straight away
+    And the refreshed value is served once the background refresh finishes
+
+  Scenario: DataFrames are cached as compressed Arrow streams
+    Given a function returning a DataFrame that is decorated with "cache_result"
+    When the function is called twice
+    Then the cached entry is stored as "arrow" and read back unchanged
+    And the size and timing of the entry are recorded
+
+  Scenario: Local copies are not served once the rows under their symbol prefix change
+    Given a local function cached with a dependency on "Price" rows starting with "LOCAL"
+    When a "Price" row for "LOCAL1 Index" at "2020-01-15" is saved by another process
+    Then the local function was recomputed
+
+  Scenario Outline: Saving prices only invalidates the entries computed from them
+    Given functions cached with dependencies on "Price" rows for "SPX Index" and "TPX Index" in January 2020
+    When a "Price" row for "<symbol>" at "<time>" is saved
+    Then the "SPX Index" entry was recomputed "<spx>" and the "TPX Index" entry "<tpx>"
+
+    Examples:
+    | symbol | time | spx | tpx |
+    | SPX Index | 2020-01-15 | yes | no |
+    | SPX Index | 2020-03-15 | no | no |
+    | TPX Index | 2020-01-31 | no | yes |
@@ -0,0 +1,80 @@
+Feature: Exante market data client
+  The HTTP client should reuse connections and recover from throttling and server errors
+
+  Scenario: Requests retry on throttling and server errors
+    Given an Exante API stub that answers "/md/1.0/groups/SPX/nearest" with "429,503,200"
+    When I ask the Exante client for the nearest "SPX" future
+    Then the nearest future is "ES.CME.U2019"
+    And the "groups" endpoint recorded "1" requests and "2" retries
+
+  Scenario: Requests give up after the retry limit
+    Given an Exante API stub that answers "/md/1.0/groups/SPX/nearest" with "503,503,503,503,503"
+    When I ask the Exante client for the nearest "SPX" future
+    Then the response is an error with status code "503"
+    And the "groups" endpoint recorded "1" requests and "3" retries
+
+  Scenario: Sequential requests share one kept-alive connection
+    Given an Exante API stub that answers "/md/1.0/groups/SPX/nearest" with "200"
+    When I ask the Exante client for the nearest "SPX" future "5" times
+    Then the stub saw "5" requests over "1" connection
+
+  Scenario: Async batches run concurrently within the connection limit
+    Given a slow Exante API stub for the nearest "SPX,TOPIX,HSI,RTY" futures
+    When I ask the async Exante client with "2" connections for all the nearest futures
+    Then every nearest future is returned in order
+    And the stub served at most "2" requests at once
+
+  Scenario: Identical concurrent requests share one HTTP call
+    Given a slow Exante API stub for the nearest "SPX" futures
+    When the Exante client asks for the nearest "SPX" future "4" times at once
+    Then the stub saw "1" requests
+    And the "groups" endpoint recorded "1" requests and "3" coalesced
+
+  Scenario: Requests wait for the shared rate limiter
+    Given an Exante API stub that answers "/md/1.0/groups/SPX/nearest" with "200"
+    And the "reference" endpoints are limited to "20" requests per second
+    When I ask the Exante client for the nearest "SPX" future "5" times
+    Then the requests took at least "0.2" seconds and the "groups" endpoint was throttled
+
+  Scenario: Overlapping OHLC windows only download the missing bars
+    Given an Exante OHLC stub with 5 minute bars
+    And an Exante client with a bar cache
+    When I ask for 5 minute bars of "ES.CME.U2019" from "2019-08-01 14:00" to "2019-08-01 15:00"
+    And I ask for 5 minute bars of "ES.CME.U2019" from "2019-08-01 14:30" to "2019-08-01 16:00"
+    Then the stub was asked for "2" ohlc ranges
+    And the last ohlc range started after "2019-08-01 15:00"
+    And the bars run from "2019-08-01 14:30" to "2019-08-01 16:00" every 5 minutes
+    When I ask for 5 minute bars of "ES.CME.U2019" from "2019-08-01 14:00" to "2019-08-01 16:00"
+    Then the stub was asked for "2" ohlc ranges
+    And the bars run from "2019-08-01 14:00" to "2019-08-01 16:00" every 5 minutes
+
+  Scenario: Cached OHLC requests longer than a response are downloaded in windows
+    Given an Exante OHLC stub with at most 5000 5 minute bars per response
+    And an Exante client with a bar cache
+    When I ask for 5 minute bars of "ES.CME.U2019" from "2019-07-01 00:00" to "2019-07-21 00:00"
+    Then the stub was asked for "2" ohlc ranges
+    And the bars run from "2019-07-01 00:00" to "2019-07-21 00:00" every 5 minutes without gaps
+    When I ask for 5 minute bars of "ES.CME.U2019" from "2019-07-01 00:00" to "2019-07-21 00:00"
+    Then the stub was asked for "2" ohlc ranges
+    And the bars run from "2019-07-01 00:00" to "2019-07-21 00:00" every 5 minutes without gaps
+
+  Scenario: Long OHLC histories are downloaded in parallel windows
+    Given an Exante OHLC stub with 5 minute bars which repeats the bar before each window
+    And an Exante client with a bar cache
+    When I download 5 minute bars of "ES.CME.U2019" from "2019-08-01 14:00" to "2019-08-01 16:00" "6" bars at a time
+    Then the stub was asked for "5" ohlc ranges
+    And the range runs from "2019-08-01 14:00" to "2019-08-01 16:00" every 5 minutes
+    And the download reported "5" windows and "25" bars
+    And storing the range as "ESU9 Index" bars writes "25" rows
+
+  Scenario: Streamed quotes are served from the last price table
+    Given an Exante quote feed stub streaming "ES.CME.U2019" at "2012.0/2012.5" and "SPX.INDEX" at "2002.1"
+    When the quote subscriber runs until it has "2" quotes
+    Then the latest price of "ES.CME.U2019" is "2012.25" without an OHLC request
+    And the latest price of "SPX.INDEX" is "2002.1" without an OHLC request
+
+  Scenario: The quote subscriber polls when the feed is unavailable
+    Given an Exante stub without a quote feed whose 1 minute "ES.CME.U2019" bar closes at "2012.0"
+    When the quote subscriber runs until it has "1" quotes
+    Then the subscriber polled "ES.CME.U2019"
+    And the latest price of "ES.CME.U2019" is "2012.0" without an OHLC request
@@ -0,0 +1,46 @@
+Feature: FT historical prices
+  Fund and index closes are scraped from FT.com concurrently and only new rows are stored
+
+  Scenario: Unchanged pages are not downloaded or stored again
+    Given an FT stub serving "ft_historical_prices.html" with an ETag
+    And no "Price" items in the database
+    When I scrape the FT prices of "FR0007017488:EUR,GB0006778350:GBP"
+    Then "20" FT prices were inserted
+    And "FR0007017488" has "10" FT closes, the latest on "2020-06-05" at "105.0"
+    When I scrape the FT prices of "FR0007017488:EUR,GB0006778350:GBP"
+    Then "0" FT prices were inserted
+    And "2" FT pages were not modified
+
+  Scenario: Only closes after the latest stored one are inserted
+    Given an FT stub serving "ft_historical_prices.html" without validators
+    And no "Price" items in the database
+    And the FT closes of "FR0007017488" up to "2020-06-01" are stored
+    When I scrape the FT prices of "FR0007017488:EUR"
+    Then "4" FT prices were inserted
+    And "FR0007017488" has "10" FT closes, the latest on "2020-06-05" at "105.0"
+
+  Scenario: Recent fund prices are read from the stored closes and report a failed scrape
+    Given a user
+    And a valid JWT token
+    And an FT stub serving "ft_historical_prices.html" without validators
+    And no "Price" items in the database
+    When I scrape the FT prices of "FR0007017488:EUR"
+    And I request the recent FT prices of "FR0007017488:EUR"
+    Then the response has "10" closes of "FR0007017488" without requesting FT
+    Given an FT stub which fails
+    When I scrape the FT prices of "FR0007017488:EUR"
+    And I request the recent FT prices of "FR0007017488:EUR"
+    Then the response has "10" closes of "FR0007017488" with a warning mentioning "stale"
+
+  Scenario: Recent fund prices are scraped when none are stored or the last scrape is old
+    Given a user
+    And a valid JWT token
+    And an FT stub serving "ft_historical_prices.html" without validators
+    And no "Price" items in the database
+    When I request the recent FT prices of "FR0007017488:EUR"
+    Then the response has "10" closes of "FR0007017488" after requesting FT "1" times
+    When I request the recent FT prices of "FR0007017488:EUR"
+    Then the response has "10" closes of "FR0007017488" without requesting FT
+    Given the last FT scrape of "FR0007017488" was "2" days ago
+    When I request the recent FT prices of "FR0007017488:EUR"
+    Then the response has "10" closes of "FR0007017488" after requesting FT "1" times
@@ -0,0 +1,50 @@
+Feature: Fund classification
+
+  Scenario: Classifying the whole universe matches the single fund calculation
+    Given daily prices of 3 "SPX Index" funds in the universe, the index and the GBPUSD fixes
+    When the funds are classified with the classify_funds command
+    Then 3 fund classifications are saved
+    And each fund's correlation and beta match the single fund calculation
+    And classifying the funds again changes nothing
+
+  Scenario: The grid search ranks every combination and saves the best one
+    Given daily prices of 2 "SPX Index" funds in the universe, the index and the GBPUSD fixes
+    When the settings of the first fund are searched in 2 processes
+    Then every index offset, fx time and hedge combination is ranked
+    And the best combination matches the single fund calculation
+    And the best combination is saved
+
+  Scenario: Rolling regressions of the classified funds match a fit of each window
+    Given daily prices of 2 "SPX Index" funds in the universe, the index and the GBPUSD fixes
+    When the funds are classified with the classify_funds command
+    And their 20 day rolling regressions are computed with the regress_funds command
+    Then every window's beta, r squared and residual volatility match a least squares fit of its returns
+    And the expanding regression ends at the classified correlation and beta
+
+  Scenario Outline: Business day shifts and counts match pandas and numpy
+    Given a calendar store in a temporary directory
+    When the <exchange> calendar is read from the store
+    Then shifting every day of 2015 to 2020 by <days> business days matches CustomBusinessDay
+    And counting the business days between them matches busday_count
+    And a new store reads the <exchange> holidays from disk
+
+    Examples:
+      | exchange | days |
+      | LSE      | -3   |
+      | NYSE     | -1   |
+      | JPX      | 0    |
+      | HKEX     | 2    |
+
+  Scenario Outline: Time of day filters select the bars of the time slices
+    Given five minute "<symbol>" bars around the clock changes of 2019
+    When the bars at <times> <timezone> time are read with a time of day filter
+    Then they are the bars of get_time_slices
+    And the filter of ten years of <times> is shorter than 5000 characters of SQL
+
+    Examples:
+      | symbol          | times             | timezone      |
+      | SLICE1 Curncy   | 12:00:00          | Europe/London |
+      | SLICE2 Curncy   | 00:30:00-02:15:00 | Europe/London |
+      | SLICE3 Index    | 19:55:00-20:55:00 | UTC           |
+      | SLICE4 Index    | 23:00:00-00:30:00 | Asia/Tokyo    |
+      | SLICE5 Curncy   | 06:00-07:30       | Europe/London |
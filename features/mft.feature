@@ -11,7 +11,47 @@ Feature: MFT calculations
       | index | signal |
       | SPX   | 0.005  |
 
+  Scenario: Signals for several indexes are computed in one batch
+    When I calculate the signals of "SPX,TOPIX"
+    Then the "SPX.INDEX" signal is equal to "0.005"
+    And the "TOPIX.INDEX" signal has no future
+    And the signal timings cover "nearest,market_data,spreads,signals,total"
+
   Scenario: Thresholds
     Given a sim result in the database
     When I calculate the thresholds using VIX
-    Then the threshold table is correctly set
\ No newline at end of file
+    Then the threshold table is correctly set
+  Scenario: Signals are served from the latest snapshot
+    When I produce a signal snapshot of "SPX,TOPIX"
+    Then the latest signal snapshot has 2 rows
+    And the signal data is read from the snapshot without computing
+    And the "SPX.INDEX" history has 1 snapshot
+
+  Scenario: Signals computed on request are not saved as snapshots
+    When the signal data is requested without a recent snapshot
+    Then the "SPX.INDEX" signal is equal to "0.005"
+    And no signal snapshot was saved
+
+  Scenario: The rolling fair spread only keeps the latest bars
+    Given a rolling spread estimator of 20 bars
+    When the spreads 1 to 30 are added one bar at a time
+    Then the fair spread is "20.5"
+    When the last bar is revised to a spread of 1000
+    And a bar older than the window is added
+    Then the estimator holds 20 bars
+    And the fair spread is "20.5"
+
+  Scenario: Tied spreads leave no fair spread
+    Given a rolling spread estimator of 20 bars
+    When the spreads 5 to 5 are added one bar at a time
+    Then the fair spread is not a number
+
+  Scenario: A new future replaces the spread estimator of its index
+    Given the spread estimator of "ROLL.INDEX" and "ROLL.U2020" has bars
+    When the spread estimator of "ROLL.INDEX" and "ROLL.Z2020" is requested
+    Then it has no bars and "ROLL.INDEX" has a single estimator
+
+  Scenario: Daily fair spreads over history
+    Given the spreads 1 to 11 in the 50 minutes before 06:00 on 2 days
+    When the daily fair spreads are computed
+    Then each day's fair spread is "6"
@@ -23,7 +23,7 @@ Feature: Parse files
     Examples:
       | file_name                 | model        |
       | static_universe_test.csv  | Universe     |
-      | 5m_price_test.csv         | Price        |
+      | 5m_price_test.csv         | Bar          |
       | daily_price_test.csv      | Price        |
       | reyl_fx_rates.xlsx        | Price        |
       | reyl_positions_1.xlsx     | Position     |
@@ -102,10 +102,30 @@ Feature: Parse files
     | reyl_cash_movements.xlsx | CashMovement |
     | exante_trades.xls | Transaction |
     | exante_transactions.xls | Transaction |
-    | 5m_price_test.csv | Price |
+    | 5m_price_test.csv | Bar |
     | daily_price_test.csv | Price |
     | static_universe_test.csv | Universe |
 
+  Scenario Outline: saving changed rows updates them in bulk
+
+    Given a file called "<file_name>"
+    And no "<model_class>" items in the database
+    When I parse and save the file
+    And I change "<changed>" "<field>" values and save the parsed data again
+    Then the save should report "<inserted>" inserted, "<updated>" updated and "<unchanged>" unchanged
+
+    Examples:
+    | file_name | model_class | field | changed | inserted | updated | unchanged |
+    | 5m_price_test.csv | Bar | close | 3 | 0 | 3 | 26 |
+    | daily_price_test.csv | Price | value | 2 | 0 | 2 | 101 |
+
+  Scenario: re-upserting a batch into a large table updates the changed rows quickly
+
+    Given "100000" "Price" rows saved with bulk_upsert
+    When I upsert "5000" of them again with "2000" changed values
+    Then the upsert should report "0" inserted, "2000" updated and "3000" unchanged
+    And the upsert should take less than "10" seconds
+
   Scenario Outline: parsing price data
 
     Given a file called "<file_name>"
@@ -114,9 +134,37 @@ Feature: Parse files
 
     Examples:
     | file_name | quantity |
-    | 5m_price_test.csv | 116 |
     | daily_price_test.csv | 103 |
 
+  Scenario Outline: parsing bar data
+
+    Given a file called "<file_name>"
+    When I parse the contents of the file
+    Then There should be "<quantity>" bar records
+
+    Examples:
+    | file_name | quantity |
+    | 5m_price_test.csv | 29 |
+
+  Scenario: bars are read back as a time-indexed frame
+
+    Given a file called "5m_price_test.csv"
+    And no "Bar" items in the database
+    When I parse and save the file
+    Then the bars for "ESM20 Index" should be indexed by time with "17" rows
+
+  Scenario Outline: model frames are read with one query
+
+    Given a file called "<file_name>"
+    And no "<model_class>" items in the database
+    When I parse and save the file
+    Then the "<model_class>" frame should match the model instances
+
+    Examples:
+    | file_name | model_class |
+    | exante_trades.xls | Transaction |
+    | exante_positions.csv | Position |
+
   Scenario Outline: parsing monthly 5m bar price
 
     Given a file called "<file_name>"
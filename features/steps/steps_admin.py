@@ -28,3 +28,16 @@ def step_impl(context):
 def step_impl(context):
     import subprocess
     context.result = subprocess.run(["django-admin", "makemigrations", "--dry-run"], stdout=subprocess.PIPE)
+
+
+@when("I explain the hot queries")
+def step_impl(context):
+    from app.hot_queries import explain_hot_queries
+    context.results = explain_hot_queries()
+
+
+@then("no hot query should use a sequential scan")
+def step_impl(context):
+    flagged = {name: plan for name, (plan, tables) in context.results.items() if len(tables) > 0}
+    assert len(context.results) > 0
+    assert len(flagged) == 0, flagged
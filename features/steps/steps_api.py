@@ -193,3 +193,123 @@ def step_impl(context, endpoint):
     token = context.token.json()
     context.client.credentials(HTTP_AUTHORIZATION='Bearer ' + token['access'])
     context.response = context.client.get(url)
+
+
+LIVE_SIGNALS = [{'Index': 'SPX.INDEX', 'Time': '2020-06-05 14:00', 'Gross Signal': '0.50%'},
+                {'Index': 'HSI.INDEX', 'Time': '2020-06-05 08:00', 'Gross Signal': '-0.10%'}]
+
+
+@given('a live feed of two signals')
+def create_live_feed(context):
+    from pandas import DataFrame
+    from app.live import LiveFeed
+    context.live_signals = [dict(signal) for signal in LIVE_SIGNALS]
+    context.live_feed = LiveFeed({'signals': (lambda: DataFrame(context.live_signals), 'Index', ['Index', 'Time'])})
+    context.live_feed.refresh()
+
+
+@when('a client follows the live feed')
+def follow_live_feed(context):
+    context.live_events = context.live_feed.events(heartbeat_s=1)
+    context.first_event = next(context.live_events)
+
+
+@when('a client follows the live feed for at most {seconds:f} seconds')
+def follow_live_feed_briefly(context, seconds):
+    from time import monotonic
+    start = monotonic()
+    context.live_stream = list(context.live_feed.events(heartbeat_s=0.1, max_duration_s=seconds))
+    context.live_stream_s = monotonic() - start
+
+
+@then('the stream ends with a reconnection delay and {count:d} "{topic}" rows')
+def check_bounded_stream(context, count, topic):
+    from app.live import RETRY_MS
+    assert context.live_stream[0].startswith('retry: ' + str(RETRY_MS) + '\n\n')
+    assert len(parse_events(context.live_stream[0])[topic]['changed']) == count
+    assert len(context.live_stream) > 1
+    assert context.live_stream_s < 2
+
+
+@when('the "{index}" signal changes')
+def change_live_signal(context, index):
+    for signal in context.live_signals:
+        if signal['Index'] == index:
+            signal['Time'], signal['Gross Signal'] = '2020-06-05 14:01', '0.60%'
+    context.live_feed.refresh()
+
+
+def parse_events(text):
+    events = {}
+    for message in text.strip().split('\n\n'):
+        lines = dict(line.split(': ', 1) for line in message.split('\n') if not line.startswith(':'))
+        if 'event' in lines:
+            events[lines['event']] = loads(lines['data'])
+    return events
+
+
+@then('the first event has {count:d} "{topic}" rows')
+def check_first_event(context, count, topic):
+    events = parse_events(context.first_event)
+    assert len(events[topic]['changed']) == count
+    assert events[topic]['removed'] == []
+
+
+@then('the next event only has the "{index}" row')
+def check_next_event(context, index):
+    changed = parse_events(next(context.live_events))['signals']['changed']
+    assert [record['Index'] for record in changed] == [index]
+    assert changed[0]['Gross Signal'] == '0.60%'
+
+
+@when('the live events are requested')
+def request_live_events(context):
+    token = context.token.json()
+    context.client.credentials(HTTP_AUTHORIZATION='Bearer ' + token['access'])
+    context.response = context.client.get(reverse('live_events', args=['mock']))
+
+
+@then('the response is an event stream with "{topics}" events')
+def check_event_stream(context, topics):
+    assert context.response.status_code == 200
+    assert context.response['Content-Type'] == 'text/event-stream'
+    text = b''.join(context.response.streaming_content).decode('utf-8')
+    assert sorted(parse_events(text).keys()) == sorted(topics.split(','))
+
+
+@given('a signal snapshot of "{indexes}" from {hours:d} hours ago')
+def create_old_snapshot(context, indexes, hours):
+    from datetime import timedelta
+    from django.core.management import call_command
+    from app.models import SignalSnapshot
+    SignalSnapshot.objects.all().delete()
+    call_command('produce_signal_snapshots', once=True, status='mock', indexes=indexes.split(','))
+    time = SignalSnapshot.objects.values_list('time', flat=True).first()
+    SignalSnapshot.objects.update(time=time - timedelta(hours=hours))
+
+
+@given('the signals computed on request have a "{index}" gross signal of {signal:f}')
+def patch_computed_signals(context, index, signal):
+    import trading.mft
+    from pandas import Timestamp
+    signals = trading.mft.latest_signal_snapshot()
+    signals.loc[signals['Index'] == index, 'Gross Signal'] = signal
+    signals['Time'] = Timestamp.utcnow()
+    compute, trading.mft.cached_signals = trading.mft.cached_signals, lambda: signals
+    context.add_cleanup(setattr, trading.mft, 'cached_signals', compute)
+
+
+@when('a client follows the live signals')
+def follow_live_signals(context):
+    import app.live
+    feed, app.live.live_feed = app.live.live_feed, None
+    context.add_cleanup(setattr, app.live, 'live_feed', feed)
+    context.live_feed = app.live.LiveFeed({'signals': app.live.get_live_feed().tables['signals']})
+    context.live_feed.refresh()
+    context.first_event = next(context.live_feed.events(follow=False))
+
+
+@then('the first event has the "{index}" gross signal "{signal}"')
+def check_live_signal(context, index, signal):
+    changed = parse_events(context.first_event)['signals']['changed']
+    assert [record['Gross Signal'] for record in changed if record['Index'] == index] == [signal], changed
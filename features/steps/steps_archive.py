@@ -0,0 +1,57 @@
+from tempfile import mkdtemp
+
+from behave import when, then
+
+
+@when('I sync the "{model_class}" archive')
+def sync_archive(context, model_class):
+    from data.archive import sync_archive
+    if not hasattr(context, 'archive_root'):
+        context.archive_root = mkdtemp()
+    context.exported = sync_archive(model_class, root=context.archive_root)
+
+
+@then('reading "{model_class}" rows for "{symbol}" from the archive matches the database')
+def assert_archive_matches_db(context, model_class, symbol):
+    import app.models
+    from data.archive import read_archive
+    model_cls = getattr(app.models, model_class)
+    archived = read_archive(model_class, root=context.archive_root, symbol=symbol, time__gte='2020-01-01')
+    ids = set(model_cls.objects.filter(symbol=symbol, time__gte='2020-01-01').values_list('id', flat=True))
+    assert (len(archived.index) > 0)
+    assert (set(archived['id']) == ids)
+    assert (archived['time'].is_monotonic_increasing)
+
+
+@then('no rows are exported by the last sync')
+def assert_nothing_exported(context):
+    assert (context.exported == 0)
+
+
+@when('the "{symbol}" prices are revised')
+def revise_prices(context, symbol):
+    from django.utils import timezone
+    from pandas import DataFrame
+    from app.models import Price
+    from app.upsert import bulk_upsert
+    columns = ['time', 'source', 'symbol', 'resolution', 'asset_type', 'aspect', 'price_type', 'value']
+    df = DataFrame.from_records(list(Price.objects.filter(symbol=symbol).values_list(*columns)), columns=columns)
+    df.loc[:, 'value'] = df['value'] + 1
+    df.loc[:, 'as_of'] = timezone.now()
+    bulk_upsert('Price', df, save_new=False, update_existing=True)
+    context.revised = len(df.index)
+
+
+@then('only the revised rows are exported by the last sync')
+def assert_revised_exported(context):
+    assert (context.exported == context.revised)
+
+
+@then('the archived "{symbol}" prices match the database')
+def assert_archived_values(context, symbol):
+    from app.models import Price
+    from data.archive import read_archive
+    archived = read_archive('Price', root=context.archive_root, symbol=symbol)
+    stored = dict(Price.objects.filter(symbol=symbol).values_list('id', 'value'))
+    assert (len(archived.index) == len(stored))
+    assert (dict(zip(archived['id'], archived['value'])) == stored)
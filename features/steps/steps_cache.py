@@ -1,8 +1,10 @@
-from time import sleep
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep, time
 
 from behave import given, when, then
 
-from app.cache import cache_result, memoize_cache_key, get
+from app.dependencies import dependency
+from app.cache import cache_result, memoize_cache_key, get, stats, reset_stats, local_cache, LocalCache
 
 
 @cache_result(timeout_s=1)
@@ -10,6 +12,11 @@ def some_function(a, b, c, d):
     return a + b + c + d
 
 
+@cache_result(timeout_s=60, local=True)
+def some_local_function(a, b, c, d):
+    return a * b * c * d
+
+
 @given('a function that is decorated with "cache_result"')
 def set_function(context):
     context.function = some_function
@@ -27,4 +34,267 @@ def check_cache(context):
     cache_key = memoize_cache_key(some_function.original_function, *context.args, **context.kwargs)
     assert(get(cache_key) is not None)
     sleep(2)
-    assert(get(cache_key) is None)
\ No newline at end of file
+    assert(get(cache_key) is None)
+
+
+@given('a function that is decorated with "cache_result" and a local tier')
+def set_local_function(context):
+    local_cache.clear()
+    reset_stats()
+    context.function = some_local_function
+    context.args = [1, 2]
+    context.kwargs = {'c': 3, 'd': 4}
+
+
+@when('the function is called twice')
+def call_function_twice(context):
+    context.results = [context.function(*context.args, **context.kwargs) for _ in range(2)]
+
+
+@then('the second call is a local cache hit')
+def check_local_hit(context):
+    assert context.results == [24, 24]
+    assert stats['l1'] == {'hits': 1, 'misses': 1}
+    assert stats['l2'] == {'hits': 0, 'misses': 1}
+
+
+@given('a local cache limited to "{max_bytes}" bytes')
+def create_local_cache(context, max_bytes):
+    context.local_cache = LocalCache(max_bytes=int(max_bytes))
+
+
+@when('I store "{quantity}" values of "{size}" bytes and read the first one back')
+def fill_local_cache(context, quantity, size):
+    for i in range(int(quantity)):
+        context.local_cache.set(i, b'x' * int(size), 60)
+        if i == 1:
+            context.local_cache.get(0)
+
+
+@then('the local cache holds "{quantity}" values and the second one was evicted')
+def check_eviction(context, quantity):
+    assert len(context.local_cache.entries) == int(quantity)
+    assert context.local_cache.get(1) is None
+    assert context.local_cache.get(0) is not None
+    assert context.local_cache.total_bytes <= context.local_cache.max_bytes
+
+
+
+computations = []
+
+
+@cache_result(timeout_s=60, early_expiry_beta=0)
+def some_slow_function(x):
+    computations.append(x)
+    sleep(0.5)
+    return x * 2
+
+
+@cache_result(timeout_s=1, stale_while_revalidate_s=60, early_expiry_beta=0)
+def some_stale_function(x):
+    computations.append(x)
+    sleep(0.3)
+    return len(computations)
+
+
+@given('a slow function that is decorated with "cache_result"')
+def set_slow_function(context):
+    from django.core.cache import cache
+    cache.clear()
+    computations.clear()
+    context.function = some_slow_function
+
+
+@given('a slow function that is decorated with "cache_result" and stale while revalidate')
+def set_stale_function(context):
+    from django.core.cache import cache
+    cache.clear()
+    computations.clear()
+    context.function = some_stale_function
+
+
+@when('"{quantity}" callers ask for the same result at once')
+def call_concurrently(context, quantity):
+    with ThreadPoolExecutor(int(quantity)) as executor:
+        context.results = list(executor.map(context.function, [1] * int(quantity)))
+
+
+@then('the function was computed "{quantity}" times')
+def check_computations(context, quantity):
+    assert context.results == [2] * len(context.results)
+    assert len(computations) == int(quantity), computations
+
+
+@when('the function is called and its entry expires')
+def call_and_expire(context):
+    context.first = context.function(1)
+    sleep(1.2)
+
+
+@then('the next call returns the stale value straight away')
+def check_stale(context):
+    start = time()
+    assert context.function(1) == context.first
+    assert time() - start < 0.3
+
+
+@then('the refreshed value is served once the background refresh finishes')
+def check_refreshed(context):
+    sleep(0.8)
+    assert context.function(1) == context.first + 1
+
+
+
+@cache_result(timeout_s=60)
+def some_frame_function(rows):
+    from pandas import DataFrame, date_range
+    index = date_range('2020-01-01', periods=rows, freq='5min', tz='UTC', name='time')
+    return DataFrame({'close': range(rows), 'symbol': 'ESM20 Index'}, index=index)
+
+
+@given('a function returning a DataFrame that is decorated with "cache_result"')
+def set_frame_function(context):
+    context.function = some_frame_function
+    context.args = [1000]
+    context.kwargs = {}
+
+
+@then('the cached entry is stored as "{format}" and read back unchanged')
+def check_frame_entry(context, format):
+    context.cache_key = memoize_cache_key(some_frame_function.original_function, *context.args)
+    entry = get(context.cache_key)
+    assert entry.value.format == format
+    first, second = context.results
+    assert first.equals(second)
+
+
+@then('the size and timing of the entry are recorded')
+def check_serialization_stats(context):
+    from app.serialization import serialization_stats
+    entry_stats = serialization_stats[context.cache_key]
+    assert entry_stats['bytes'] > 0
+    assert entry_stats['encode_s'] >= 0 and entry_stats['decode_s'] >= 0
+
+
+
+@cache_result(timeout_s=60, early_expiry_beta=0,
+              dependencies=lambda symbol: [dependency('Price', symbols=[symbol], start='2020-01-01', end='2020-01-31')])
+def some_price_function(symbol):
+    computations.append(symbol)
+    return symbol
+
+
+@given('functions cached with dependencies on "Price" rows for "{first}" and "{second}" in January 2020')
+def set_dependent_functions(context, first, second):
+    from django.core.cache import cache
+    cache.clear()
+    computations.clear()
+    context.symbols = [first, second]
+    for symbol in context.symbols:
+        some_price_function(symbol)
+
+
+@when('a "{model_class}" row for "{symbol}" at "{time}" is saved')
+def save_row(context, model_class, symbol, time):
+    from pandas import DataFrame, Timestamp
+    from data.parse import FileParser
+    at = Timestamp(time, tz='UTC')
+    df = DataFrame([{'as_of': at, 'time': at, 'value': 1.0, 'source': 'Bloomberg', 'symbol': symbol,
+                     'resolution': '1d', 'asset_type': 'equity_index', 'aspect': 'close', 'price_type': 'trade'}])
+    FileParser.save({model_class: df}, save_new=True)
+    computations.clear()
+    for symbol in context.symbols:
+        some_price_function(symbol)
+
+
+@then('the "{first}" entry was recomputed "{first_recomputed}" and the "{second}" entry "{second_recomputed}"')
+def check_recomputed(context, first, first_recomputed, second, second_recomputed):
+    assert (first in computations) == (first_recomputed == 'yes'), computations
+    assert (second in computations) == (second_recomputed == 'yes'), computations
+
+
+@cache_result(timeout_s=60, early_expiry_beta=0, local=True,
+              dependencies=lambda prefix: [dependency('Price', prefixes=[prefix])])
+def some_local_prefix_function(prefix):
+    computations.append(prefix)
+    return prefix
+
+
+@given('a local function cached with a dependency on "Price" rows starting with "{prefix}"')
+def set_local_prefix_function(context, prefix):
+    from django.core.cache import cache
+    cache.clear()
+    local_cache.clear()
+    computations.clear()
+    context.prefix = prefix
+    some_local_prefix_function(prefix)
+    some_local_prefix_function(prefix)
+    assert computations == [prefix]
+
+
+@when('a "{model_class}" row for "{symbol}" at "{time}" is saved by another process')
+def save_row_elsewhere(context, model_class, symbol, time):
+    from pandas import DataFrame, Timestamp
+    from data.parse import FileParser
+    at = Timestamp(time, tz='UTC')
+    df = DataFrame([{'as_of': at, 'time': at, 'value': 1.0, 'source': 'Bloomberg', 'symbol': symbol,
+                     'resolution': '1d', 'asset_type': 'equity_index', 'aspect': 'close', 'price_type': 'trade'}])
+    # publishing clears this process's local tier, keep it as another process would
+    entries, total_bytes = local_cache.entries.copy(), local_cache.total_bytes
+    FileParser.save({model_class: df}, save_new=True)
+    local_cache.entries, local_cache.total_bytes = entries, total_bytes
+
+
+@then('the local function was recomputed')
+def check_local_recomputed(context):
+    computations.clear()
+    some_local_prefix_function(context.prefix)
+    assert computations == [context.prefix], computations
+
+
+@given('two cache keys in the same lock stripe')
+def find_keys_in_one_stripe(context):
+    from app.cache import key_lock_stripes
+    stripe = hash('stripe-key-0') % len(key_lock_stripes)
+    second = next(key for key in ('stripe-key-' + str(i) for i in range(1, 10000))
+                  if hash(key) % len(key_lock_stripes) == stripe)
+    context.keys = ['stripe-key-0', second]
+    context.stripe = stripe
+
+
+@when('the first key is locked for a recompute')
+def lock_first_key(context):
+    from threading import Event, Thread
+    from app.cache import key_lock
+    context.locked, context.release = Event(), Event()
+
+    def recompute():
+        with key_lock(context.keys[0]):
+            context.locked.set()
+            context.release.wait(5)
+    context.recompute = Thread(target=recompute)
+    context.recompute.start()
+    assert context.locked.wait(5)
+
+
+@then('the second key can be locked straight away')
+def lock_second_key(context):
+    from threading import Event, Thread
+    from app.cache import key_lock
+    acquired = Event()
+
+    def other_recompute():
+        with key_lock(context.keys[1]):
+            acquired.set()
+    Thread(target=other_recompute).start()
+    try:
+        assert acquired.wait(1)
+    finally:
+        context.release.set()
+        context.recompute.join()
+
+
+@then('no lock is left once both are released')
+def check_locks_dropped(context):
+    from app.cache import key_locks
+    assert not any(key in key_locks[context.stripe] for key in context.keys)
@@ -0,0 +1,303 @@
+from tempfile import mkdtemp
+import json
+from os.path import join
+from threading import Lock, Thread, Event
+from time import sleep, perf_counter, monotonic
+
+from behave import given, when, then
+from pandas import Timestamp, date_range
+
+from data.http.exante import ExanteClient
+from data.http.bar_cache import BarCache
+from data.http.exante_async import AsyncExanteClient
+from data.http.quotes import QuoteTable, QuoteSubscriber
+from utils.test import StubServer
+
+NEAREST = {"id": "ES.CME.U2019", "mpi": 0.25}
+
+
+def create_client(context):
+    client = ExanteClient.create(status='demo', host=context.stub.url, auth=('user', 'password'))
+    client.BACKOFF_S = 0.01
+    return client
+
+
+@given('an Exante API stub that answers "{path}" with "{status_codes}"')
+def start_stub(context, path, status_codes):
+    responses = [(int(code), NEAREST if code == '200' else {'error': code}, {}) for code in status_codes.split(',')]
+    context.stub = StubServer({path: responses}).__enter__()
+    context.add_cleanup(context.stub.__exit__)
+    context.exante_client = create_client(context)
+
+
+@when('I ask the Exante client for the nearest "{symbol}" future')
+def ask_nearest(context, symbol):
+    context.response = context.exante_client.nearest(symbol)
+
+
+@when('I ask the Exante client for the nearest "{symbol}" future "{times}" times')
+def ask_nearest_repeatedly(context, symbol, times):
+    start = perf_counter()
+    context.responses = [context.exante_client.nearest(symbol) for _ in range(int(times))]
+    context.elapsed_s = perf_counter() - start
+
+
+@when('the Exante client asks for the nearest "{symbol}" future "{times}" times at once')
+def ask_nearest_concurrently(context, symbol, times):
+    context.exante_client = create_client(context)
+    context.responses = context.exante_client.batch_api_request(context.exante_client.nearest, [symbol] * int(times))
+
+
+@given('the "{endpoint_class}" endpoints are limited to "{rate}" requests per second')
+def limit_rate(context, endpoint_class, rate):
+    context.exante_client.RATE_LIMITS = {endpoint_class: (float(rate), 1)}
+
+
+@then('the nearest future is "{future}"')
+def check_nearest(context, future):
+    assert context.response['id'] == future
+
+
+@then('the response is an error with status code "{status_code}"')
+def check_error(context, status_code):
+    assert context.response['status_code'] == int(status_code)
+
+
+@then('the "{endpoint}" endpoint recorded "{requests}" requests and "{retries}" retries')
+def check_stats(context, endpoint, requests, retries):
+    stats = context.exante_client.endpoint_stats().loc[endpoint]
+    assert stats['requests'] == int(requests)
+    assert stats['retries'] == int(retries)
+    assert stats['mean_latency_s'] > 0
+
+
+@then('the stub saw "{requests}" requests over "{connections}" connection')
+def check_connections(context, requests, connections):
+    assert len(context.stub.requests) == int(requests)
+    assert len(context.stub.client_ports) == int(connections)
+
+
+class SlowNearest:
+
+    def __init__(self):
+        self.lock = Lock()
+        self.active = 0
+        self.max_active = 0
+
+    def __call__(self, path, query, headers):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        sleep(0.1)
+        with self.lock:
+            self.active -= 1
+        return {"id": path.split('/')[-2] + ".FUTURE", "mpi": 0.25}
+
+
+@given('a slow Exante API stub for the nearest "{symbols}" futures')
+def start_slow_stub(context, symbols):
+    context.symbols = symbols.split(',')
+    context.slow_nearest = SlowNearest()
+    routes = {'/md/1.0/groups/' + symbol + '/nearest': [(200, context.slow_nearest, {})] for symbol in context.symbols}
+    context.stub = StubServer(routes).__enter__()
+    context.add_cleanup(context.stub.__exit__)
+
+
+@when('I ask the async Exante client with "{limit}" connections for all the nearest futures')
+def ask_nearest_async(context, limit):
+    client = AsyncExanteClient.create(status='demo', host=context.stub.url, auth=('user', 'password'),
+                                      connection_limit=int(limit))
+    context.responses = client.run_sync(client.batch_api_request, client.nearest, context.symbols)
+
+
+@then('every nearest future is returned in order')
+def check_nearest_batch(context):
+    assert [response['id'] for response in context.responses] == [s + '.FUTURE' for s in context.symbols]
+
+
+@then('the stub served at most "{limit}" requests at once')
+def check_concurrency(context, limit):
+    assert 1 < context.slow_nearest.max_active <= int(limit)
+
+
+@then('the stub saw "{requests}" requests')
+def check_requests(context, requests):
+    assert len(context.stub.requests) == int(requests)
+
+
+@then('the "{endpoint}" endpoint recorded "{requests}" requests and "{coalesced}" coalesced')
+def check_coalesced(context, endpoint, requests, coalesced):
+    stats = context.exante_client.endpoint_stats().loc[endpoint]
+    assert stats['requests'] == int(requests)
+    assert stats['coalesced'] == int(coalesced)
+    assert len({response['id'] for response in context.responses}) == 1
+
+
+@then('the requests took at least "{seconds}" seconds and the "{endpoint}" endpoint was throttled')
+def check_throttled(context, seconds, endpoint):
+    assert context.elapsed_s >= float(seconds)
+    assert context.exante_client.endpoint_stats().loc[endpoint]['throttled_s'] > 0
+
+
+def ohlc_bars(path, query, headers):
+    start, end = int(query['from'][0]), int(query['to'][0])
+    first = -(-start // 300000) * 300000
+    return [{"timestamp": t, "open": 1.0, "high": 2.0, "low": 0.5, "close": 1.5, "volume": 10}
+            for t in reversed(range(first, end + 1, 300000))]
+
+
+def ohlc_bars_from_previous(path, query, headers):
+    start = int(query['from'][0])
+    query = dict(query, **{'from': [str(start - 300000)]})
+    return ohlc_bars(path, query, headers)
+
+
+def ohlc_bars_up_to_size(path, query, headers):
+    return ohlc_bars(path, query, headers)[:int(query.get('size', ['5000'])[0])]
+
+
+@given('an Exante OHLC stub with at most 5000 5 minute bars per response')
+def start_capped_ohlc_stub(context):
+    context.stub = StubServer({'/md/1.0/ohlc/ES.CME.U2019/300': [(200, ohlc_bars_up_to_size, {})]}).__enter__()
+    context.add_cleanup(context.stub.__exit__)
+
+
+@given('an Exante OHLC stub with 5 minute bars')
+def start_ohlc_stub(context):
+    context.stub = StubServer({'/md/1.0/ohlc/ES.CME.U2019/300': [(200, ohlc_bars, {})]}).__enter__()
+    context.add_cleanup(context.stub.__exit__)
+
+
+@given('an Exante OHLC stub with 5 minute bars which repeats the bar before each window')
+def start_overlapping_ohlc_stub(context):
+    context.stub = StubServer({'/md/1.0/ohlc/ES.CME.U2019/300': [(200, ohlc_bars_from_previous, {})]}).__enter__()
+    context.add_cleanup(context.stub.__exit__)
+
+
+@given('an Exante client with a bar cache')
+def create_cached_client(context):
+    context.exante_client = ExanteClient.create(status='demo', host=context.stub.url, auth=('user', 'password'),
+                                                bar_cache=BarCache(mkdtemp()))
+
+
+@when('I ask for 5 minute bars of "{symbol}" from "{start}" to "{end}"')
+def ask_ohlc(context, symbol, start, end):
+    context.bars = context.exante_client.OHLC(symbol, 300, start_time=Timestamp(start, tz='UTC').to_pydatetime(),
+                                              end_time=Timestamp(end, tz='UTC').to_pydatetime())
+
+
+@then('the stub was asked for "{count}" ohlc ranges')
+def check_ohlc_requests(context, count):
+    assert len(context.stub.requests) == int(count)
+
+
+@then('the last ohlc range started after "{time}"')
+def check_last_range(context, time):
+    path, query, headers = context.stub.requests[-1]
+    assert int(query['from'][0]) > Timestamp(time, tz='UTC').value // 10 ** 6
+
+
+@then('the bars run from "{start}" to "{end}" every 5 minutes')
+def check_bars(context, start, end):
+    expected = date_range(start, end, freq='5min')
+    assert list(context.bars['datetime']) == list(reversed(expected))
+
+
+@when('I download 5 minute bars of "{symbol}" from "{start}" to "{end}" "{max_bars}" bars at a time')
+def download_ohlc_range(context, symbol, start, end, max_bars):
+    context.progress = []
+    context.bars = context.exante_client.OHLC_range(symbol, 300, Timestamp(start, tz='UTC').to_pydatetime(),
+                                                    Timestamp(end, tz='UTC').to_pydatetime(),
+                                                    progress=lambda *args: context.progress.append(args),
+                                                    max_bars_per_request=int(max_bars))
+
+
+@then('the bars run from "{start}" to "{end}" every 5 minutes without gaps')
+def check_bars_count(context, start, end):
+    assert len(context.bars.index) == len(date_range(start, end, freq='5min'))
+    check_bars(context, start, end)
+
+
+@then('the range runs from "{start}" to "{end}" every 5 minutes')
+def check_range(context, start, end):
+    assert list(context.bars['datetime']) == list(date_range(start, end, freq='5min'))
+
+
+@then('the download reported "{windows}" windows and "{bars}" bars')
+def check_download_stats(context, windows, bars):
+    assert len(context.progress) == int(windows)
+    assert context.progress[-1][:2] == (int(windows), int(windows))
+    assert context.exante_client.last_download['windows'] == int(windows)
+    assert context.exante_client.last_download['rows'] == int(bars)
+    assert context.exante_client.last_download['bars_per_s'] > 0
+
+
+@then('storing the range as "{symbol}" bars writes "{rows}" rows')
+def store_range(context, symbol, rows):
+    from app.bars import bars_from_ohlc, write_bars
+    from app.enums import index_future
+    from app.models import Bar
+    write_bars(bars_from_ohlc(context.bars, symbol, 300, index_future))
+    assert Bar.objects.filter(symbol=symbol).count() == int(rows)
+
+
+def feed_message(symbol, price):
+    if '/' in price:
+        bid, ask = price.split('/')
+        return {"timestamp": 1564675500000, "symbolId": symbol, "bid": [{"price": float(bid), "size": 1}],
+                "ask": [{"price": float(ask), "size": 1}]}
+    return {"timestamp": 1564675500000, "symbolId": symbol, "bid": [{"price": float(price), "size": 1}],
+            "ask": [{"price": float(price), "size": 1}]}
+
+
+@given('an Exante quote feed stub streaming "{future}" at "{future_price}" and "{index}" at "{index_price}"')
+def start_feed_stub(context, future, future_price, index, index_price):
+    lines = [{"event": "heartbeat"}, feed_message(future, future_price), feed_message(index, index_price)]
+    body = '\n'.join(json.dumps(line) for line in lines) + '\n'
+    context.symbols = [future, index]
+    context.stub = StubServer({'/md/1.0/feed/' + ','.join(context.symbols):
+                               [(200, body, {'Content-Type': 'application/x-json-stream'})]}).__enter__()
+    context.add_cleanup(context.stub.__exit__)
+
+
+@given('an Exante stub without a quote feed whose 1 minute "{symbol}" bar closes at "{close}"')
+def start_polling_stub(context, symbol, close):
+    bar = [{"timestamp": 1564675500000, "open": 1.0, "high": 1.0, "low": 1.0, "close": float(close), "volume": 1}]
+    context.symbols = [symbol]
+    context.stub = StubServer({'/md/1.0/ohlc/' + symbol + '/60': [(200, bar, {})]}).__enter__()
+    context.add_cleanup(context.stub.__exit__)
+
+
+@when('the quote subscriber runs until it has "{count}" quotes')
+def run_subscriber(context, count):
+    context.quote_table = QuoteTable(join(mkdtemp(), 'quotes.sqlite3'))
+    context.subscriber = QuoteSubscriber(create_client(context), context.symbols, context.quote_table,
+                                         poll_interval_s=0.05)
+    stop = Event()
+    thread = Thread(target=context.subscriber.run, args=(stop,), daemon=True)
+    thread.start()
+    deadline = monotonic() + 5
+    while len(context.quote_table.read().index) < int(count) and monotonic() < deadline:
+        sleep(0.01)
+    stop.set()
+    thread.join(5)
+    context.requests_seen = len(context.stub.requests)
+
+
+@then('the latest price of "{symbol}" is "{price}" without an OHLC request')
+def check_latest_price(context, symbol, price):
+    client = ExanteClient.create(status='demo', host=context.stub.url, auth=('user', 'password'),
+                                 quote_table=context.quote_table)
+    start = perf_counter()
+    record = client.latest_price(symbol)
+    assert perf_counter() - start < 0.01
+    assert record['close'] == float(price)
+    assert record['symbol'] == symbol
+    assert len(context.stub.requests) == context.requests_seen
+
+
+@then('the subscriber polled "{symbol}"')
+def check_polled(context, symbol):
+    assert context.subscriber.stats['failures'] >= 1
+    assert context.subscriber.stats['polled'] >= 1
+    assert any(path == '/md/1.0/ohlc/' + symbol + '/60' for path, query, headers in context.stub.requests)
@@ -0,0 +1,130 @@
+from json import loads
+
+from behave import given, when, then
+from pandas import Timedelta, Timestamp
+
+from utils.test import StubServer, test_file
+
+ETAG = '"2020-06-05"'
+
+
+def read_page(file_name):
+    with open(test_file(file_name), 'rb') as f:
+        return f.read()
+
+
+def start_stub(context, routes):
+    '''
+    Serve routes in place of FT, for the scrapes of the API views too
+    '''
+    import data.http.ft
+    context.stub = StubServer(routes).__enter__()
+    context.add_cleanup(context.stub.__exit__)
+    host, data.http.ft.FT_HOST = data.http.ft.FT_HOST, context.stub.url
+    context.add_cleanup(setattr, data.http.ft, 'FT_HOST', host)
+
+
+@given('an FT stub serving "{file_name}" with an ETag')
+def start_ft_stub_with_etag(context, file_name):
+    page = read_page(file_name)
+
+    def respond(path, query, headers):
+        if headers.get('If-None-Match') == ETAG:
+            return 304, b'', {'ETag': ETAG}
+        return 200, page, {'Content-Type': 'text/html', 'ETag': ETAG}
+
+    context.page = page
+    start_stub(context, {'/data/indices/tearsheet/historical': [respond]})
+
+
+@given('an FT stub serving "{file_name}" without validators')
+def start_ft_stub(context, file_name):
+    context.page = read_page(file_name)
+    start_stub(context, {'/data/indices/tearsheet/historical': [(200, context.page, {})]})
+
+
+@given('an FT stub which fails')
+def start_failing_ft_stub(context):
+    start_stub(context, {'/data/indices/tearsheet/historical': [(500, b'', {})]})
+
+
+@given('the FT closes of "{symbol}" up to "{time}" are stored')
+def store_closes(context, symbol, time):
+    from app.upsert import bulk_upsert
+    from data.http.ft import parse_page, price_rows
+    prices = parse_page(context.page)
+    prices = prices[prices['Time'] <= Timestamp(time, tz='UTC')]
+    bulk_upsert('Price', price_rows(symbol, 'fund', prices, Timestamp.utcnow()))
+
+
+@when('I scrape the FT prices of "{funds}"')
+def scrape(context, funds):
+    from data.http.ft import scrape_daily
+    requests_ = [tuple(fund.split(':')) + ('fund',) for fund in funds.split(',')]
+    context.new_prices, context.scrape_stats = scrape_daily(requests_, host=context.stub.url)
+
+
+@when('I request the recent FT prices of "{fund}"')
+def request_recent_prices(context, fund):
+    from django.urls import reverse
+    isin, currency = fund.split(':')
+    context.stub_requests = len(context.stub.requests)
+    url = reverse('recent_fund_prices', args=['live', 'json', isin, currency])
+    context.client.credentials(HTTP_AUTHORIZATION='Bearer ' + context.token.json()['access'])
+    context.response = context.client.get(url)
+
+
+@then('"{count}" FT prices were inserted')
+def check_inserted(context, count):
+    assert context.scrape_stats['failed'] == 0
+    assert context.scrape_stats['inserted'] == int(count)
+
+
+@then('"{count}" FT pages were not modified')
+def check_not_modified(context, count):
+    assert context.scrape_stats['not_modified'] == int(count)
+    assert all('If-None-Match' in headers for _, _, headers in context.stub.requests[-int(count):])
+
+
+@then('"{symbol}" has "{count}" FT closes, the latest on "{date}" at "{price}"')
+def check_closes(context, symbol, count, date, price):
+    from data.http.ft import recent_prices, price_symbol
+    prices = recent_prices(price_symbol(symbol, 'fund'))
+    assert len(prices.index) == int(count)
+    assert Timestamp(prices['Time'].iloc[0]) == Timestamp(date, tz='UTC')
+    assert prices['Price'].iloc[0] == float(price)
+
+
+@then('the response has "{count}" closes of "{isin}" without requesting FT')
+def check_recent_prices(context, count, isin):
+    assert context.response.status_code == 200
+    rows = loads(context.response.content)
+    assert len(rows) == int(count)
+    assert all(row['Symbol'] == isin for row in rows)
+    assert len(context.stub.requests) == context.stub_requests
+
+
+@given('the last FT scrape of "{isin}" was "{days}" days ago')
+def age_last_scrape(context, isin, days):
+    from app.cache import set
+    from data.http.ft import price_symbol, scrape_key, last_scrape, SCRAPE_TIMEOUT_S
+    symbol = price_symbol(isin, 'fund')
+    scrape = last_scrape(symbol)
+    set(scrape_key(symbol), dict(scrape, time=scrape['time'] - Timedelta(days=int(days))), SCRAPE_TIMEOUT_S)
+
+
+@then('the response has "{count}" closes of "{isin}" after requesting FT "{requests}" times')
+def check_scraped_prices(context, count, isin, requests):
+    assert context.response.status_code == 200
+    rows = loads(context.response.content)
+    assert len(rows) == int(count)
+    assert all(row['Symbol'] == isin for row in rows)
+    assert len(context.stub.requests) - context.stub_requests == int(requests)
+
+
+@then('the response has "{count}" closes of "{isin}" with a warning mentioning "{text}"')
+def check_stale_prices(context, count, isin, text):
+    assert context.response.status_code == 200
+    rows = loads(context.response.content)
+    assert len(rows) == int(count)
+    assert all(row['Symbol'] == isin and text in row['Warning'] for row in rows), rows
@@ -0,0 +1,255 @@
+from datetime import time
+
+from behave import given, when, then
+from numpy.random import default_rng
+from pandas import DataFrame, Timestamp, Timedelta, bdate_range, concat
+
+START_DATE, END_DATE = '2019-04-01', '2019-05-31'
+
+
+def price_rows(symbol, asset_type, times, values):
+    from app.enums import bloomberg, one_day, close, trade
+    return DataFrame({'as_of': Timestamp('2019-06-01', tz='UTC'), 'time': times, 'value': values,
+                      'source': bloomberg, 'symbol': symbol, 'resolution': one_day, 'asset_type': asset_type,
+                      'aspect': close, 'price_type': trade})
+
+
+@given('daily prices of {count:d} "{index}" funds in the universe, the index and the GBPUSD fixes')
+def create_fund_prices(context, count, index):
+    from app.enums import fund, equity_index, fx_spot, bloomberg, five_minutes, mid
+    from app.upsert import bulk_upsert
+    from trading.fund_classifier import INDEX_FX
+    rng = default_rng(21)
+    days = bdate_range(START_DATE, END_DATE, tz='UTC')
+    index_prices = 2900 * (1 + rng.normal(0, 0.01, len(days))).cumprod()
+    context.index, context.fx = index, INDEX_FX[index]
+    context.funds = [context.scenario.name[:5].upper() + str(i) + ' LN Equity' for i in range(count)]
+    prices = [price_rows(index, equity_index, days, index_prices)]
+    for i, symbol in enumerate(context.funds):
+        returns = (i + 1) * 0.5 * rng.normal(0, 0.01, len(days)) + rng.normal(0, 0.005, len(days))
+        prices.append(price_rows(symbol, fund, days, 100 * (1 + returns).cumprod()))
+    bulk_upsert('Price', concat(prices, ignore_index=True))
+    for hour in [11, 12]:
+        fixes = (days.tz_localize(None) + Timedelta(hours=hour)).tz_localize('Europe/London').tz_convert('UTC')
+        bulk_upsert('Bar', DataFrame({'as_of': Timestamp('2019-06-01', tz='UTC'), 'time': fixes, 'source': bloomberg,
+                                      'symbol': context.fx, 'resolution': five_minutes, 'asset_type': fx_spot,
+                                      'price_type': mid,
+                                      'close': 1.3 * (1 + rng.normal(0, 0.004, len(days))).cumprod()}))
+    bulk_upsert('Universe', DataFrame({'as_of': Timestamp('2019-06-01', tz='UTC'), 'bb_ticker': context.funds,
+                                       'asset_type': fund, 'currency': 'GBP', 'name': context.funds,
+                                       'symbol': context.funds, 'geo': 'US'}))
+
+
+@when('the funds are classified with the classify_funds command')
+def classify(context):
+    from django.core.management import call_command
+    call_command('classify_funds', start_date=Timestamp(START_DATE).date(), end_date=Timestamp(END_DATE).date(),
+                 funds=context.funds)
+
+
+def saved_classifications(context):
+    from app.models import FundClassification
+    return FundClassification.objects.filter(fund__in=context.funds)
+
+
+@then('{count:d} fund classifications are saved')
+def check_saved(context, count):
+    assert saved_classifications(context).count() == count
+
+
+def single_fund_statistics(context, fund, fx_time, index_offset, hedged):
+    from trading.fund_classifier import read_prices, read_fx_prices, get_fund_idx_fx_p_dic, \
+        get_formatted_daily_p_dic, get_returns, get_correlation, get_beta
+    from app.enums import one_day, close
+    price_dic = {'daily_price': read_prices(time__gte=START_DATE, time__lte=END_DATE, resolution=one_day,
+                                            aspect=close, symbol__in=[fund, context.index]),
+                 'bar_price': read_fx_prices(START_DATE, END_DATE, context.fx, fx_time)}
+    prices = get_fund_idx_fx_p_dic(price_dic, fund, context.index, context.fx)
+    returns = get_returns(get_formatted_daily_p_dic(prices, START_DATE, END_DATE, index_offset, False))
+    return get_correlation(returns, hedged), get_beta(returns, hedged)
+
+
+@then("each fund's correlation and beta match the single fund calculation")
+def check_single_fund(context):
+    from trading.fund_classifier import INDEX_OFFSET
+    for classification in saved_classifications(context):
+        correlation, beta = single_fund_statistics(context, classification.fund, time(12),
+                                                   INDEX_OFFSET[context.index], False)
+        assert abs(classification.rsq - correlation) < 1e-9
+        assert abs(classification.beta - beta) < 1e-9
+
+
+@then('classifying the funds again changes nothing')
+def check_rerun(context):
+    from trading.fund_classifier import batch_fund_classification
+    _, counts = batch_fund_classification(START_DATE, END_DATE, funds=context.funds)
+    assert counts['inserted'] == 0 and counts['updated'] == 0, counts
+    assert saved_classifications(context).count() == len(context.funds)
+
+
+GRID = {'index_offsets': (-1, 0), 'fx_times': (time(11), time(12)), 'hedges': (False, True)}
+
+
+@when('the settings of the first fund are searched in {processes:d} processes')
+def search_first_fund(context, processes):
+    from trading.fund_classifier import val_time_search_by_correlation
+    context.ranked = val_time_search_by_correlation(context.funds[0], context.index, context.fx, START_DATE, END_DATE,
+                                                    max_workers=processes, **GRID)
+
+
+@then('every index offset, fx time and hedge combination is ranked')
+def check_ranking(context):
+    ranked = context.ranked
+    assert len(ranked.index) == 8
+    assert list(ranked['rank']) == list(range(1, 9))
+    assert ranked['rsq'].is_monotonic_decreasing
+    assert set(zip(ranked['index_offset'], ranked['fx_time'], ranked['has_currency_hedge'])) == \
+        {(offset, fx_time, hedged) for offset in GRID['index_offsets'] for fx_time in GRID['fx_times']
+         for hedged in GRID['hedges']}
+
+
+@then('the best combination matches the single fund calculation')
+def check_best(context):
+    best = context.ranked.iloc[0]
+    correlation, beta = single_fund_statistics(context, best['fund'], best['fx_time'], best['index_offset'],
+                                               best['has_currency_hedge'])
+    assert abs(best['rsq'] - correlation) < 1e-9
+    assert abs(best['beta'] - beta) < 1e-9
+
+
+@then('the best combination is saved')
+def check_best_saved(context):
+    best = context.ranked.iloc[0]
+    saved = saved_classifications(context)
+    assert saved.count() == 1
+    assert saved[0].index_offset == best['index_offset'] and saved[0].fx_time == best['fx_time']
+    assert saved[0].has_currency_hedge == best['has_currency_hedge']
+
+
+@when('their {window:d} day rolling regressions are computed with the regress_funds command')
+def regress(context, window):
+    from django.core.management import call_command
+    context.window = window
+    call_command('regress_funds', start_date=Timestamp(START_DATE).date(), end_date=Timestamp(END_DATE).date(),
+                 funds=context.funds, window=window)
+
+
+@then("every window's beta, r squared and residual volatility match a least squares fit of its returns")
+def check_windows(context):
+    from numpy import polyfit, corrcoef
+    from app.models import FundRegression
+    from trading.fund_classifier import read_fund_returns, INDEX_OFFSET
+    fund_r, index_r, fx_r = read_fund_returns(context.funds, context.index, context.fx, time(12), START_DATE,
+                                              END_DATE, INDEX_OFFSET[context.index], False)
+    hedge_r = index_r - fx_r
+    saved = FundRegression.objects.filter(fund__in=context.funds, window=context.window)
+    assert saved.count() == len(context.funds) * (len(fund_r.dropna().index) - context.window + 1)
+    for regression in saved:
+        end = fund_r.index.get_loc(Timestamp(regression.date))
+        y = fund_r[regression.fund].iloc[end - context.window + 1:end + 1]
+        x = hedge_r.iloc[end - context.window + 1:end + 1]
+        beta, alpha = polyfit(x, y, 1)
+        residuals = y - alpha - beta * x
+        assert regression.observations == context.window
+        assert abs(regression.beta - beta) < 1e-9
+        assert abs(regression.r_squared - corrcoef(x, y)[0, 1] ** 2) < 1e-9
+        assert abs(regression.residual_vol - residuals.std(ddof=2)) < 1e-9
+
+
+@then('the expanding regression ends at the classified correlation and beta')
+def check_expanding(context):
+    from trading.fund_classifier import batch_fund_regressions
+    df, _ = batch_fund_regressions(START_DATE, END_DATE, funds=context.funds, save=False)
+    for classification in saved_classifications(context):
+        last = df[df['fund'] == classification.fund].iloc[-1]
+        assert abs(last['r_squared'] - classification.rsq ** 2) < 1e-9
+        assert abs(last['beta'] - classification.beta) < 1e-9
+
+
+@given('a calendar store in a temporary directory')
+def create_calendar_store(context):
+    from tempfile import mkdtemp
+    from trading.calendars import CalendarStore
+    context.calendar_root = mkdtemp()
+    context.calendar_store = CalendarStore(context.calendar_root)
+
+
+@when('the {exchange} calendar is read from the store')
+def read_calendar(context, exchange):
+    context.exchange = exchange
+    context.calendar = context.calendar_store.get(exchange)
+
+
+@then('shifting every day of 2015 to 2020 by {days:d} business days matches CustomBusinessDay')
+def check_shift(context, days):
+    from pandas import date_range, DatetimeIndex
+    from pandas.tseries.offsets import CustomBusinessDay
+    context.dates = date_range('2015-01-01', '2020-12-31').date
+    context.shifted = context.calendar.shift(context.dates, days)
+    expected = DatetimeIndex(context.dates + CustomBusinessDay(days, holidays=context.calendar.holidays))
+    assert DatetimeIndex(context.shifted).equals(expected)
+
+
+@then('counting the business days between them matches busday_count')
+def check_count(context):
+    from numpy import asarray, busday_count
+    begin = asarray(context.dates, dtype='datetime64[D]')
+    for end in [context.shifted, begin[::-1]]:
+        assert (context.calendar.count(begin, end) == busday_count(begin, end, holidays=context.calendar.holidays)).all()
+
+
+@then('a new store reads the {exchange} holidays from disk')
+def check_disk(context, exchange):
+    import os
+    from numpy import array_equal
+    from trading.calendars import CalendarStore
+    store = CalendarStore(context.calendar_root)
+    assert os.path.isfile(store.path(exchange))
+    assert array_equal(store.get(exchange).holidays, context.calendar.holidays)
+
+
+@given('five minute "{symbol}" bars around the clock changes of {year:d}')
+def create_bars_around_clock_changes(context, symbol, year):
+    from pandas import date_range
+    from app.enums import bloomberg, five_minutes, fx_spot, mid
+    from app.upsert import bulk_upsert
+    context.symbol, context.year = symbol, year
+    times = date_range(str(year) + '-03-28', str(year) + '-04-02', freq='5min', tz='UTC').append(
+        date_range(str(year) + '-10-25', str(year) + '-10-30', freq='5min', tz='UTC'))
+    bulk_upsert('Bar', DataFrame({'as_of': Timestamp('2020-01-01', tz='UTC'), 'time': times, 'source': bloomberg,
+                                  'symbol': symbol, 'resolution': five_minutes, 'asset_type': fx_spot,
+                                  'price_type': mid, 'close': 1.0}))
+
+
+@when('the bars at {times} {timezone} time are read with a time of day filter')
+def read_bars_at_times(context, times, timezone):
+    from app.bars import read_bars
+    from trading.fund_classifier import time_slices_q
+    context.times = times.split('-') if '-' in times else times
+    context.timezone = timezone
+    start, end = str(context.year) + '-01-01', str(context.year) + '-12-31'
+    context.bars = read_bars(time_slices_q(start, end, context.times, timezone), symbol=context.symbol)
+
+
+@then('they are the bars of get_time_slices')
+def check_bars_at_times(context):
+    from pandas import DatetimeIndex
+    from trading.fund_classifier import get_time_slices
+    start, end = str(context.year) + '-01-01', str(context.year) + '-12-31'
+    expected = DatetimeIndex(get_time_slices(start, end, context.times, context.timezone)).tz_localize('UTC')
+    stored = DatetimeIndex(read_bars_of_symbol(context.symbol))
+    assert len(context.bars.index) > 0
+    assert DatetimeIndex(context.bars.index).equals(stored[stored.isin(expected)])
+
+
+def read_bars_of_symbol(symbol):
+    from app.models import Bar
+    return list(Bar.objects.filter(symbol=symbol).order_by('time').values_list('time', flat=True))
+
+
+@then('the filter of ten years of {times} is shorter than {length:d} characters of SQL')
+def check_sql_length(context, times, length):
+    from app.models import Bar
+    from trading.fund_classifier import time_slices_q
+    query = Bar.objects.filter(time_slices_q('2010-01-01', '2019-12-31', context.times, context.timezone)).query
+    assert len(str(query)) < length
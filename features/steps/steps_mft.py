@@ -1,3 +1,5 @@
+from math import isnan
+
 from behave import *
 
 from data.http.exante import ExanteClient
@@ -24,6 +26,167 @@ def check_signal(context, value):
     assert context.signal > signal*0.99
 
 
+@when('I calculate the signals of "{indexes}"')
+def calculate_several_signals(context, indexes):
+    import trading.mft
+    trading.mft.status = 'mock'
+    context.signals = calculate_signals(*indexes.split(',')).set_index('Index')
+
+
+@then('the "{index}" signal is equal to "{value}"')
+def check_index_signal(context, index, value):
+    signal = context.signals.loc[index, 'Gross Signal']
+    assert abs(signal - float(value)) < abs(float(value)) * 0.01
+
+
+@then('the "{index}" signal has no future')
+def check_missing_future(context, index):
+    assert context.signals.loc[index, 'Future'] == 'n/a'
+    assert context.signals.loc[index, 'Gross Signal'] != context.signals.loc[index, 'Gross Signal']
+
+
+@then('the signal timings cover "{stages}"')
+def check_timings(context, stages):
+    from trading.mft import signal_timings
+    assert list(signal_timings.keys()) == stages.split(',')
+    assert all(seconds >= 0 for seconds in signal_timings.values())
+
+
+@when('I produce a signal snapshot of "{indexes}"')
+def produce_snapshot(context, indexes):
+    from django.core.management import call_command
+    call_command('produce_signal_snapshots', once=True, status='mock', indexes=indexes.split(','))
+
+
+@then('the latest signal snapshot has {count:d} rows')
+def check_snapshot(context, count):
+    from trading.mft import latest_signal_snapshot
+    context.snapshot = latest_signal_snapshot()
+    assert len(context.snapshot.index) == count
+    spx = context.snapshot.set_index('Index').loc['SPX.INDEX']
+    assert abs(spx['Gross Signal'] - 0.005) < 0.005 * 0.01
+
+
+@then('the signal data is read from the snapshot without computing')
+def check_signal_data(context):
+    import trading.mft
+
+    def fail(*args):
+        raise AssertionError('signals computed on request')
+    compute, trading.mft.compute_signals = trading.mft.compute_signals, fail
+    try:
+        df = trading.mft.signal_data()
+    finally:
+        trading.mft.compute_signals = compute
+    assert list(df.columns) == list(context.snapshot.columns)
+    assert list(df['Index']) == list(context.snapshot['Index'])
+
+
+@when('the signal data is requested without a recent snapshot')
+def request_without_snapshot(context):
+    import trading.mft
+    from app.models import SignalSnapshot
+    from django.test import override_settings
+    trading.mft.status = 'mock'
+    context.snapshot_count = SignalSnapshot.objects.count()
+    with override_settings(SIGNAL_SNAPSHOT_MAX_AGE_S=0):
+        context.signals = trading.mft.signal_data().set_index('Index')
+
+
+@then('no signal snapshot was saved')
+def check_no_snapshot(context):
+    from app.models import SignalSnapshot
+    assert SignalSnapshot.objects.count() == context.snapshot_count
+
+
+@then('the "{index}" history has {count:d} snapshot')
+def check_history(context, index, count):
+    from trading.mft import signal_history
+    assert len(signal_history(index).index) == count
+
+
+@given('a rolling spread estimator of {window:d} bars')
+def create_estimator(context, window):
+    from trading.spreads import RollingSpread
+    context.estimator = RollingSpread(window)
+
+
+@when('the spreads {first:d} to {last:d} are added one bar at a time')
+def add_spreads(context, first, last):
+    from pandas import Timestamp, Timedelta
+    context.start = Timestamp('2020-06-05 05:00')
+    for i, spread in enumerate(range(first, last + 1)):
+        context.estimator.update(context.start + Timedelta(minutes=5 * i), float(spread))
+
+
+@when('the last bar is revised to a spread of {spread:d}')
+def revise_last_bar(context, spread):
+    assert context.estimator.update(context.estimator.last_time, float(spread))
+
+
+@when('a bar older than the window is added')
+def add_old_bar(context):
+    assert not context.estimator.update(context.start, -1000.0)
+
+
+@then('the estimator holds {count:d} bars')
+def check_estimator_size(context, count):
+    assert len(context.estimator) == count
+
+
+@then('the fair spread is "{value}"')
+def check_fair_spread(context, value):
+    assert abs(context.estimator.fair_spread() - float(value)) < 1e-9
+
+
+@then('the fair spread is not a number')
+def check_no_fair_spread(context):
+    assert isnan(context.estimator.fair_spread())
+
+
+@given('the spread estimator of "{index}" and "{future}" has bars')
+def fill_pair_estimator(context, index, future):
+    from pandas import Timestamp
+    from trading.spreads import get_spread_estimator
+    get_spread_estimator(index, future, 20).update(Timestamp('2020-06-05 05:00'), 1.0)
+
+
+@when('the spread estimator of "{index}" and "{future}" is requested')
+def request_pair_estimator(context, index, future):
+    from trading.spreads import get_spread_estimator
+    context.estimator = get_spread_estimator(index, future, 20)
+
+
+@then('it has no bars and "{index}" has a single estimator')
+def check_rolled_estimator(context, index):
+    from trading.spreads import spread_estimators
+    assert len(context.estimator) == 0
+    assert spread_estimators[index][1] is context.estimator
+    assert sum(1 for key in spread_estimators if index in key) == 1
+
+
+@given('the spreads {first:d} to {last:d} in the 50 minutes before 06:00 on {days:d} days')
+def create_daily_spreads(context, first, last, days):
+    from pandas import Series, date_range, concat
+    context.days = days
+    context.spreads = concat([Series(range(first, last + 1), dtype='float64',
+                                     index=date_range('2020-06-0' + str(day + 1) + ' 05:10', periods=last - first + 1,
+                                                      freq='5min', tz='UTC'))
+                              for day in range(days)])
+
+
+@when('the daily fair spreads are computed')
+def compute_daily_spreads(context):
+    from trading.spreads import daily_fair_spreads
+    context.daily_spreads = daily_fair_spreads(context.spreads, '06:00:00')
+
+
+@then('each day\'s fair spread is "{value}"')
+def check_daily_spreads(context, value):
+    assert len(context.daily_spreads.index) == context.days
+    assert all(abs(spread - float(value)) < 1e-9 for spread in context.daily_spreads)
+
+
 @then("the threshold table is correctly set")
 def step_impl(context):
     assert(len(context.threshold_table) == 2)
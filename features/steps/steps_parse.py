@@ -121,6 +121,28 @@ def assert_monthly_data_no_of_prices(context, quantity):
     assert isinstance(df, DataFrame)
     assert (len(df.index) == int(quantity))
 
+@then('There should be "{quantity}" bar records')
+def assert_no_of_bars(context, quantity):
+    df = context.contents['Bar']
+    assert isinstance(df, DataFrame)
+    assert (len(df.index) == int(quantity))
+
+
+@then('the bars for "{symbol}" should be indexed by time with "{quantity}" rows')
+def assert_read_bars(context, symbol, quantity):
+    from app.bars import read_bars
+    df = read_bars(symbol=symbol)
+    assert (df.index.name == 'time')
+    assert (df.index.is_monotonic_increasing)
+    assert (len(df.index) == int(quantity))
+    assert (df['close'].notnull().all())
+
+
+@when('I parse and save the file')
+def parse_and_save_file(context):
+    context.models = FileParser.parse_and_save(context.file, save_new=True)
+
+
 @then('There should be "{quantity}" None values')
 def assert_universe_data_no_of_nones(context, quantity):
     df = context.contents['Universe']
@@ -129,7 +151,7 @@ def assert_universe_data_no_of_nones(context, quantity):
 
 @then('The timezone of the as_of and time column should be "{timezone}"')
 def assert_monthly_5m_data_timezone(context, timezone):
-    df = context.contents['Price']
+    df = context.contents['Bar']
     assert isinstance(df, DataFrame)
     assert (str(df['time'].dt.tz) == timezone)
 
@@ -210,3 +232,66 @@ def step_impl(context, model_class):
     import app.models
     model_cls = getattr(app.models, model_class)
     model_cls.objects.all().delete()
+
+
+@then('the "{model_class}" frame should match the model instances')
+def step_impl(context, model_class):
+    import app.models
+    from app.models import read_dataframe, to_dict
+    from pandas.testing import assert_frame_equal
+    model_cls = getattr(app.models, model_class)
+    query_set = model_cls.objects.order_by('id')
+    expected = DataFrame.from_records([to_dict(model) for model in query_set])
+    df = read_dataframe(query_set)
+    assert len(df.index) > 0
+    assert str(df['id'].dtype) == 'int64'
+    assert_frame_equal(df.astype('object'), expected[df.columns].astype('object'), check_dtype=False)
+
+
+@when('I change "{changed}" "{field}" values and save the parsed data again')
+def step_impl(context, changed, field):
+    parser = FileParser.create_parser(context.file)
+    data = parser.parse()
+    for df in data.values():
+        df.loc[df.index[:int(changed)], field] = -1.0
+    context.models = parser.save(data, save_new=True, update_existing=True)
+
+
+@then('the save should report "{inserted}" inserted, "{updated}" updated and "{unchanged}" unchanged')
+def step_impl(context, inserted, updated, unchanged):
+    objs, message = context.models
+    expected = '(' + inserted + ' inserted, ' + updated + ' updated, ' + unchanged + ' unchanged)'
+    assert message.endswith(expected), message
+
+
+@given('"{rows}" "{model_class}" rows saved with bulk_upsert')
+def step_impl(context, rows, model_class):
+    from pandas import date_range
+    from app.upsert import bulk_upsert
+    time = date_range('2015-01-01', periods=int(rows) // 4, freq='5min', tz='UTC')
+    context.upsert_model = model_class
+    context.upserted = DataFrame({'time': time.repeat(4), 'symbol': ['UPS' + str(i) for i in range(4)] * len(time),
+                                  'value': 1.0, 'source': 'Exante', 'as_of': time[-1]})
+    bulk_upsert(model_class, context.upserted)
+
+
+@when('I upsert "{rows}" of them again with "{changed}" changed values')
+def step_impl(context, rows, changed):
+    from time import perf_counter
+    from app.upsert import bulk_upsert
+    df = context.upserted.iloc[-int(rows):].copy()
+    df.iloc[:int(changed), df.columns.get_loc('value')] = 2.0
+    start = perf_counter()
+    _, context.counts = bulk_upsert(context.upsert_model, df)
+    context.elapsed_s = perf_counter() - start
+
+
+@then('the upsert should report "{inserted}" inserted, "{updated}" updated and "{unchanged}" unchanged')
+def step_impl(context, inserted, updated, unchanged):
+    assert context.counts == {'inserted': int(inserted), 'updated': int(updated), 'unchanged': int(unchanged)}, \
+        context.counts
+
+
+@then('the upsert should take less than "{seconds}" seconds')
+def step_impl(context, seconds):
+    assert context.elapsed_s < float(seconds), context.elapsed_s
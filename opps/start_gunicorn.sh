@@ -1 +1 @@
-gunicorn -b :8081 wsgi:application
\ No newline at end of file
+gunicorn -b :8081 --worker-class gthread --workers 1 --threads 16 --timeout 600 wsgi:application
\ No newline at end of file
@@ -1,19 +1,27 @@
-import hashlib
 from datetime import datetime
+from functools import partial
 
-from utils import api_response, percentage_formatter, float_formatter, datetime_formatter, Message
+from pandas import Timedelta, Timestamp
+
+from utils import api_response, percentage_formatter, float_formatter, datetime_formatter, Message, random_dataframe
 from data.parse import FileParser
 from data.parse.json_model import JSONParser
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
+from rest_framework.authentication import SessionAuthentication
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from app.live import LiveFeed, get_live_feed, row_hash
+from app.page_views import SignalsView, ContractsView
 from app.asset import Asset
 from data.http import merge_request_fields
-from data.http.ft import parse_daily
+from data.http.ft import price_symbol, recent_prices, last_scrape, scrape_daily
 from app.enums import reyl, bloomberg
 from app.enums import index_future as future_asset_type
 from reporting.reconciliation import end_of_day, cash_rec_summary
 from trading.mft import signal_data, contract_information
 from app.models import CashMovement, Transaction, to_dataframe
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, authentication_classes
+
+RECENT_PRICES_MAX_AGE = Timedelta(days=1)
 
 
 @api_view()
@@ -26,8 +34,24 @@ def aviva_funds(request):
 @api_view()
 @api_response()
 def recent_fund_prices(request, isin, currency):
-    prices = parse_daily(isin, currency, "fund")
+    '''
+    The latest daily FT closes, scraped first when none are stored or the last successful scrape is older than
+    RECENT_PRICES_MAX_AGE, with a Warning column when the last scrape failed
+    '''
+    symbol = price_symbol(isin, "fund")
+    prices = recent_prices(symbol)
+    scrape = last_scrape(symbol)
+    if len(prices.index) == 0 or scrape is None or scrape['error'] is not None or \
+            scrape['time'] < Timestamp.utcnow() - RECENT_PRICES_MAX_AGE:
+        scrape_daily([(isin, currency, 'fund')])
+        prices, scrape = recent_prices(symbol), last_scrape(symbol)
+    failed = scrape is not None and scrape['error'] is not None
+    if len(prices.index) == 0:
+        return Message('no FT prices of ' + isin + ' are stored' +
+                       (', the scrape failed: ' + scrape['error'] if failed else ''), 'error')
     data = merge_request_fields(isin, "daily", "ft.com", "fund", prices)
+    if failed:
+        data['Warning'] = 'stale, the scrape at ' + scrape['time'].isoformat() + ' failed: ' + scrape['error']
     return data
 
 
@@ -41,18 +65,37 @@ def recent_fund_prices(request, isin, currency):
                           'net signal': percentage_formatter,
                           'time': datetime_formatter})
 def signals(request):
-    def hash(row):
-        m = hashlib.md5()
-        m.update(row['index'].encode('utf-8'))
-        m.update(str(row['time']).encode('utf-8'))
-        return m.hexdigest()
-    global signals_formatters
     data = signal_data()
-    data = data.rename(columns={'gross_signal': 'gross signal', 'net_signal': 'net signal'})
-    data.loc[:, 'hash'] = data.apply(hash, axis=1)
+    data.columns = [column.lower() for column in data.columns]
+    data.loc[:, 'hash'] = data.apply(row_hash, axis=1, columns=['index', 'time'])
     return data
 
 
+@api_view()
+@authentication_classes([SessionAuthentication, JWTAuthentication])
+def live_events(request, status):
+    '''
+    Server-sent events with the signal and contract size rows which changed, ?topics=signals,contracts
+    '''
+    topics = request.GET['topics'].split(',') if 'topics' in request.GET else None
+    if status == 'mock':
+        columns = {'signals': SignalsView.columns, 'contracts': ContractsView.columns}
+        feed = LiveFeed({topic: (partial(random_dataframe, columns=columns_), columns_[0], columns_)
+                         for topic, columns_ in columns.items()})
+        feed.refresh()
+        events = feed.events(topics, follow=False)
+    elif status == 'live':
+        feed = get_live_feed()
+        feed.start()
+        events = feed.events(topics)
+    else:
+        return HttpResponse('status must be "mock" or "live"')
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 @api_view()
 @api_response(structure=CashMovement)
 def reyl_cash_movements(request):
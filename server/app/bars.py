@@ -0,0 +1,68 @@
+from pandas import DataFrame, Timestamp, to_datetime
+
+from app.enums import open, high, low, close, volume, one_minute, five_minutes, one_hour, one_day, exante, trade
+from app.models import Bar, bulk_update_fields, field_names
+from app.upsert import bulk_upsert
+
+BAR_ASPECTS = [open, high, low, close, volume]
+
+BAR_COLUMNS = field_names(Bar)
+
+BAR_RESOLUTIONS = {60: one_minute, 300: five_minutes, 60 * 60: one_hour, 24 * 60 * 60: one_day}
+
+
+def bars_from_prices(prices: DataFrame):
+    '''
+    Pivot one-row-per-aspect Price records into one row per bar
+    :param prices: DataFrame with the Price columns
+    :return: DataFrame with the Bar columns
+    '''
+    keys = bulk_update_fields['Bar'] + ['asset_type']
+    if len(prices.index) == 0:
+        return DataFrame(columns=BAR_COLUMNS)
+    values = prices.pivot_table(index=keys, columns='aspect', values='value', aggfunc='last')
+    as_ofs = prices.groupby(keys)['as_of'].max()
+    bars = values.join(as_ofs).reset_index()
+    bars.columns.name = None
+    for aspect in BAR_ASPECTS:
+        if aspect not in bars.columns:
+            bars.loc[:, aspect] = None
+    return bars[BAR_COLUMNS]
+
+
+def bars_from_ohlc(ohlc: DataFrame, symbol: str, bar_length_seconds: int, asset_type: str, as_of=None):
+    '''
+    Convert Exante OHLC bars, e.g. from ExanteClient.OHLC_range, into Bar rows
+    :param symbol: symbol the bars are stored under
+    :return: DataFrame with the Bar columns
+    '''
+    bars = DataFrame({'time': to_datetime(ohlc['timestamp'].astype('int64'), unit='ms', utc=True)})
+    bars.loc[:, 'as_of'] = Timestamp.utcnow() if as_of is None else as_of
+    bars.loc[:, 'source'] = exante
+    bars.loc[:, 'symbol'] = symbol
+    bars.loc[:, 'resolution'] = BAR_RESOLUTIONS[bar_length_seconds]
+    bars.loc[:, 'asset_type'] = asset_type
+    bars.loc[:, 'price_type'] = trade
+    for aspect in BAR_ASPECTS:
+        bars.loc[:, aspect] = ohlc[aspect].astype(float).values if aspect in ohlc.columns else None
+    return bars[BAR_COLUMNS]
+
+
+def read_bars(*q_objects, **filter_criteria):
+    '''
+    Read bars without building model instances
+    :param q_objects: Django Q objects on the Bar model
+    :param filter_criteria: Django filter arguments on the Bar model
+    :return: DataFrame indexed by time with one column per Bar field
+    '''
+    query_set = Bar.objects.filter(*q_objects, **filter_criteria).order_by('time').values_list(*BAR_COLUMNS)
+    df = DataFrame.from_records(list(query_set), columns=BAR_COLUMNS)
+    df.loc[:, BAR_ASPECTS] = df[BAR_ASPECTS].astype(float)
+    return df.set_index('time')
+
+
+def write_bars(bars: DataFrame, save_new=True, update_existing=False):
+    if 'time' not in bars.columns:
+        bars = bars.reset_index()
+    objs, _ = bulk_upsert('Bar', bars, save_new=save_new, update_existing=update_existing)
+    return objs
@@ -1,4 +1,35 @@
-from memoize import memoize, Memoizer
+import pickle
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from copy import deepcopy
+from math import log
+from random import random
+from threading import RLock, Lock, Thread
+from time import monotonic, time, sleep
+
+from memoize import memoize, Memoizer, DEFAULT_TIMEOUT, function_namespace
+from pandas import DataFrame, Series
+
+from app.dependencies import is_current, register_prefixes
+from app.serialization import encode, decode
+from utils.cloud_logging import logger
+
+L1_MAX_BYTES = 256 * 1024 * 1024
+LOCK_SUFFIX = ':lock'
+DEPENDENCIES_SUFFIX = ':dependencies'
+LOCK_POLL_S = 0.1
+
+# expires_at is the soft deadline, the entry stays in Django's cache for stale_while_revalidate_s longer
+# delta is how long the value took to compute, used for early expiry
+# dependencies are the rows the value was computed from, changes to them after created_at invalidate it
+CacheEntry = namedtuple('CacheEntry', ['value', 'expires_at', 'delta', 'created_at', 'dependencies'],
+                        defaults=[0, ()])
+
+# per key recompute locks as [lock, threads holding or waiting for it], each stripe guards the keys hashed to it
+key_lock_stripes = [Lock() for _ in range(64)]
+key_locks = [{} for _ in key_lock_stripes]
+
+stats = {'l1': {'hits': 0, 'misses': 0}, 'l2': {'hits': 0, 'misses': 0}}
 
 
 def get(*args, **kwargs):
@@ -11,25 +42,270 @@ def set(*args, **kwargs):
     return cache.set(*args, **kwargs)
 
 
-def cache_result(timeout_s, override_key=None, version=None, validate=None):
+def add(*args, **kwargs):
+    from django.core.cache import cache
+    return cache.add(*args, **kwargs)
+
+
+def delete(*args, **kwargs):
+    from django.core.cache import cache
+    return cache.delete(*args, **kwargs)
+
+
+def size_of(value):
+    '''
+    Approximate memory used by a cached value
+    :return: bytes
+    '''
+    if isinstance(value, DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    elif isinstance(value, Series):
+        return int(value.memory_usage(deep=True))
+    else:
+        return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+
+class LocalCache:
+    '''
+    Per process LRU cache bounded by the total size of the values rather than the number of entries
+    '''
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.lock = RLock()
+
+    def limit(self):
+        if self.max_bytes is not None:
+            return self.max_bytes
+        from django.conf import settings
+        return getattr(settings, 'CACHE_L1_MAX_BYTES', L1_MAX_BYTES)
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+            expires_at, size, value = entry
+            if expires_at <= monotonic():
+                self.delete(key)
+                return default
+            self.entries.move_to_end(key)
+        return deepcopy(value)
+
+    def set(self, key, value, timeout_s):
+        size = size_of(value)
+        with self.lock:
+            self.delete(key)
+            if size > self.limit():
+                return
+            self.entries[key] = (monotonic() + timeout_s, size, deepcopy(value))
+            self.total_bytes += size
+            while self.total_bytes > self.limit():
+                _, (_, evicted_size, _) = self.entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+
+    def delete(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.total_bytes -= entry[1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+
+local_cache = LocalCache()
+
+
+def count(tier, hit):
+    stats[tier]['hits' if hit else 'misses'] += 1
+
+
+def reset_stats():
+    for tier in stats.values():
+        tier['hits'], tier['misses'] = 0, 0
+
+
+def is_fresh(entry, early_expiry_beta):
+    '''
+    Expire an entry early with a probability that rises towards its deadline, scaled by how long it took to compute
+    '''
+    jitter = -entry.delta * early_expiry_beta * log(1 - random())
+    return time() + jitter < entry.expires_at
+
+
+def read_entry(key, version):
+    entry = get(key, default=None, version=version)
+    if entry is None or isinstance(entry, CacheEntry):
+        return entry
+    return CacheEntry(entry, float('inf'), 0)
+
+
+@contextmanager
+def key_lock(key):
+    '''
+    Hold the lock of one key while its value is recomputed. Its stripe is only held to find or drop the key's lock,
+    so recomputes of other keys never wait for it.
+    '''
+    stripe = hash(key) % len(key_lock_stripes)
+    with key_lock_stripes[stripe]:
+        lock = key_locks[stripe].get(key)
+        if lock is None:
+            lock = key_locks[stripe][key] = [Lock(), 0]
+        lock[1] += 1
+    try:
+        with lock[0]:
+            yield
+    finally:
+        with key_lock_stripes[stripe]:
+            lock[1] -= 1
+            if lock[1] == 0:
+                del key_locks[stripe][key]
+
+
+def wait_for_entry(key, version, timeout_s):
+    deadline = time() + timeout_s
+    while time() < deadline:
+        sleep(LOCK_POLL_S)
+        entry = read_entry(key, version)
+        if entry is not None:
+            return entry
+    return None
+
+
+def cache_result(timeout_s, override_key=None, version=None, validate=None, local=False, local_timeout_s=None,
+                 stale_while_revalidate_s=None, early_expiry_beta=1.0, lock_timeout_s=60, dependencies=None):
+    '''
+    :param timeout_s: lifetime of the entry in Django's cache
+    :param local: also keep the value in this process, in front of Django's cache
+    :param local_timeout_s: lifetime of the in process copy, never longer than timeout_s
+    :param stale_while_revalidate_s: serve an expired value for this long while it is refreshed in the background
+    :param early_expiry_beta: 0 disables probabilistic early expiry, larger values refresh earlier
+    :param lock_timeout_s: how long one caller may hold the recompute lock before others give up waiting
+    :param dependencies: called with the function's arguments, returns the app.dependencies.dependency list the
+    value is computed from. Entries and their local copies are invalidated when publish_changes reports overlapping
+    rows, so a local hit then also reads the change logs from Django's cache
+    '''
+    l1_timeout_s = timeout_s if local_timeout_s is None else min(local_timeout_s, timeout_s)
+    stale_s = stale_while_revalidate_s or 0
+
     def decorator(f):
+        def set_local(l1_key, value, deps, created_at):
+            local_cache.set(l1_key, value, l1_timeout_s)
+            if dependencies is not None:
+                local_cache.set(l1_key + DEPENDENCIES_SUFFIX, (deps, created_at), l1_timeout_s)
+
+        def get_local(l1_key):
+            '''
+            :return: the in process copy, None if there is none or, like an entry of Django's cache, the rows it
+            depends on changed since it was computed
+            '''
+            value = local_cache.get(l1_key)
+            if value is not None and dependencies is not None:
+                current = local_cache.get(l1_key + DEPENDENCIES_SUFFIX)
+                if current is None or not is_current(*current):
+                    local_cache.delete(l1_key)
+                    return None
+            return value
+
+        def compute(key, l1_key, *args, **kwargs):
+            # registered before reading so changes published while the value is computed invalidate it
+            deps = tuple(dependencies(*args, **kwargs)) if dependencies is not None else ()
+            register_prefixes(deps)
+            start = time()
+            value = f(*args, **kwargs)
+            if validate is None or validate(value):
+                entry = CacheEntry(encode(value, key), time() + timeout_s, time() - start, start, deps)
+                set(key, entry, timeout_s + stale_s, version=version)
+                if local:
+                    set_local(l1_key, value, deps, start)
+            return value
+
+        def refresh(key, l1_key, seen, *args, **kwargs):
+            with key_lock(key):
+                entry = read_entry(key, version)
+                refreshed = entry is not None and (seen is None or entry.expires_at != seen.expires_at)
+                if refreshed and entry.expires_at > time() and is_current(entry.dependencies, entry.created_at):
+                    return decode(entry.value, key)
+                if add(key + LOCK_SUFFIX, True, lock_timeout_s, version=version):
+                    try:
+                        return compute(key, l1_key, *args, **kwargs)
+                    finally:
+                        delete(key + LOCK_SUFFIX, version=version)
+                if entry is None:
+                    entry = wait_for_entry(key, version, lock_timeout_s)
+                if entry is None:
+                    return compute(key, l1_key, *args, **kwargs)
+                return decode(entry.value, key)
+
+        def refresh_in_background(key, l1_key, *args, **kwargs):
+            if not add(key + LOCK_SUFFIX, True, lock_timeout_s, version=version):
+                return
+
+            def run():
+                from django.db import connections
+                try:
+                    compute(key, l1_key, *args, **kwargs)
+                except Exception:
+                    logger.exception('cache_result | background refresh failed for ' + str(f))
+                finally:
+                    delete(key + LOCK_SUFFIX, version=version)
+                    connections.close_all()
+            Thread(target=run, daemon=True).start()
+
         def _f(*args, **kwargs):
             if override_key is None:
                 key = memoize_cache_key(f, *args, **kwargs)
             else:
                 key = override_key
-            value = get(key, default=None, version=version)
-            if value is None:
-                value = f(*args, **kwargs)
-                if validate is None or validate(value):
-                    set(key, value, timeout_s, version=version)
-            return value
+            l1_key = make_key(key, 'l1', version)
+            if local:
+                value = get_local(l1_key)
+                count('l1', value is not None)
+                if value is not None:
+                    return value
+            entry = read_entry(key, version)
+            count('l2', entry is not None)
+            if entry is not None and is_fresh(entry, early_expiry_beta) and \
+                    is_current(entry.dependencies, entry.created_at):
+                value = decode(entry.value, key)
+                if local:
+                    set_local(l1_key, value, entry.dependencies, entry.created_at)
+                return value
+            if entry is not None and stale_while_revalidate_s is not None:
+                refresh_in_background(key, l1_key, *args, **kwargs)
+                return decode(entry.value, key)
+            return refresh(key, l1_key, entry, *args, **kwargs)
         _f.original_function = f
         return _f
     return decorator
 
 
-memoizer = Memoizer()
+class AtomicMemoizer(Memoizer):
+    '''
+    Memoizer which creates the version of a function with add, so callers racing on its first call agree on the
+    version, and so on the key whose lock they wait for
+    '''
+
+    def _memoize_version(self, f, args=None, reset=False, delete=False, timeout=DEFAULT_TIMEOUT):
+        if reset or delete:
+            return super()._memoize_version(f, args=args, reset=reset, delete=delete, timeout=timeout)
+        names = function_namespace(f, args=args)
+        keys = [self._memvname(name) for name in names if name]
+        versions = self.get_many(*keys)
+        for i, key in enumerate(keys):
+            if versions[i] is None:
+                version = self._memoize_make_version_hash()
+                self.cache.add(key, version, timeout)
+                versions[i] = self.cache.get(key) or version
+        return names[0], ''.join(versions)
+
+
+memoizer = AtomicMemoizer()
 
 
 def memoize_cache_key(f, *args, **kwargs):
@@ -0,0 +1,153 @@
+from collections import namedtuple
+from time import time
+from urllib.parse import quote
+
+from pandas import Timestamp, isnull, to_datetime
+
+CHANGE_LOG_PREFIX = 'dependency:'
+PREFIX_REGISTRY_PREFIX = 'dependency-prefixes:'
+CHANGE_LOG_TIMEOUT_S = 30 * 24 * 60 * 60
+MAX_CHANGES = 100
+
+# the time field used for the date range of each model's changes
+DEPENDENCY_TIME_FIELDS = {'Price': 'time', 'Bar': 'time', 'Universe': 'as_of'}
+
+Dependency = namedtuple('Dependency', ['model', 'symbols', 'prefixes', 'start', 'end'])
+
+
+def as_timestamp(value):
+    if value is None or isnull(value):
+        return None
+    timestamp = Timestamp(value)
+    if timestamp.tz is None:
+        return timestamp.tz_localize('UTC')
+    return timestamp.tz_convert('UTC')
+
+
+def dependency(model, symbols=(), prefixes=(), start=None, end=None):
+    '''
+    Declare that a cached value was computed from the rows of a model
+    :param model: model class name, e.g. 'Price'
+    :param symbols: exact symbols read
+    :param prefixes: symbol prefixes read with symbol__startswith
+    :param start: first time read, None when unbounded
+    :param end: last time read, None when unbounded
+    '''
+    return Dependency(model, tuple(symbols), tuple(prefixes), as_timestamp(start), as_timestamp(end))
+
+
+def change_log_key(model, symbol):
+    return CHANGE_LOG_PREFIX + model + ':' + quote(symbol, safe='')
+
+
+def prefix_key(model, prefix):
+    return CHANGE_LOG_PREFIX + model + ':' + quote(prefix, safe='') + '*'
+
+
+def dependency_keys(dependencies):
+    keys = []
+    for dep in dependencies:
+        keys += [change_log_key(dep.model, symbol) for symbol in dep.symbols]
+        keys += [prefix_key(dep.model, prefix) for prefix in dep.prefixes]
+    return keys
+
+
+def overlaps(start, end, other_start, other_end):
+    after_start = start is None or other_end is None or other_end >= start
+    before_end = end is None or other_start is None or other_start <= end
+    return after_start and before_end
+
+
+def registration_key(model, prefix):
+    return PREFIX_REGISTRY_PREFIX + model + ':' + quote(prefix, safe='')
+
+
+def register_prefixes(dependencies):
+    '''
+    Remember which prefixes cached entries depend on so publish_changes only writes the change logs that are read.
+    Each prefix has its own key, added without reading the others, so concurrent registrations cannot drop one another
+    '''
+    from django.core.cache import cache
+    for dep in dependencies:
+        for prefix in dep.prefixes:
+            cache.add(registration_key(dep.model, prefix), True, None)
+
+
+def registered_prefixes(model, symbols):
+    '''
+    :return: the registered prefixes of any of the symbols
+    '''
+    from django.core.cache import cache
+    candidates = {registration_key(model, symbol[:i]): symbol[:i] for symbol in symbols for i in range(len(symbol) + 1)}
+    return [candidates[key] for key in cache.get_many(list(candidates))]
+
+
+def is_current(dependencies, created_at):
+    '''
+    :return: False if any of the rows the entry depends on changed after it was computed
+    '''
+    if not dependencies:
+        return True
+    from django.core.cache import cache
+    change_logs = cache.get_many(dependency_keys(dependencies))
+    for dep in dependencies:
+        keys = [change_log_key(dep.model, symbol) for symbol in dep.symbols] + \
+               [prefix_key(dep.model, prefix) for prefix in dep.prefixes]
+        for key in keys:
+            for changed_at, start, end in change_logs.get(key, []):
+                if changed_at >= created_at and overlaps(dep.start, dep.end, start, end):
+                    return False
+    return True
+
+
+def changed_ranges(model, df):
+    '''
+    :param df: rows that were inserted or updated
+    :return: dict of symbol: (first time, last time)
+    '''
+    time_field = DEPENDENCY_TIME_FIELDS.get(model)
+    if 'symbol' not in df.columns or len(df.index) == 0:
+        return {}
+    if time_field is None or time_field not in df.columns:
+        return {symbol: (None, None) for symbol in df['symbol'].dropna().unique()}
+    ranges = to_datetime(df[time_field], utc=True).groupby(df['symbol']).agg(['min', 'max'])
+    return {symbol: (row['min'], row['max']) for symbol, row in ranges.iterrows()}
+
+
+def compact(change_log):
+    '''
+    Merge the oldest changes into one covering them all, so the log stays bounded without missing invalidations
+    '''
+    if len(change_log) <= MAX_CHANGES:
+        return change_log
+    merged, kept = change_log[:-MAX_CHANGES + 1], change_log[-MAX_CHANGES + 1:]
+    starts, ends = [start for _, start, _ in merged], [end for _, _, end in merged]
+    start = None if None in starts else min(starts)
+    end = None if None in ends else max(ends)
+    return [(max(changed_at for changed_at, _, _ in merged), start, end)] + kept
+
+
+def publish_changes(model, ranges):
+    '''
+    Invalidate the cached entries which depend on the changed rows
+    :param model: model class name
+    :param ranges: dict of symbol: (start, end) as returned by changed_ranges
+    '''
+    if len(ranges) == 0:
+        return
+    from django.core.cache import cache
+    from app.cache import local_cache
+    prefixes = registered_prefixes(model, ranges.keys())
+    changes = {}
+    for symbol, (start, end) in ranges.items():
+        keys = [change_log_key(model, symbol)] + [prefix_key(model, p) for p in prefixes if symbol.startswith(p)]
+        for key in keys:
+            changes.setdefault(key, []).append((as_timestamp(start), as_timestamp(end)))
+    now = time()
+    change_logs = cache.get_many(list(changes.keys()))
+    for key, key_changes in changes.items():
+        change_log = [change for change in change_logs.get(key, []) if change[0] > now - CHANGE_LOG_TIMEOUT_S]
+        change_log += [(now, start, end) for start, end in key_changes]
+        change_logs[key] = compact(change_log)
+    cache.set_many({key: change_logs[key] for key in changes}, CHANGE_LOG_TIMEOUT_S)
+    local_cache.clear()
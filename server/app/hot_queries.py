@@ -0,0 +1,97 @@
+import re
+from datetime import time
+from functools import reduce
+from operator import or_
+
+from django.db import connections
+from django.db.models import Q
+from pandas import Timestamp, Timedelta
+
+from app.enums import one_day, five_minutes, close, mid, trade, nav, index_future, fx_spot, bloomberg
+from app.models import Price, Bar
+from app.time_slices import time_of_day_q
+
+HOT_QUERIES = {}
+
+SEQ_SCAN_PATTERNS = {'postgresql': re.compile(r'Seq Scan on (\w+)'),
+                     'sqlite': re.compile(r'\bSCAN (?:TABLE )?(\w+)\s*$', re.MULTILINE)}
+
+EXAMPLE_END = Timestamp('2020-06-01', tz='UTC')
+EXAMPLE_START = EXAMPLE_END - Timedelta(days=90)
+
+
+def hot_query(name):
+    '''
+    Register a function returning a representative QuerySet for one of the frequently run queries
+    '''
+    def decorator(f):
+        HOT_QUERIES[name] = f
+        return f
+    return decorator
+
+
+def example_time_slice():
+    return time_of_day_q(EXAMPLE_START, EXAMPLE_END, time(16), timezone='UTC')
+
+
+@hot_query('fund_classifier.get_daily_prices')
+def daily_prices():
+    return Price.objects.filter(time__gte=EXAMPLE_START, time__lte=EXAMPLE_END, resolution=one_day, aspect=close,
+                                symbol__in=['GB0006778350 ISIN', 'SPX Index'])
+
+
+@hot_query('mft_backtest.get_daily_price')
+def daily_price_panel():
+    return Price.objects.filter(time__range=[EXAMPLE_START, EXAMPLE_END], symbol__in=['SPX Index', 'VIX Index'],
+                                aspect=close, resolution=one_day, price_type__in=[trade, nav])
+
+
+@hot_query('fund_classifier.get_bar_prices fx')
+def fx_bar_prices():
+    return Bar.objects.filter(example_time_slice(), resolution=five_minutes, symbol='GBPUSD Curncy',
+                              price_type__in=[mid, trade])
+
+
+@hot_query('fund_classifier.get_bar_prices futures')
+def future_bar_prices():
+    return Bar.objects.filter(example_time_slice(), resolution=five_minutes, asset_type=index_future,
+                              symbol__startswith='ES')
+
+
+@hot_query('mft_backtest.get_bar_price')
+def bar_price_panel():
+    futures = reduce(or_, [Q(symbol__startswith=prefix) for prefix in ['ES', 'Z ']])
+    return Bar.objects.filter(Q(time__range=[EXAMPLE_START, EXAMPLE_END], resolution=five_minutes) &
+                              (futures | Q(symbol__in=['GBPUSD Curncy', 'SPX Index'])))
+
+
+@hot_query('marks.get_gbp_exchange_rates')
+def gbp_exchange_rates():
+    return Price.objects.filter(source=bloomberg, symbol__in=['GBPUSD Curncy', 'GBPEUR Curncy'], asset_type=fx_spot,
+                                as_of=EXAMPLE_END, time=EXAMPLE_END)
+
+
+def seq_scans(plan, vendor):
+    '''
+    :return: names of the tables read with a full scan in the EXPLAIN output
+    '''
+    pattern = SEQ_SCAN_PATTERNS.get(vendor)
+    if pattern is None:
+        return []
+    return pattern.findall(plan)
+
+
+def explain_hot_queries(names=None):
+    '''
+    Run EXPLAIN on the registered hot queries
+    :param names: subset of HOT_QUERIES to explain, all of them when None
+    :return: dict of name: (plan, tables read with a sequential scan)
+    '''
+    results = {}
+    for name, f in HOT_QUERIES.items():
+        if names is not None and name not in names:
+            continue
+        query_set = f()
+        plan = query_set.explain()
+        results[name] = (plan, seq_scans(plan, connections[query_set.db].vendor))
+    return results
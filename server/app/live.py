@@ -0,0 +1,164 @@
+import hashlib
+import json
+from threading import Condition, Lock, Thread
+from time import monotonic, sleep
+
+from pandas import DataFrame
+
+from utils import apply_formatters
+from utils.cloud_logging import logger
+
+INTERVAL_S = 5
+
+HEARTBEAT_S = 15
+
+KEEP_ALIVE = ': keep-alive\n\n'
+
+# each stream ends after this long and the browser reconnects RETRY_MS later, so a connection only holds a server
+# thread for a bounded time, well within the gunicorn timeout
+STREAM_S = 5 * 60
+
+RETRY_MS = 1000
+
+
+def row_hash(row, columns):
+    '''
+    :return: digest of the row's values in the columns, which changes whenever one of them does
+    '''
+    m = hashlib.md5()
+    for column in columns:
+        m.update(str(row[column]).encode('utf-8'))
+    return m.hexdigest()
+
+
+def table_rows(df: DataFrame, key: str, hash_columns):
+    '''
+    :return: dict of key: (hash, JSON ready record) for every row
+    '''
+    hashes = [row_hash(row, hash_columns) for _, row in df.iterrows()]
+    records = json.loads(df.to_json(orient='records', date_format='iso'))
+    return {record[key]: (hash_, record) for hash_, record in zip(hashes, records)}
+
+
+def delta(seen: dict, rows: dict):
+    '''
+    :param seen: table_rows the client already has
+    :return: dict of changed records and removed keys, None if nothing changed
+    '''
+    changed = [record for key, (hash_, record) in rows.items() if key not in seen or seen[key][0] != hash_]
+    removed = [key for key in seen if key not in rows]
+    if len(changed) == 0 and len(removed) == 0:
+        return None
+    return {'changed': changed, 'removed': removed}
+
+
+def sse_message(event: str, data):
+    return 'event: ' + event + '\ndata: ' + json.dumps(data) + '\n\n'
+
+
+class LiveFeed:
+    '''
+    Recomputes a few small tables on one background thread per process and fans the changed rows out to every
+    connected client as server-sent events, so clients no longer trigger the computation themselves. Every
+    gunicorn worker process polls its own sources, which read the latest snapshot or the shared cache_result of the
+    signals and contract sizes, so the web server runs a single worker process with threads for the streams.
+    '''
+
+    def __init__(self, tables: dict, interval_s: float = INTERVAL_S):
+        '''
+        :param tables: dict of topic: (function returning a DataFrame, key column, columns hashed to detect changes)
+        '''
+        self.tables = tables
+        self.interval_s = interval_s
+        self.rows = {topic: {} for topic in tables}
+        self.version = 0
+        self.condition = Condition()
+        self.lock = Lock()
+        self.thread = None
+
+    def refresh(self):
+        rows = dict(self.rows)
+        for topic, (source, key, hash_columns) in self.tables.items():
+            try:
+                rows[topic] = table_rows(source(), key, hash_columns)
+            except Exception as e:
+                logger.warning('live | refreshing ' + topic + ' failed: ' + str(e))
+        with self.condition:
+            if any(delta(self.rows[topic], rows[topic]) is not None for topic in self.tables):
+                self.rows = rows
+                self.version += 1
+                self.condition.notify_all()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = Thread(target=self.run, name='live-feed', daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            self.refresh()
+            sleep(self.interval_s)
+
+    def wait(self, version, timeout_s):
+        '''
+        :return: (version, rows) as soon as the version differs from the one given, or after timeout_s
+        '''
+        with self.condition:
+            self.condition.wait_for(lambda: self.version != version, timeout_s)
+            return self.version, self.rows
+
+    def events(self, topics=None, follow=True, heartbeat_s=HEARTBEAT_S, max_duration_s=STREAM_S):
+        '''
+        Server-sent events of one client: every row on the first message, then only the rows which changed.
+        The first message sets the reconnection delay and the stream ends after max_duration_s, the client's
+        EventSource then reconnects and receives every row again.
+        :param topics: topics the client follows, all by default
+        :param follow: False to stop after the first message
+        '''
+        topics = list(self.tables) if topics is None else [topic for topic in topics if topic in self.tables]
+        seen = {topic: {} for topic in topics}
+        version = None
+        deadline = monotonic() + max_duration_s
+        messages = ['retry: ' + str(RETRY_MS) + '\n\n']
+        while True:
+            version, rows = self.wait(version, min(heartbeat_s, max(0.0, deadline - monotonic())))
+            for topic in topics:
+                changes = delta(seen[topic], rows[topic])
+                if changes is not None:
+                    messages.append(sse_message(topic, changes))
+                seen[topic] = rows[topic]
+            yield ''.join(messages) or KEEP_ALIVE
+            if not follow or monotonic() >= deadline:
+                return
+            messages = []
+
+
+def view_table(view, data_function):
+    '''
+    :return: source of a LiveFeed table formatted like the TableView shows it
+    '''
+    def source():
+        df = data_function()
+        if df is None or len(df.index) == 0:
+            return DataFrame(columns=view.columns)
+        return apply_formatters(df[view.columns].copy(), view.formatters)
+    return source
+
+
+live_feed = None
+
+
+def get_live_feed():
+    '''
+    :return: the process wide feed of the MFT signals, from signal_data like SignalsView so the stream never replaces
+    the page's rows with an old snapshot, and of the futures contract sizes
+    '''
+    global live_feed
+    if live_feed is None:
+        from app.page_views import SignalsView, ContractsView
+        from trading.mft import signal_data, cached_contract_information
+        live_feed = LiveFeed({'signals': (view_table(SignalsView, signal_data), 'Index', ['Index', 'Time']),
+                              'contracts': (view_table(ContractsView, cached_contract_information), 'Exante ID',
+                                            ['Exante ID', 'As Of', 'Contract Size (£)'])})
+    return live_feed
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+from pandas import Timestamp
+
+from app.bars import bars_from_ohlc, write_bars, BAR_RESOLUTIONS
+from app.enums import AssetType, index_future
+from data.http.bar_cache import get_bar_cache
+from data.http.exante import ExanteClient
+
+
+class Command(BaseCommand):
+
+    help = 'Download a range of Exante OHLC bars in parallel windows and store them as Bar rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('symbol', help='Exante symbol, e.g. ES.CME.U2019')
+        parser.add_argument('start')
+        parser.add_argument('end')
+        parser.add_argument('--bar-length', type=int, default=300, choices=list(BAR_RESOLUTIONS.keys()),
+                            dest='bar_length_seconds')
+        parser.add_argument('--store-as', default=None, dest='store_as', help='symbol of the Bar rows, default symbol')
+        parser.add_argument('--asset-type', default=index_future, choices=[c for c, _ in AssetType.choices()],
+                            dest='asset_type')
+        parser.add_argument('--max-workers', type=int, default=None, dest='max_workers')
+        parser.add_argument('--status', default='live', choices=['live', 'demo'])
+
+    def handle(self, *args, **options):
+        client = ExanteClient.create(status=options['status'], max_workers=options['max_workers'],
+                                     bar_cache=get_bar_cache())
+
+        def progress(done, windows, bars):
+            if options['verbosity'] > 1:
+                self.stdout.write('{}/{} windows, {} bars'.format(done, windows, bars))
+
+        ohlc = client.OHLC_range(options['symbol'], options['bar_length_seconds'],
+                                 Timestamp(options['start'], tz='UTC').to_pydatetime(),
+                                 Timestamp(options['end'], tz='UTC').to_pydatetime(), progress=progress)
+        if 'error' in ohlc.columns:
+            raise CommandError('Exante returned ' + str(ohlc.iloc[0].to_dict()))
+        bars = bars_from_ohlc(ohlc, options['store_as'] or options['symbol'], options['bar_length_seconds'],
+                              options['asset_type'])
+        objs = write_bars(bars, save_new=True, update_existing=True)
+        stats = client.last_download
+        self.stdout.write(self.style.SUCCESS(
+            '{symbol}: {rows} bars from {windows} windows, {elapsed_s:.1f}s, {bars_per_s:.0f} bars/s'.format(**stats)
+            + ', ' + str(len(objs)) + ' rows written'))
@@ -0,0 +1,45 @@
+from datetime import date, time, timedelta
+
+from django.core.management.base import BaseCommand
+
+from trading.fund_classifier import batch_fund_classification, search_fund_classifications
+
+
+class Command(BaseCommand):
+
+    help = 'Classify every fund of the Universe against its index and save the results in FundClassification'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start-date', type=date.fromisoformat, dest='start_date',
+                            help='default a year before the end date')
+        parser.add_argument('--end-date', type=date.fromisoformat, dest='end_date', help='default yesterday')
+        parser.add_argument('--fund', action='append', dest='funds', help='fund to classify, default all of them')
+        parser.add_argument('--fx-time', type=time.fromisoformat, default=time(12), dest='fx_time',
+                            help='London fx valuation time')
+        parser.add_argument('--index-offset', type=int, dest='index_offset',
+                            help='index day offset, default the usual one of the index')
+        parser.add_argument('--hedged', action='store_true', dest='has_currency_hedge')
+        parser.add_argument('--include-holidays', action='store_true', dest='include_holidays')
+        parser.add_argument('--search', action='store_true',
+                            help='search every index offset, fx time and hedge combination and keep the best')
+        parser.add_argument('--max-workers', type=int, dest='max_workers',
+                            help='processes of the search, 0 to search in this process')
+        parser.add_argument('--dry-run', action='store_true', help='print the classifications without saving')
+
+    def handle(self, *args, **options):
+        end_date = options['end_date'] or date.today() - timedelta(days=1)
+        start_date = options['start_date'] or end_date - timedelta(days=365)
+        if options['search']:
+            df, counts = search_fund_classifications(start_date, end_date, funds=options['funds'],
+                                                     include_holidays=options['include_holidays'],
+                                                     save=not options['dry_run'], max_workers=options['max_workers'])
+        else:
+            df, counts = batch_fund_classification(start_date, end_date, funds=options['funds'],
+                                                   fx_time=options['fx_time'], index_offset=options['index_offset'],
+                                                   has_currency_hedge=options['has_currency_hedge'],
+                                                   include_holidays=options['include_holidays'],
+                                                   save=not options['dry_run'])
+        if len(df.index) > 0:
+            self.stdout.write(df[['fund', 'index', 'index_offset', 'fx_time', 'has_currency_hedge', 'rsq', 'beta',
+                                  'residual_std', 'observations']].to_string())
+        self.stdout.write(str(len(df.index)) + ' funds classified, ' + str(counts))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app.hot_queries import HOT_QUERIES, explain_hot_queries
+
+
+class Command(BaseCommand):
+
+    help = 'Run EXPLAIN on the registered hot Price and Bar queries and flag sequential scans'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--query', action='append', choices=list(HOT_QUERIES.keys()), dest='names')
+        parser.add_argument('--fail-on-seq-scan', action='store_true', dest='fail_on_seq_scan')
+
+    def handle(self, *args, **options):
+        results = explain_hot_queries(options['names'])
+        flagged = []
+        for name, (plan, tables) in results.items():
+            if len(tables) > 0:
+                flagged.append(name)
+                self.stdout.write(self.style.WARNING(name + ': sequential scan on ' + ', '.join(tables)))
+            else:
+                self.stdout.write(self.style.SUCCESS(name + ': ok'))
+            if len(tables) > 0 or options['verbosity'] > 1:
+                self.stdout.write(plan)
+        if flagged and options['fail_on_seq_scan']:
+            raise CommandError(str(len(flagged)) + ' hot queries use sequential scans: ' + ', '.join(flagged))
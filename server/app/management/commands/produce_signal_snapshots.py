@@ -0,0 +1,44 @@
+from time import monotonic, sleep
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+import trading.mft
+from trading.mft import in_market_hours, produce_signal_snapshot
+from utils.cloud_logging import logger
+
+
+class Command(BaseCommand):
+
+    help = 'Compute the MFT signals every interval during market hours and save them as timestamped snapshots'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--index', action='append', dest='indexes',
+                            help='index to produce signals for, default settings.SIGNAL_INDEXES')
+        parser.add_argument('--interval', type=float, default=settings.SIGNAL_SNAPSHOT_INTERVAL_S, dest='interval_s')
+        parser.add_argument('--once', action='store_true', help='write one snapshot now, whatever the time')
+        parser.add_argument('--status', default='live', choices=['live', 'demo', 'mock'])
+
+    def handle(self, *args, **options):
+        trading.mft.status = options['status']
+        indexes = options['indexes'] or settings.SIGNAL_INDEXES
+        try:
+            while True:
+                started = monotonic()
+                if options['once'] or in_market_hours(timezone.now()):
+                    self.produce(indexes)
+                if options['once']:
+                    break
+                sleep(max(0.0, options['interval_s'] - (monotonic() - started)))
+        except KeyboardInterrupt:
+            pass
+
+    def produce(self, indexes):
+        try:
+            df = produce_signal_snapshot(indexes)
+        except Exception as e:
+            logger.warning('mft | signal snapshot failed: ' + str(e))
+            return
+        self.stdout.write(str(timezone.now()) + ' | ' + str(len(df.index)) + ' signals, ' +
+                          str(round(trading.mft.signal_timings.get('total', 0), 3)) + 's')
@@ -0,0 +1,31 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+
+from trading.fund_classifier import batch_fund_regressions
+
+
+class Command(BaseCommand):
+
+    help = 'Compute the rolling beta, r squared and residual volatility of every classified fund and save them ' \
+           'in FundRegression'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start-date', type=date.fromisoformat, dest='start_date',
+                            help='default a year before the end date')
+        parser.add_argument('--end-date', type=date.fromisoformat, dest='end_date', help='default yesterday')
+        parser.add_argument('--fund', action='append', dest='funds', help='fund to regress, default all of them')
+        parser.add_argument('--window', type=int, help='return dates in each window, default an expanding window')
+        parser.add_argument('--include-holidays', action='store_true', dest='include_holidays')
+        parser.add_argument('--dry-run', action='store_true', help='print the statistics without saving')
+
+    def handle(self, *args, **options):
+        end_date = options['end_date'] or date.today() - timedelta(days=1)
+        start_date = options['start_date'] or end_date - timedelta(days=365)
+        df, counts = batch_fund_regressions(start_date, end_date, window=options['window'], funds=options['funds'],
+                                            include_holidays=options['include_holidays'],
+                                            save=not options['dry_run'])
+        if len(df.index) > 0:
+            latest = df.sort_values('date').drop_duplicates(subset='fund', keep='last')
+            self.stdout.write(latest[['fund', 'date', 'beta', 'r_squared', 'residual_vol', 'observations']].to_string())
+        self.stdout.write(str(len(df.index)) + ' fund regressions, ' + str(counts))
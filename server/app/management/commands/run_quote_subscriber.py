@@ -0,0 +1,36 @@
+from threading import Event
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from data.http.exante import ExanteClient
+from data.http.quotes import QuoteSubscriber, get_quote_table
+
+
+class Command(BaseCommand):
+
+    help = 'Keep the local last price table current from the Exante quote feed, polling when the feed is down'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--index', action='append', dest='indexes',
+                            help='follow the index and its nearest future, default settings.EXANTE_QUOTE_INDEXES')
+        parser.add_argument('--symbol', action='append', dest='symbols',
+                            help='other Exante symbols to follow, default settings.EXANTE_QUOTE_SYMBOLS')
+        parser.add_argument('--poll-interval', type=float, default=1, dest='poll_interval_s')
+        parser.add_argument('--fallback', type=float, default=60, dest='fallback_s',
+                            help='seconds to poll after the feed fails before reconnecting')
+        parser.add_argument('--status', default='live', choices=['live', 'demo'])
+
+    def handle(self, *args, **options):
+        client = ExanteClient.create(status=options['status'])
+        indexes = options['indexes'] or settings.EXANTE_QUOTE_INDEXES
+        symbols = list(options['symbols'] or settings.EXANTE_QUOTE_SYMBOLS)
+        symbols += [index + client.INDEX_SUFFIX for index in indexes]
+        symbols += [info['id'] for info in client.batch_api_request(client.nearest, indexes) if 'id' in info]
+        self.stdout.write('following ' + ', '.join(symbols))
+        subscriber = QuoteSubscriber(client, symbols, get_quote_table(), poll_interval_s=options['poll_interval_s'],
+                                     fallback_s=options['fallback_s'])
+        try:
+            subscriber.run(Event())
+        except KeyboardInterrupt:
+            self.stdout.write(str(subscriber.stats))
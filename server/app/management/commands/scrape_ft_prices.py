@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from data.http.ft import scrape_daily, ticker_to_symbol, MAX_WORKERS
+
+
+class Command(BaseCommand):
+
+    help = 'Scrape the FT historical price pages concurrently and store the daily closes not already saved'
+
+    def add_arguments(self, parser):
+        parser.add_argument('funds', nargs='*', help='fund ISIN and currency, e.g. FR0007017488:EUR')
+        parser.add_argument('--index', action='append', default=[], choices=list(ticker_to_symbol.keys()),
+                            dest='indexes')
+        parser.add_argument('--max-workers', type=int, default=MAX_WORKERS, dest='max_workers')
+
+    def handle(self, *args, **options):
+        requests_ = []
+        for fund in options['funds']:
+            isin, _, currency = fund.partition(':')
+            if currency == '':
+                raise CommandError('funds are given as ISIN:CURRENCY, got ' + fund)
+            requests_.append((isin, currency, 'fund'))
+        requests_ += [(index, None, 'index') for index in options['indexes']]
+        _, stats = scrape_daily(requests_, max_workers=options['max_workers'])
+        self.stdout.write('{pages} pages, {not_modified} unchanged, {failed} failed, {inserted} prices inserted '
+                          'in {elapsed_s:.1f}s'.format(**stats))
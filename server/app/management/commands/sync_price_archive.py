@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from data.archive import sync_archive
+
+
+class Command(BaseCommand):
+
+    help = 'Export the Price and Bar rows created since the last sync to the parquet archive'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', action='append', choices=['Price', 'Bar'], dest='models')
+        parser.add_argument('--root', default=None)
+
+    def handle(self, *args, **options):
+        models = options['models'] or ['Price', 'Bar']
+        for model_cls_name in models:
+            exported = sync_archive(model_cls_name, root=options['root'])
+            self.stdout.write(model_cls_name + ': exported ' + str(exported) + ' rows')
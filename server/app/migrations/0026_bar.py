@@ -0,0 +1,36 @@
+# Generated by Django 2.2.6 on 2026-10-18 09:41
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0025_simresult'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Bar',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('as_of', models.DateTimeField()),
+                ('time', models.DateTimeField(db_index=True)),
+                ('source', models.CharField(choices=[('unknown', 'unknown'), ('Bloomberg', 'Bloomberg'), ('Exante', 'Exante'), ('Reyl', 'Reyl'), ('Ft', 'Ft'), ('PortaraCQG', 'PortaraCQG'), ('Dukascopy', 'Dukascopy')], max_length=20)),
+                ('symbol', models.CharField(db_index=True, max_length=30, validators=[django.core.validators.MinLengthValidator(3)])),
+                ('resolution', models.CharField(choices=[('unknown', 'unknown'), ('1s', '1s'), ('1m', '1m'), ('1h', '1h'), ('1d', '1d'), ('5m', '5m')], db_index=True, default='unknown', max_length=20)),
+                ('asset_type', models.CharField(choices=[('unknown', 'unknown'), ('index_future', 'index_future'), ('fund', 'fund'), ('cash', 'cash'), ('fx_spot', 'fx_spot'), ('cash_equity', 'cash_equity'), ('fx_forward', 'fx_forward'), ('fx_future', 'fx_future'), ('equity_index', 'equity_index'), ('volatility_index', 'volatility_index')], default='unknown', max_length=20)),
+                ('price_type', models.CharField(choices=[('unknown', 'unknown'), ('trade', 'trade'), ('bid', 'bid'), ('ask', 'ask'), ('nav', 'nav'), ('mid', 'mid')], db_index=True, default='unknown', max_length=20)),
+                ('open', models.FloatField(null=True)),
+                ('high', models.FloatField(null=True)),
+                ('low', models.FloatField(null=True)),
+                ('close', models.FloatField(null=True)),
+                ('volume', models.FloatField(null=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='bar',
+            constraint=models.UniqueConstraint(fields=('time', 'source', 'symbol', 'resolution', 'price_type'), name='unique_bar'),
+        ),
+    ]
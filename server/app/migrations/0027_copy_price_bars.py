@@ -0,0 +1,70 @@
+from datetime import timedelta
+
+from django.db import migrations
+from django.db.models import Max, Min
+from pandas import DataFrame
+
+
+PRICE_COLUMNS = ['as_of', 'time', 'value', 'source', 'symbol', 'resolution', 'asset_type', 'aspect', 'price_type']
+
+BAR_KEYS = ['time', 'source', 'symbol', 'resolution', 'price_type', 'asset_type']
+
+BAR_ASPECTS = ['open', 'high', 'low', 'close', 'volume']
+
+BAR_COLUMNS = ['as_of', 'time', 'source', 'symbol', 'resolution', 'asset_type', 'price_type'] + BAR_ASPECTS
+
+
+def bars_from_prices(prices: DataFrame):
+    '''
+    Pivot one-row-per-aspect Price records into one row per bar, a copy of app.bars.bars_from_prices as it was
+    when this migration was written so later changes to it do not change the migration
+    '''
+    values = prices.pivot_table(index=BAR_KEYS, columns='aspect', values='value', aggfunc='last')
+    as_ofs = prices.groupby(BAR_KEYS)['as_of'].max()
+    bars = values.join(as_ofs).reset_index()
+    bars.columns.name = None
+    for aspect in BAR_ASPECTS:
+        if aspect not in bars.columns:
+            bars.loc[:, aspect] = None
+    return bars[BAR_COLUMNS]
+
+
+def months(first, last):
+    '''
+    :return: (start, end) of every month from the one of first to the one of last, the pages read at once
+    '''
+    start = first.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    while start <= last:
+        end = (start + timedelta(days=32)).replace(day=1)
+        yield start, end
+        start = end
+
+
+def copy_price_bars(apps, schema_editor):
+    Price = apps.get_model('app', 'Price')
+    Bar = apps.get_model('app', 'Bar')
+    bar_prices = Price.objects.filter(resolution='5m')
+    ranges = bar_prices.values('symbol').annotate(first=Min('time'), last=Max('time')) \
+        .values_list('symbol', 'first', 'last')
+    for symbol, first, last in ranges:
+        # every aspect of a bar has the bar's time, so a month of prices holds whole bars
+        for start, end in months(first, last):
+            records = bar_prices.filter(symbol=symbol, time__gte=start, time__lt=end).values_list(*PRICE_COLUMNS)
+            prices = DataFrame.from_records(list(records), columns=PRICE_COLUMNS)
+            if len(prices.index) == 0:
+                continue
+            bars = bars_from_prices(prices).astype('object')
+            bars = bars.where(bars.notnull(), None)
+            objs = [Bar(**d) for d in bars.to_dict(orient='records')]
+            Bar.objects.bulk_create(objs, ignore_conflicts=True, batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0026_bar'),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_price_bars, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.6 on 2026-10-18 10:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0027_copy_price_bars'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bar',
+            index=models.Index(fields=['symbol', 'resolution', 'time'], name='bar_symbol_res_time', opclasses=['varchar_pattern_ops', 'text_ops', 'timestamptz_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='price',
+            index=models.Index(fields=['symbol', 'resolution', 'aspect', 'time'], name='price_symbol_res_aspect_time', opclasses=['varchar_pattern_ops', 'text_ops', 'text_ops', 'timestamptz_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='price',
+            index=models.Index(fields=['as_of', 'source', 'asset_type', 'symbol'], name='price_as_of_source_type'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 2.2.6 on 2026-10-18 10:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0028_price_bar_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SignalSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time', models.DateTimeField(db_index=True)),
+                ('index', models.CharField(max_length=20)),
+                ('future', models.CharField(max_length=30)),
+                ('future_price', models.FloatField(null=True)),
+                ('index_price', models.FloatField(null=True)),
+                ('fair_spread', models.FloatField(null=True)),
+                ('quote_time', models.DateTimeField(null=True)),
+                ('gross_signal', models.FloatField(null=True)),
+                ('net_signal', models.FloatField(null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='signalsnapshot',
+            index=models.Index(fields=['index', 'time'], name='signal_snapshot_index_time'),
+        ),
+        migrations.AddConstraint(
+            model_name='signalsnapshot',
+            constraint=models.UniqueConstraint(fields=('time', 'index'), name='unique_signal_snapshot'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 2.2.6 on 2026-10-18 11:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0029_signalsnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FundRegression',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('fund', models.CharField(max_length=50)),
+                ('index', models.CharField(max_length=50)),
+                ('fx', models.CharField(max_length=50)),
+                ('has_currency_hedge', models.BooleanField()),
+                ('index_offset', models.IntegerField()),
+                ('fx_time', models.TimeField()),
+                ('window', models.IntegerField()),
+                ('beta', models.FloatField()),
+                ('rsq', models.FloatField(null=True)),
+                ('residual_vol', models.FloatField(null=True)),
+                ('observations', models.IntegerField()),
+                ('as_of', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='fundregression',
+            index=models.Index(fields=['fund', 'date'], name='fund_regression_fund_date'),
+        ),
+        migrations.AddConstraint(
+            model_name='fundregression',
+            constraint=models.UniqueConstraint(fields=('date', 'fund', 'index', 'fx', 'has_currency_hedge', 'index_offset', 'fx_time', 'window'), name='unique_fund_regression'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.6 on 2026-10-18 12:38
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0030_fundregression'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='fundregression',
+            old_name='rsq',
+            new_name='r_squared',
+        ),
+    ]
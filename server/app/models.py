@@ -1,13 +1,15 @@
 from django.core.validators import MinLengthValidator
-from django.db.models import Model, UniqueConstraint
+from django.db import connections
+from django.db.models import Model, UniqueConstraint, QuerySet, Index
 from django.db.models.fields import *
-from pandas import DataFrame
+from numpy import array
+from pandas import DataFrame, Categorical, to_datetime
 
 from app.enums import *
 from app.enums import fund, index_future, AssetType, fx_forward, fx_spot, TransactionType, Source, Resolution, Custodian, \
     Owner, Group, transfer, interest, dividend, fee, Aspect, PriceType
 
-from django.core.exceptions import ObjectDoesNotExist
+from django.core.exceptions import ObjectDoesNotExist, EmptyResultSet
 import sys
 
 this_module = sys.modules[__name__]
@@ -25,7 +27,72 @@ def to_dict(model):
     return as_dict
 
 
+def column_array(field, values, categorical=True):
+    if isinstance(field, DateTimeField):
+        return to_datetime(array(values, dtype='object'), utc=True)
+    elif isinstance(field, FloatField):
+        return array(values, dtype='float64')
+    elif isinstance(field, (AutoField, IntegerField)) and None not in values:
+        return array(values, dtype='int64')
+    elif isinstance(field, BooleanField) and None not in values:
+        return array(values, dtype='bool')
+    elif isinstance(field, CharField) and field.choices and categorical:
+        categories = [choice for choice, _ in field.choices]
+        categories += sorted(set(values) - set(categories) - {None})
+        return Categorical(values, categories=categories)
+    else:
+        return array(values, dtype='object')
+
+
+def computed_column(model_cls, df, field):
+    computed_fields = getattr(model_cls, 'COMPUTED_FIELDS', {})
+    if field in computed_fields:
+        source_field, method_name = computed_fields[field]
+        method = getattr(model_cls, method_name)
+        source = df[source_field].astype('object')
+        mapping = {value: method(value) for value in source.unique()}
+        return source.map(mapping).values
+    else:
+        records = df[[f.name for f in model_cls._meta.concrete_fields]].to_dict(orient='records')
+        return array([getattr(model_cls(**record), field) for record in records], dtype='object')
+
+
+def fetch_rows(query_set):
+    '''
+    Run the query on a plain cursor, skipping the per value conversions done by the ORM
+    '''
+    try:
+        sql, params = query_set.query.get_compiler(query_set.db).as_sql()
+    except EmptyResultSet:
+        return []
+    with connections[query_set.db].cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def read_dataframe(query_set, *additional_fields, categorical=True):
+    '''
+    Build a DataFrame from a single values_list query instead of model instances
+    :param query_set: QuerySet of any model in this module
+    :param additional_fields: properties to add, vectorised when listed in the model's COMPUTED_FIELDS
+    :param categorical: enum backed CharFields are returned as categoricals
+    :return: DataFrame with one typed column per concrete field
+    '''
+    model_cls = query_set.model
+    fields = model_cls._meta.concrete_fields
+    names = [field.name for field in fields]
+    rows = fetch_rows(query_set.values_list(*names))
+    columns = list(zip(*rows)) if len(rows) > 0 else [()] * len(fields)
+    data = {field.name: column_array(field, values, categorical) for field, values in zip(fields, columns)}
+    df = DataFrame(data)
+    for field in additional_fields:
+        df.loc[:, field] = computed_column(model_cls, df, field)
+    return df
+
+
 def to_dataframe(models, *additional_fields):
+    if isinstance(models, QuerySet):
+        return read_dataframe(models, *additional_fields, categorical=False)
     records = []
     for model in models:
         as_dict = to_dict(model)
@@ -68,7 +135,11 @@ bulk_update_fields = {'FundClassification': ['fund', 'index', 'fx', 'has_currenc
                       'Transaction': ['custodian', 'owner', 'group', 'transaction_time',
                                                 'value_date', 'symbol', 'currency', 'transaction_type', 'asset_type'],
                       'Price': ['time', 'source', 'symbol', 'resolution', 'asset_type', 'aspect', 'price_type'],
-                      'Universe': ['symbol', 'as_of']}
+                      'Bar': ['time', 'source', 'symbol', 'resolution', 'price_type'],
+                      'Universe': ['symbol', 'as_of'],
+                      'SignalSnapshot': ['time', 'index'],
+                      'FundRegression': ['date', 'fund', 'index', 'fx', 'has_currency_hedge', 'index_offset',
+                                         'fx_time', 'window']}
 
 
 def update_unique(cls_name, d, unique_fields=None):
@@ -106,6 +177,48 @@ class Price(Model):
     class Meta:
         constraints = [UniqueConstraint(name='unique_price',
                                         fields=bulk_update_fields['Price'])]
+        # symbol leads with a pattern opclass so PostgreSQL can also use it for symbol__startswith
+        indexes = [Index(name='price_symbol_res_aspect_time', fields=['symbol', 'resolution', 'aspect', 'time'],
+                         opclasses=['varchar_pattern_ops', 'text_ops', 'text_ops', 'timestamptz_ops']),
+                   Index(name='price_as_of_source_type', fields=['as_of', 'source', 'asset_type', 'symbol'])]
+
+
+class Bar(Model):
+    as_of = DateTimeField()
+    time = DateTimeField(db_index=True)
+    source = CharField(max_length=20, choices=Source.choices())
+    symbol = CharField(validators=[MinLengthValidator(3)], max_length=30, db_index=True)
+    resolution = CharField(max_length=20, choices=Resolution.choices(), default=Resolution.choices()[0][0], db_index=True)
+    asset_type = CharField(max_length=20, choices=AssetType.choices(), default=AssetType.choices()[0][0])
+    price_type = CharField(max_length=20, choices=PriceType.choices(), default=PriceType.choices()[0][0], db_index=True)
+    open = FloatField(null=True)
+    high = FloatField(null=True)
+    low = FloatField(null=True)
+    close = FloatField(null=True)
+    volume = FloatField(null=True)
+
+    class Meta:
+        constraints = [UniqueConstraint(name='unique_bar',
+                                        fields=bulk_update_fields['Bar'])]
+        indexes = [Index(name='bar_symbol_res_time', fields=['symbol', 'resolution', 'time'],
+                         opclasses=['varchar_pattern_ops', 'text_ops', 'timestamptz_ops'])]
+
+
+class SignalSnapshot(Model):
+    time = DateTimeField(db_index=True)
+    index = CharField(max_length=20)
+    future = CharField(max_length=30)
+    future_price = FloatField(null=True)
+    index_price = FloatField(null=True)
+    fair_spread = FloatField(null=True)
+    quote_time = DateTimeField(null=True)
+    gross_signal = FloatField(null=True)
+    net_signal = FloatField(null=True)
+
+    class Meta:
+        constraints = [UniqueConstraint(name='unique_signal_snapshot',
+                                        fields=bulk_update_fields['SignalSnapshot'])]
+        indexes = [Index(name='signal_snapshot_index_time', fields=['index', 'time'])]
 
 
 class Universe(Model):
@@ -193,6 +306,8 @@ class CashMovement(Model):
         constraints = [UniqueConstraint(name='unique_cash_movement',
                                         fields=bulk_update_fields['CashMovement'])]
 
+    COMPUTED_FIELDS = {'classification': ('description', '_classification')}
+
     @staticmethod
     def _classification(description):
         if description[:7] in ['Subscr.', 'Repurch']:
@@ -276,3 +391,27 @@ class FundClassification(Model):
     class Meta:
         constraints = [UniqueConstraint(name='unique_fund_classification',
                                         fields=bulk_update_fields['FundClassification'])]
+
+
+class FundRegression(Model):
+    # inputs, window 0 is an expanding window
+    date = DateField()
+    fund = CharField(max_length=50)
+    index = CharField(max_length=50)
+    fx = CharField(max_length=50)
+    has_currency_hedge = BooleanField()
+    index_offset = IntegerField()
+    fx_time = TimeField()
+    window = IntegerField()
+    # outputs
+    beta = FloatField()
+    # the squared correlation, FundClassification.rsq holds the signed correlation
+    r_squared = FloatField(null=True)
+    residual_vol = FloatField(null=True)
+    observations = IntegerField()
+    as_of = DateTimeField()
+
+    class Meta:
+        constraints = [UniqueConstraint(name='unique_fund_regression',
+                                        fields=bulk_update_fields['FundRegression'])]
+        indexes = [Index(name='fund_regression_fund_date', fields=['fund', 'date'])]
@@ -1,11 +1,12 @@
 from django.shortcuts import render
+from django.urls import reverse
 from django.views.generic import TemplateView
 from django.views.generic.list import ListView
 from django.views.generic.edit import FormView
 from django.contrib.auth.mixins import LoginRequiredMixin
-from trading.fund_classifier import calculate_fund_classification
+from trading.fund_classifier import calculate_fund_classification, val_time_search_by_correlation
 
-from trading.mft import signal_data, contract_information
+from trading.mft import signal_data, cached_contract_information
 from pandas import DataFrame
 from trading.research.mft_backtest import get_latest_sim_result
 
@@ -14,7 +15,9 @@ from data.parse import FileParser
 
 from abc import abstractmethod
 from datetime import datetime
+from math import isnan
 from app.cache import cache_result
+from data.http.exante import ExanteClient
 
 from app.forms import FundClassificationForm
 
@@ -62,6 +65,8 @@ class TableView(LoginRequiredMixin, ListView):
     table_id_2 = "dataTableTwo"
     title = ""
     caption = ""
+    live_topic = None
+    live_key = None
 
     def get_queryset(self):
         return None
@@ -74,6 +79,10 @@ class TableView(LoginRequiredMixin, ListView):
         context["table"] = self.get_html_table()
         context["title"] = self.title
         context["caption"] = self.caption
+        if self.live_topic is not None:
+            context["live_url"] = reverse('live_events', args=['live']) + '?topics=' + self.live_topic
+            context["live_topic"] = self.live_topic
+            context["live_key"] = self.live_key
         return context
 
     @abstractmethod
@@ -91,11 +100,14 @@ class TableView(LoginRequiredMixin, ListView):
                           index=False)
 
 
-@cache_result(24 * 60 * 60, validate=lambda x: x != float('nan'))
+# short fallback for deployments where run_quote_subscriber is not running and every call polls Exante
+@cache_result(ExanteClient.QUOTE_MAX_AGE_S, validate=lambda x: not isnan(x))
 def get_vix():
-    from data.http.exante import ExanteClient
-    exante_client = ExanteClient.create(status="live")
-    data = exante_client.latest_price('VIX.INDEX')
+    '''
+    :return: the VIX bid/ask mid while the quote subscriber streams it, else the last one minute bar close
+    '''
+    from trading.mft import get_exante_client
+    data = get_exante_client().latest_price('VIX.INDEX')
     return data['close']
 
 
@@ -110,6 +122,8 @@ class SignalsView(TableView):
                   "Net Signal": percentage_formatter}
     title = "Signals"
     caption = "Signals per index"
+    live_topic = 'signals'
+    live_key = 'Index'
     threshold_caption = 'Vol-scaled thresholds based on sim optimisation'
 
     @staticmethod
@@ -163,10 +177,12 @@ class ContractsView(TableView):
     columns = ["Name", "Country", "Exchange", "Exante ID", "Currency", "Expiration", "Contract Size (£)", "As Of"]
     formatters = {"Contract Size (£)": float_formatter}
     title = "Futures Contracts"
-    caption = "Refresh the page to calculate contract size again"
+    caption = "Contract sizes update live"
+    live_topic = 'contracts'
+    live_key = 'Exante ID'
 
     def get_dataframe(self):
-        return contract_information()
+        return cached_contract_information()
 
 
 class ModelView(TableView):
@@ -216,13 +232,29 @@ class FundClassifierView(LoginRequiredMixin, FormView):
                                                         'div': div,
                                                         'script': script,
                                                         'geo': self.geo})
+        elif 'search' in request.POST:
+            _mutable = fund_classification.data._mutable
+            fund_classification.data._mutable = True
+            fund_classification.is_valid()
+            data = fund_classification.clean()
+            ranked = val_time_search_by_correlation(data['fund'], data['index'], data['fx'], data['start_date'],
+                                                    data['end_date'], include_holidays=data['include_holidays'],
+                                                    save=False, max_workers=0)
+            best = ranked.iloc[0]
+            fund_classification.data['index_offset'] = int(best['index_offset'])
+            fund_classification.data['has_currency_hedge'] = bool(best['has_currency_hedge'])
+            fund_classification.data['fx_time'] = best['fx_time'].strftime('%H:%M')
+            fund_classification.data['rsq'] = floor(best['rsq']*100)/100
+            fund_classification.data['beta'] = floor(best['beta']*100)/100
+            fund_classification.data._mutable = _mutable
+            return render(request, self.template_name, {'form': fund_classification, 'geo': self.geo})
         elif 'save' in request.POST:
             obj = fund_classification.save(commit=False)
             obj.as_of = datetime.now()
             obj.save()
             return render(request, self.template_name, {'form': fund_classification, 'geo': self.geo})
         else:
-            raise ValueError('FundClassifierView: can only calculate or save in this view')
+            raise ValueError('FundClassifierView: can only calculate, search or save in this view')
 
 
 class FundClassifierViewUS(FundClassifierView):
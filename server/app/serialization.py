@@ -0,0 +1,101 @@
+import pickle
+from collections import namedtuple, OrderedDict
+from time import perf_counter
+
+import pyarrow
+from pandas import DataFrame, Series
+
+ARROW = 'arrow'
+PICKLE = 'pickle'
+SERIES_COLUMN = '__series__'
+MAX_TRACKED_KEYS = 1000
+
+EncodedValue = namedtuple('EncodedValue', ['format', 'kind', 'name', 'data'])
+
+# key: {'format', 'bytes', 'encode_s', 'decode_s'} for the most recently written keys
+serialization_stats = OrderedDict()
+
+
+def compression():
+    for codec in ['zstd', 'lz4']:
+        if pyarrow.Codec.is_available(codec):
+            return codec
+    return None
+
+
+def has_arrow_names(df: DataFrame):
+    names = list(df.columns) + [name for name in df.index.names if name is not None]
+    return all(isinstance(name, str) for name in names) and len(set(df.columns)) == len(df.columns)
+
+
+def to_arrow_bytes(df: DataFrame):
+    table = pyarrow.Table.from_pandas(df, preserve_index=True)
+    sink = pyarrow.BufferOutputStream()
+    options = pyarrow.ipc.IpcWriteOptions(compression=compression())
+    with pyarrow.ipc.new_stream(sink, table.schema, options=options) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def from_arrow_bytes(data):
+    with pyarrow.ipc.open_stream(pyarrow.py_buffer(data)) as reader:
+        return reader.read_all().to_pandas()
+
+
+def encode_frame(value):
+    if isinstance(value, Series):
+        if value.name is not None and not isinstance(value.name, str):
+            return None
+        df = value.to_frame(SERIES_COLUMN)
+    else:
+        df = value
+    if not has_arrow_names(df):
+        return None
+    try:
+        data = to_arrow_bytes(df)
+    except (pyarrow.ArrowException, TypeError, ValueError):
+        return None
+    return EncodedValue(ARROW, type(value).__name__, getattr(value, 'name', None), data)
+
+
+def record(key, **kwargs):
+    if key is None:
+        return
+    serialization_stats.setdefault(key, {}).update(kwargs)
+    serialization_stats.move_to_end(key)
+    while len(serialization_stats) > MAX_TRACKED_KEYS:
+        serialization_stats.popitem(last=False)
+
+
+def encode(value, key=None):
+    '''
+    Serialize DataFrames and Series as compressed Arrow IPC streams, anything else with pickle
+    :param key: cache key the size and timing are recorded under
+    :return: EncodedValue
+    '''
+    start = perf_counter()
+    encoded = None
+    if isinstance(value, (DataFrame, Series)):
+        encoded = encode_frame(value)
+    if encoded is None:
+        encoded = EncodedValue(PICKLE, type(value).__name__, None, pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+    record(key, format=encoded.format, bytes=len(encoded.data), encode_s=perf_counter() - start)
+    return encoded
+
+
+def decode(encoded, key=None):
+    '''
+    :param encoded: EncodedValue, anything else is returned unchanged
+    '''
+    if not isinstance(encoded, EncodedValue):
+        return encoded
+    start = perf_counter()
+    if encoded.format == ARROW:
+        value = from_arrow_bytes(encoded.data)
+        if encoded.kind == 'Series':
+            value = value[SERIES_COLUMN].rename(encoded.name)
+    else:
+        value = pickle.loads(encoded.data)
+    if key in serialization_stats:
+        record(key, decode_s=perf_counter() - start)
+    return value
@@ -0,0 +1,87 @@
+from datetime import time
+from functools import reduce
+from operator import or_
+
+from django.db.models import Q
+from numpy import arange, flatnonzero, full, split, timedelta64
+from pandas import DatetimeIndex, Timestamp
+
+FREQUENCY_MINUTES = 5
+
+MINUTES_PER_DAY = 24 * 60
+
+
+def minutes_of_day(time_of_day):
+    '''
+    :param time_of_day: datetime.time or a string such as '12:00:00' or '12:00'
+    '''
+    t = time.fromisoformat(str(time_of_day))
+    return t.hour * 60 + t.minute
+
+
+def time_of_day(minutes):
+    minutes = int(minutes) % MINUTES_PER_DAY
+    return time(minutes // 60, minutes % 60)
+
+
+def window_minutes(start_time, end_time=None):
+    '''
+    :return: (start, end) minutes from midnight, end past MINUTES_PER_DAY when the window crosses midnight
+    '''
+    start_minutes = minutes_of_day(start_time)
+    end_minutes = start_minutes if end_time is None else minutes_of_day(end_time)
+    return start_minutes, end_minutes + (MINUTES_PER_DAY if end_minutes < start_minutes else 0)
+
+
+def time_slices(start_date, end_date, start_time, end_time=None, timezone='Europe/London',
+                frequency_minutes=FREQUENCY_MINUTES):
+    '''
+    Every frequency_minutes time from start_time to end_time included, through midnight if end_time is earlier,
+    start_time only if end_time is None, in timezone on every day from start_date to end_date, generated as
+    datetime64 arrays without a full date_range
+    Times which do not exist when the clocks go forward are skipped, both occurrences are kept when they go back
+    :param start_date: first time included, e.g. '2019-04-01'
+    :param end_date: last time included, e.g. '2019-05-31' which ends at midnight like get_time_slices always did
+    :return: sorted UTC DatetimeIndex
+    '''
+    first, last = Timestamp(start_date).to_datetime64(), Timestamp(end_date).to_datetime64()
+    start_minutes, end_minutes = window_minutes(start_time, end_time)
+    minutes = arange(start_minutes, end_minutes + 1, frequency_minutes).astype('timedelta64[m]')
+    # a window across midnight starts on the day before
+    days = arange(first.astype('datetime64[D]') - timedelta64(1 if end_minutes >= MINUTES_PER_DAY else 0, 'D'),
+                  last.astype('datetime64[D]') + timedelta64(1, 'D'))
+    local = (days.astype('datetime64[m]')[:, None] + minutes[None, :]).ravel()
+    local = DatetimeIndex(local[(local >= first) & (local <= last)])
+    if timezone == 'UTC':
+        return local.tz_localize('UTC')
+    summer = local.tz_localize(timezone, ambiguous=full(len(local), True), nonexistent='NaT')
+    winter = local.tz_localize(timezone, ambiguous=full(len(local), False), nonexistent='NaT')
+    return summer.append(winter).dropna().unique().sort_values().tz_convert('UTC')
+
+
+def time_of_day_q(start_date, end_date, start_time, end_time=None, timezone='Europe/London', field='time'):
+    '''
+    Filter for the times of time_slices, as one date range and time of day range per period in which timezone
+    keeps the same UTC offset, instead of a list of every time. Rows are expected on the frequency_minutes grid,
+    e.g. five minute bars.
+    :param field: DateTimeField to filter
+    :return: Q object
+    '''
+    slices = time_slices(start_date, end_date, start_time, end_time, timezone)
+    if len(slices) == 0:
+        return Q(pk__in=[])
+    utc = slices.tz_localize(None).values
+    offsets = (slices.tz_convert(timezone).tz_localize(None).values - utc).astype('timedelta64[m]').astype(int)
+    start_minutes, end_minutes = window_minutes(start_time, end_time)
+    predicates = []
+    for period in split(arange(len(utc)), flatnonzero(offsets[1:] != offsets[:-1]) + 1):
+        offset = offsets[period[0]]
+        first_time, last_time = time_of_day(start_minutes - offset), time_of_day(end_minutes - offset)
+        period_range = Q(**{field + '__range': (slices[period[0]], slices[period[-1]])})
+        if first_time <= last_time:
+            time_range = Q(**{field + '__time__range': (first_time, last_time)})
+        else:
+            # the window crosses midnight UTC
+            time_range = Q(**{field + '__time__gte': first_time}) | Q(**{field + '__time__lte': last_time})
+        predicates.append(period_range & time_range)
+    return reduce(or_, predicates)
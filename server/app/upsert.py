@@ -0,0 +1,158 @@
+from django.db import connections, transaction
+from pandas import DataFrame
+
+import app.models
+from app.models import bulk_update_fields, to_models
+
+UPSERT_BATCH_SIZE = 5000
+STAGE_TABLE = 'upsert_stage'
+
+
+def upsert_keys(model_cls_name, df: DataFrame):
+    '''
+    Split the rows by the fields used to find their existing counterpart, the same way update_unique does
+    :return: list of (key fields, rows) tuples
+    '''
+    key = [field for field in bulk_update_fields.get(model_cls_name, []) if field in df.columns]
+    if 'unique' not in df.columns:
+        return [(key, df)]
+    has_unique = df['unique'].notnull() & (df['unique'] != '')
+    groups = [(['unique'], df[has_unique]), (key, df[~has_unique])]
+    return [(key, rows) for key, rows in groups if len(rows.index) > 0]
+
+
+def is_full_key(model_cls, key):
+    if key == ['unique']:
+        return True
+    constraints = [list(constraint.fields) for constraint in model_cls._meta.constraints]
+    return key in constraints
+
+
+def db_rows(objs, fields, connection):
+    return [[field.get_db_prep_save(getattr(obj, field.attname), connection) for field in fields] for obj in objs]
+
+
+def equals(connection, field, left, right):
+    column = connection.ops.quote_name(field.column)
+    if not field.null:
+        return left + '.' + column + ' = ' + right + '.' + column
+    elif connection.vendor == 'sqlite':
+        return left + '.' + column + ' IS ' + right + '.' + column
+    else:
+        return left + '.' + column + ' IS NOT DISTINCT FROM ' + right + '.' + column
+
+
+def differs(connection, field, left, right):
+    column = connection.ops.quote_name(field.column)
+    if connection.vendor == 'sqlite':
+        return left + '.' + column + ' IS NOT ' + right + '.' + column
+    else:
+        return left + '.' + column + ' IS DISTINCT FROM ' + right + '.' + column
+
+
+def insert_on_conflict(model_cls, connection, fields, key_fields, update_fields, rows, update_existing):
+    '''
+    PostgreSQL: INSERT ... ON CONFLICT, returning one row per inserted or changed record
+    :return: (inserted, updated)
+    '''
+    quote = connection.ops.quote_name
+    table = quote(model_cls._meta.db_table)
+    columns = ', '.join(quote(field.column) for field in fields)
+    values = ', '.join(['(' + ', '.join(['%s'] * len(fields)) + ')'] * len(rows))
+    sql = 'INSERT INTO ' + table + ' (' + columns + ') VALUES ' + values
+    if update_existing and len(update_fields) > 0:
+        conflict = ', '.join(quote(field.column) for field in key_fields)
+        assignments = ', '.join(quote(f.column) + ' = EXCLUDED.' + quote(f.column) for f in update_fields)
+        changed = ' OR '.join(differs(connection, f, table, 'EXCLUDED') for f in update_fields)
+        sql += ' ON CONFLICT (' + conflict + ') DO UPDATE SET ' + assignments + ' WHERE ' + changed
+    else:
+        sql += ' ON CONFLICT DO NOTHING'
+    sql += ' RETURNING (xmax = 0)'
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [value for row in rows for value in row])
+        flags = [inserted for inserted, in cursor.fetchall()]
+    inserted = sum(flags)
+    return inserted, len(flags) - inserted
+
+
+def merge_staged(model_cls, connection, fields, key_fields, update_fields, rows, save_new, update_existing):
+    '''
+    Stage the rows in a temporary table indexed on the key, then update the changed matches with UPDATE ... FROM
+    (SQLite 3.33 or later and PostgreSQL) and insert the rest in one statement each
+    :return: (inserted, updated)
+    '''
+    quote = connection.ops.quote_name
+    table = quote(model_cls._meta.db_table)
+    stage = quote(STAGE_TABLE)
+    columns = ', '.join(quote(field.column) for field in fields)
+    match = ' AND '.join(equals(connection, field, table, stage) for field in key_fields)
+    inserted, updated = 0, 0
+    with connection.cursor() as cursor:
+        cursor.execute('DROP TABLE IF EXISTS ' + stage)
+        cursor.execute('CREATE TEMPORARY TABLE ' + stage + ' AS SELECT ' + columns + ' FROM ' + table + ' WHERE 1 = 0')
+        cursor.executemany('INSERT INTO ' + stage + ' (' + columns + ') VALUES (' + ', '.join(['%s'] * len(fields)) + ')',
+                           rows)
+        if len(key_fields) > 0:
+            # rows are unique on the key, so either side of the joins below can be looked up instead of scanned
+            cursor.execute('CREATE UNIQUE INDEX ' + quote(STAGE_TABLE + '_key') + ' ON ' + stage + ' (' +
+                           ', '.join(quote(field.column) for field in key_fields) + ')')
+        if update_existing and len(key_fields) > 0 and len(update_fields) > 0:
+            assignments = ', '.join(quote(f.column) + ' = ' + stage + '.' + quote(f.column) for f in update_fields)
+            changed = ' OR '.join(differs(connection, f, table, stage) for f in update_fields)
+            cursor.execute('UPDATE ' + table + ' SET ' + assignments + ' FROM ' + stage + ' WHERE ' + match +
+                           ' AND (' + changed + ')')
+            updated = cursor.rowcount
+        if save_new:
+            select = 'SELECT ' + columns + ' FROM ' + stage
+            if len(key_fields) > 0:
+                select += ' WHERE NOT EXISTS (SELECT 1 FROM ' + table + ' WHERE ' + match + ')'
+            if connection.vendor == 'sqlite':
+                cursor.execute('INSERT OR IGNORE INTO ' + table + ' (' + columns + ') ' + select)
+            else:
+                cursor.execute('INSERT INTO ' + table + ' (' + columns + ') ' + select + ' ON CONFLICT DO NOTHING')
+            inserted = cursor.rowcount
+        cursor.execute('DROP TABLE ' + stage)
+    return inserted, updated
+
+
+def bulk_upsert(model_cls_name, df: DataFrame, save_new=True, update_existing=True, batch_size=UPSERT_BATCH_SIZE):
+    '''
+    Insert new rows and update existing ones with set based statements instead of a query per row
+    Rows are matched on 'unique' where it is set, otherwise on the bulk_update_fields present in df
+    :param model_cls_name: name of a model in app.models
+    :param df: DataFrame with model field columns
+    :param save_new: insert rows which do not exist yet
+    :param update_existing: overwrite the columns present in df on matching rows
+    :param batch_size: rows per statement
+    :return: (objs, counts) where counts has the number of inserted, updated and unchanged rows
+    '''
+    model_cls = getattr(app.models, model_cls_name)
+    objs, cols = to_models(model_cls, df)
+    counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+    if not save_new and not update_existing:
+        return objs, counts
+    connection = connections[model_cls.objects.db]
+    fields = [field for field in model_cls._meta.concrete_fields if not field.primary_key]
+    by_name = {field.name: field for field in fields}
+    df = df[cols].reset_index(drop=True)
+    for key, rows in upsert_keys(model_cls_name, df):
+        key_fields = [by_name[name] for name in key]
+        update_fields = [by_name[name] for name in cols if name not in key]
+        if len(key) > 0:
+            rows = rows.drop_duplicates(subset=key, keep='last')
+        use_on_conflict = connection.vendor == 'postgresql' and save_new and \
+            (not update_existing or is_full_key(model_cls, key))
+        for start in range(0, len(rows.index), batch_size):
+            batch = rows.iloc[start:start + batch_size]
+            values = db_rows([objs[i] for i in batch.index], fields, connection)
+            with transaction.atomic(using=model_cls.objects.db):
+                if use_on_conflict:
+                    inserted, updated = insert_on_conflict(model_cls, connection, fields, key_fields, update_fields,
+                                                           values, update_existing)
+                else:
+                    inserted, updated = merge_staged(model_cls, connection, fields, key_fields, update_fields,
+                                                     values, save_new, update_existing)
+            counts['inserted'] += inserted
+            counts['updated'] += updated
+    counts['unchanged'] = len(objs) - counts['inserted'] - counts['updated']
+    return objs, counts
@@ -35,6 +35,7 @@ urlpatterns = [
     path('api/<str:status>/<str:response_type>/model', handle_json_model, name='handle_json_model'),
     path("api/<str:status>/<str:response_type>/prices/recent/fund/<str:isin>/<str:currency>/", api_views.recent_fund_prices, name="recent_fund_prices"),
     path("api/<str:status>/<str:response_type>/signals", api_views.signals, name="signals"),
+    path("api/<str:status>/events/live", api_views.live_events, name="live_events"),
     path("api/<str:status>/<str:response_type>/reyl_cash_movements", api_views.reyl_cash_movements, name="reyl_cash_movements"),
     path("api/<str:status>/<str:response_type>/reyl_transactions", api_views.reyl_transactions, name="reyl_transactions"),
     path("api/<str:status>/<str:response_type>/reyl_cash_movement_summary", api_views.reyl_cash_movement_summary, name="reyl_cash_movement_summary"),
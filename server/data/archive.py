@@ -0,0 +1,266 @@
+import json
+from os import listdir, makedirs
+from os.path import join, isdir, isfile, splitext
+from urllib.parse import quote, unquote
+
+import pyarrow
+import pyarrow.parquet as parquet
+from django.conf import settings
+from django.db.models import FloatField, Max, Q
+from pandas import DataFrame, Timestamp, concat
+
+import app.models
+from app.models import field_names, bulk_update_fields
+
+ROW_GROUP_SIZE = 10000
+SYNC_BATCH_SIZE = 100000
+STATE_FILE = '_sync.json'
+TIME_FIELD = 'time'
+PARTITION_FIELD = 'symbol'
+ARCHIVE_OPERATORS = {'exact': '==', 'in': 'in', 'gte': '>=', 'gt': '>', 'lte': '<=', 'lt': '<'}
+
+
+def archive_root(root=None):
+    if root is None:
+        root = settings.PRICE_ARCHIVE_DIR
+    return root
+
+
+def archive_dir(model_cls_name, root=None):
+    return join(archive_root(root), model_cls_name)
+
+
+def partition_path(model_cls_name, symbol, month, root=None):
+    return join(archive_dir(model_cls_name, root), quote(symbol, safe=' '), month + '.parquet')
+
+
+def archive_columns(model_cls_name):
+    model_cls = getattr(app.models, model_cls_name)
+    return ['id'] + field_names(model_cls)
+
+
+def coerce_types(model_cls_name, df):
+    model_cls = getattr(app.models, model_cls_name)
+    for field in model_cls._meta.get_fields():
+        if isinstance(field, FloatField):
+            df.loc[:, field.name] = df[field.name].astype(float)
+    return df
+
+
+def as_utc(value):
+    timestamp = Timestamp(value)
+    if timestamp.tz is None:
+        return timestamp.tz_localize('UTC')
+    return timestamp.tz_convert('UTC')
+
+
+def parse_filter_criteria(**filter_criteria):
+    '''
+    Split Django style filters into (field, lookup, value) tuples
+    :param filter_criteria: e.g. symbol__in=[...], time__gte=...
+    :return: list of tuples, time values converted to UTC timestamps
+    '''
+    criteria = []
+    for key, value in filter_criteria.items():
+        field, _, lookup = key.partition('__')
+        lookup = lookup or 'exact'
+        if field == TIME_FIELD:
+            if lookup in ['in', 'range']:
+                value = [as_utc(v) for v in value]
+            else:
+                value = as_utc(value)
+        criteria.append((field, lookup, value))
+    return criteria
+
+
+def matches(value, lookup, criterion):
+    if lookup == 'exact':
+        return value == criterion
+    elif lookup == 'in':
+        return value in criterion
+    elif lookup == 'startswith':
+        return value.startswith(criterion)
+    else:
+        raise ValueError('archive: unsupported lookup ' + lookup + ' on ' + PARTITION_FIELD)
+
+
+def month_bounds(criteria):
+    lower, upper, months = None, None, None
+    for field, lookup, value in criteria:
+        if field != TIME_FIELD:
+            continue
+        if lookup in ['gte', 'gt']:
+            lower = value
+        elif lookup in ['lte', 'lt']:
+            upper = value
+        elif lookup == 'range':
+            lower, upper = value
+        elif lookup == 'exact':
+            months = {value.strftime('%Y-%m')}
+        elif lookup == 'in':
+            months = {v.strftime('%Y-%m') for v in value}
+    lower = None if lower is None else lower.strftime('%Y-%m')
+    upper = None if upper is None else upper.strftime('%Y-%m')
+    return lower, upper, months
+
+
+def prune_files(model_cls_name, criteria, root=None):
+    '''
+    Select the partition files that can hold rows matching the criteria
+    '''
+    path = archive_dir(model_cls_name, root)
+    if not isdir(path):
+        return []
+    symbol_criteria = [(lookup, value) for field, lookup, value in criteria if field == PARTITION_FIELD]
+    lower, upper, months = month_bounds(criteria)
+    files = []
+    for symbol_dir in sorted(listdir(path)):
+        symbol = unquote(symbol_dir)
+        if not isdir(join(path, symbol_dir)):
+            continue
+        if not all(matches(symbol, lookup, value) for lookup, value in symbol_criteria):
+            continue
+        for file_name in sorted(listdir(join(path, symbol_dir))):
+            month, ext = splitext(file_name)
+            if ext != '.parquet':
+                continue
+            if lower is not None and month < lower:
+                continue
+            if upper is not None and month > upper:
+                continue
+            if months is not None and month not in months:
+                continue
+            files.append(join(path, symbol_dir, file_name))
+    return files
+
+
+def row_filters(criteria):
+    '''
+    Translate the criteria into pyarrow filters so row groups are skipped using the parquet statistics
+    '''
+    filters = []
+    for field, lookup, value in criteria:
+        if field == PARTITION_FIELD and lookup == 'startswith':
+            continue
+        if lookup == 'range':
+            filters += [(field, '>=', value[0]), (field, '<=', value[1])]
+        elif lookup in ARCHIVE_OPERATORS:
+            if lookup == 'in':
+                value = list(value)
+            filters.append((field, ARCHIVE_OPERATORS[lookup], value))
+        elif lookup != 'startswith':
+            raise ValueError('archive: unsupported lookup ' + lookup)
+    return filters
+
+
+def read_table(model_cls_name, root=None, **filter_criteria):
+    criteria = parse_filter_criteria(**filter_criteria)
+    files = prune_files(model_cls_name, criteria, root)
+    filters = row_filters(criteria) or None
+    tables = [parquet.read_table(file, filters=filters) for file in files]
+    tables = [table for table in tables if table.num_rows > 0]
+    if len(tables) == 0:
+        return None
+    return pyarrow.concat_tables(tables)
+
+
+def read_archive(model_cls_name, root=None, **filter_criteria):
+    '''
+    Read archived rows as a DataFrame, pruning symbol/month files and parquet row groups on the way
+    :param model_cls_name: 'Price' or 'Bar'
+    :param filter_criteria: a subset of the Django lookups: exact, in, gte, gt, lte, lt, range and startswith
+    :return: DataFrame with the same columns as read_frame on the model
+    '''
+    table = read_table(model_cls_name, root, **filter_criteria)
+    columns = archive_columns(model_cls_name)
+    if table is None:
+        return DataFrame(columns=columns)
+    df = table.to_pandas()
+    for field, lookup, value in parse_filter_criteria(**filter_criteria):
+        if lookup == 'startswith' and field != PARTITION_FIELD:
+            df = df[df[field].str.startswith(value)]
+    return df[columns].sort_values(['symbol', TIME_FIELD]).reset_index(drop=True)
+
+
+def read_archived_prices(**filter_criteria):
+    return read_archive('Price', **filter_criteria)
+
+
+def read_archived_bars(**filter_criteria):
+    df = read_archive('Bar', **filter_criteria)
+    return df.drop('id', axis='columns').set_index(TIME_FIELD).sort_index()
+
+
+def read_state(root=None):
+    path = join(archive_root(root), STATE_FILE)
+    if not isfile(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_state(state, root=None):
+    with open(join(archive_root(root), STATE_FILE), 'w') as f:
+        json.dump(state, f)
+
+
+def write_partition(model_cls_name, symbol, month, df, root=None):
+    path = partition_path(model_cls_name, symbol, month, root)
+    if isfile(path):
+        df = concat([parquet.read_table(path).to_pandas(), df], ignore_index=True, sort=False)
+    df = df.drop_duplicates(subset=bulk_update_fields[model_cls_name], keep='last')
+    df = df.sort_values(TIME_FIELD).reset_index(drop=True)
+    makedirs(join(archive_dir(model_cls_name, root), quote(symbol, safe=' ')), exist_ok=True)
+    table = pyarrow.Table.from_pandas(df, preserve_index=False)
+    parquet.write_table(table, path, row_group_size=ROW_GROUP_SIZE)
+
+
+def write_partitions(model_cls_name, df, root=None):
+    months = df[TIME_FIELD].dt.strftime('%Y-%m')
+    for (symbol, month), partition_df in df.groupby([df[PARTITION_FIELD], months]):
+        write_partition(model_cls_name, symbol, month, partition_df, root)
+
+
+def sync_state(state, model_cls_name):
+    '''
+    :return: (id of the last row exported, latest as_of when the last sync started or None)
+    '''
+    model_state = state.get(model_cls_name, {})
+    if not isinstance(model_state, dict):
+        # state written before updates were tracked
+        return model_state, None
+    as_of = model_state.get('as_of')
+    return model_state.get('id', 0), None if as_of is None else Timestamp(as_of)
+
+
+def sync_archive(model_cls_name='Price', root=None, batch_size=SYNC_BATCH_SIZE):
+    '''
+    Append the rows created since the last sync to the archive, and rewrite the rows updated since, which bulk_upsert
+    marks with a later as_of. Updated rows replace their archived version in write_partition.
+    :return: number of rows exported
+    '''
+    model_cls = getattr(app.models, model_cls_name)
+    columns = archive_columns(model_cls_name)
+    makedirs(archive_root(root), exist_ok=True)
+    state = read_state(root)
+    last_id, last_as_of = sync_state(state, model_cls_name)
+    # rows written while this sync runs are picked up by the next one
+    as_of = model_cls.objects.aggregate(as_of=Max('as_of'))['as_of']
+    changed = Q(id__gt=last_id) if last_as_of is None else Q(id__gt=last_id) | Q(as_of__gt=last_as_of)
+    cursor, exported = 0, 0
+    while True:
+        query_set = model_cls.objects.filter(changed, id__gt=cursor).order_by('id').values_list(*columns)[:batch_size]
+        df = DataFrame.from_records(list(query_set), columns=columns)
+        if len(df.index) == 0:
+            break
+        df = coerce_types(model_cls_name, df)
+        write_partitions(model_cls_name, df, root)
+        cursor = int(df['id'].max())
+        last_id = max(last_id, cursor)
+        exported += len(df.index)
+        state[model_cls_name] = {'id': last_id, 'as_of': None if last_as_of is None else last_as_of.isoformat()}
+        write_state(state, root)
+    if as_of is not None:
+        state[model_cls_name] = {'id': last_id, 'as_of': Timestamp(as_of).isoformat()}
+        write_state(state, root)
+    return exported
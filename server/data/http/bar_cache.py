@@ -0,0 +1,156 @@
+import json
+import os
+from os.path import join, isfile
+from threading import Lock
+from time import time
+from urllib.parse import quote
+
+import pyarrow
+import pyarrow.parquet as parquet
+from pandas import DataFrame, concat
+
+TIMESTAMP = 'timestamp'
+LOCK_STRIPES = 64
+
+
+def merge_intervals(intervals):
+    '''
+    :param intervals: (start, end) pairs of inclusive millisecond timestamps
+    :return: sorted, non overlapping intervals, touching ones joined
+    '''
+    merged = []
+    for start, end in sorted(intervals):
+        if len(merged) > 0 and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [tuple(interval) for interval in merged]
+
+
+def subtract_intervals(start, end, covered):
+    '''
+    :return: the parts of [start, end] which are not in the covered intervals
+    '''
+    missing = []
+    for covered_start, covered_end in merge_intervals(covered):
+        if covered_end < start or covered_start > end:
+            continue
+        if covered_start > start:
+            missing.append((start, covered_start - 1))
+        start = max(start, covered_end + 1)
+        if start > end:
+            return missing
+    if start <= end:
+        missing.append((start, end))
+    return missing
+
+
+def write_json(path, value):
+    with open(path, 'w') as f:
+        json.dump(value, f)
+
+
+def merge_records(cached, fetched):
+    '''
+    Combine cached bars with freshly downloaded ones, which win on equal timestamps
+    :return: records latest first
+    '''
+    records = {record[TIMESTAMP]: record for record in cached}
+    records.update({record[TIMESTAMP]: record for record in fetched})
+    return [records[timestamp] for timestamp in sorted(records, reverse=True)]
+
+
+def record_range(records):
+    timestamps = [record[TIMESTAMP] for record in records]
+    return min(timestamps), max(timestamps)
+
+
+class BarCache:
+    '''
+    Exante OHLC bars already downloaded, one parquet file per (symbol, bar length) next to a JSON list of the
+    millisecond ranges it fully covers. Only bars which have closed are recorded as covered, so the forming bar
+    is always downloaded again.
+    '''
+
+    def __init__(self, root=None):
+        if root is None:
+            from django.conf import settings
+            root = settings.EXANTE_BAR_CACHE_DIR
+        self.root = root
+        self.locks = [Lock() for _ in range(LOCK_STRIPES)]
+
+    def lock(self, symbol, bar_length_seconds):
+        return self.locks[hash((symbol, bar_length_seconds)) % LOCK_STRIPES]
+
+    def path(self, symbol, bar_length_seconds, ext):
+        return join(self.root, quote(symbol, safe=' '), str(bar_length_seconds) + ext)
+
+    def coverage(self, symbol, bar_length_seconds):
+        path = self.path(symbol, bar_length_seconds, '.json')
+        if not isfile(path):
+            return []
+        with open(path) as f:
+            return [tuple(interval) for interval in json.load(f)]
+
+    def missing(self, symbol, bar_length_seconds, start_ms, end_ms):
+        '''
+        :return: list of (start, end) millisecond ranges which have to be downloaded
+        '''
+        return subtract_intervals(start_ms, end_ms, self.coverage(symbol, bar_length_seconds))
+
+    def read_frame(self, symbol, bar_length_seconds, filters=None):
+        path = self.path(symbol, bar_length_seconds, '.parquet')
+        if not isfile(path):
+            return DataFrame(columns=[TIMESTAMP])
+        return parquet.read_table(path, filters=filters).to_pandas()
+
+    def read(self, symbol, bar_length_seconds, start_ms, end_ms):
+        '''
+        :return: bars with start_ms <= timestamp <= end_ms as records, latest first like the API
+        '''
+        df = self.read_frame(symbol, bar_length_seconds, [(TIMESTAMP, '>=', start_ms), (TIMESTAMP, '<=', end_ms)])
+        return df.sort_values(TIMESTAMP, ascending=False).to_dict(orient='records')
+
+    def write(self, symbol, bar_length_seconds, records, start_ms, end_ms):
+        '''
+        Store downloaded bars and mark [start_ms, end_ms] as covered up to the last closed bar
+        :param records: bars as returned by the API
+        '''
+        settled_ms = int(time() * 1000) - bar_length_seconds * 1000
+        end_ms = min(end_ms, settled_ms)
+        records = [record for record in records if record[TIMESTAMP] <= settled_ms]
+        with self.lock(symbol, bar_length_seconds):
+            os.makedirs(join(self.root, quote(symbol, safe=' ')), exist_ok=True)
+            if len(records) > 0:
+                df = concat([self.read_frame(symbol, bar_length_seconds), DataFrame.from_records(records)],
+                            ignore_index=True, sort=False)
+                df = df.drop_duplicates(subset=[TIMESTAMP], keep='last').sort_values(TIMESTAMP)
+                df[TIMESTAMP] = df[TIMESTAMP].astype('int64')
+                self.replace(self.path(symbol, bar_length_seconds, '.parquet'),
+                             lambda path: parquet.write_table(pyarrow.Table.from_pandas(df, preserve_index=False),
+                                                              path))
+            if start_ms <= end_ms:
+                coverage = merge_intervals(self.coverage(symbol, bar_length_seconds) + [(start_ms, end_ms)])
+                self.replace(self.path(symbol, bar_length_seconds, '.json'), lambda path: write_json(path, coverage))
+
+    @staticmethod
+    def replace(path, write):
+        '''
+        Write to a temporary file first so readers in other processes never see a partial file
+        '''
+        temporary_path = path + '.' + str(os.getpid()) + '.tmp'
+        write(temporary_path)
+        os.replace(temporary_path, path)
+
+
+bar_cache = None
+
+
+def get_bar_cache():
+    '''
+    :return: the process wide cache in settings.EXANTE_BAR_CACHE_DIR
+    '''
+    global bar_cache
+    if bar_cache is None:
+        bar_cache = BarCache()
+    return bar_cache
@@ -1,28 +1,131 @@
-from concurrent.futures import ThreadPoolExecutor
+import json
+from concurrent.futures import ThreadPoolExecutor, Future
 from datetime import datetime
+from functools import partial
+from random import uniform
+from threading import Lock
+from time import perf_counter, sleep
 from urllib.parse import quote, unquote
 
-from requests import get as http_get
+from requests import Session, RequestException
+from requests.adapters import HTTPAdapter
 from pandas import DataFrame, to_datetime
 
+from data.http.bar_cache import BarCache, merge_records, record_range
+from data.http.quotes import QuoteTable, latest_price_record
+from data.http.rate_limit import rate_limiter
 from utils.cloud_logging import logger
 
 from utils import swallow_and_log_exception
 
+OHLC_COLUMNS = ["timestamp", "open", "high", "low", "close", "volume"]
+
+# size limit of the ohlc endpoint, longer histories are downloaded in windows of this many bars
+MAX_BARS_PER_REQUEST = 5000
+
+
+def ohlc_windows(start_ms: int, end_ms: int, bar_length_seconds: int, max_bars: int = MAX_BARS_PER_REQUEST):
+    '''
+    :return: consecutive (from, to) millisecond windows covering [start_ms, end_ms], each holding at most max_bars
+    '''
+    step = max_bars * bar_length_seconds * 1000
+    return [(start, min(start + step - 1, end_ms)) for start in range(start_ms, end_ms + 1, step)]
+
+
+def range_windows(bar_cache, symbol, bar_length_seconds, start_ms, end_ms, max_bars):
+    if bar_cache is None:
+        ranges = [(start_ms, end_ms)]
+    else:
+        ranges = bar_cache.missing(symbol, bar_length_seconds, start_ms, end_ms)
+    return [window for start, end in ranges for window in ohlc_windows(start, end, bar_length_seconds, max_bars)]
+
+
+def cache_window(bar_cache, symbol, bar_length_seconds, data, start_ms, end_ms, max_bars):
+    '''
+    Store the bars of one window download. The whole window is marked as covered only if the response cannot have
+    been cut at max_bars, i.e. it has fewer bars or every bar the window can hold, else only the span of its bars
+    '''
+    in_window = sum(1 for record in data if start_ms <= record["timestamp"] <= end_ms)
+    if len(data) < max_bars or in_window >= (end_ms - start_ms) // (bar_length_seconds * 1000) + 1:
+        bar_cache.write(symbol, bar_length_seconds, data, start_ms, end_ms)
+    else:
+        bar_cache.write(symbol, bar_length_seconds, data, *record_range(data))
+
+
+def range_frame(bar_cache, symbol, bar_length_seconds, start_ms, end_ms, responses):
+    '''
+    Join the windows of a range download, dropping the bars repeated on window boundaries
+    :return: DataFrame sorted by timestamp, or the first API error
+    '''
+    fetched = []
+    for data in responses:
+        if 'error' in data:
+            return ExanteClient.ohlc_frame(data)
+        fetched += [record for record in data if start_ms <= record["timestamp"] <= end_ms]
+    cached = [] if bar_cache is None else bar_cache.read(symbol, bar_length_seconds, start_ms, end_ms)
+    records = merge_records(cached, fetched)
+    if len(records) == 0:
+        return DataFrame(columns=OHLC_COLUMNS + ["datetime"])
+    df = ExanteClient.ohlc_frame(records)
+    return df.sort_values("timestamp").reset_index(drop=True)
+
+
+class DownloadProgress:
+    '''
+    Counts the windows and bars of a range download
+    '''
+
+    def __init__(self, symbol: str, windows: int, progress=None):
+        self.symbol = symbol
+        self.windows = windows
+        self.progress = progress
+        self.done = 0
+        self.bars = 0
+        self.start = perf_counter()
+        self.lock = Lock()
+
+    def update(self, data):
+        with self.lock:
+            self.done += 1
+            self.bars += 0 if 'error' in data else len(data)
+            done, bars = self.done, self.bars
+        if self.progress is not None:
+            self.progress(done, self.windows, bars)
+
+    def stats(self, rows: int):
+        '''
+        :param rows: bars left once the windows are joined
+        '''
+        elapsed_s = perf_counter() - self.start
+        stats = {"symbol": self.symbol, "windows": self.windows, "bars": self.bars, "rows": rows,
+                 "elapsed_s": elapsed_s, "bars_per_s": self.bars / elapsed_s if elapsed_s > 0 else float('nan')}
+        logger.info('exante | downloaded {bars} {symbol} bars in {windows} windows in {elapsed_s:.2f}s '
+                    '({bars_per_s:.0f} bars/s), {rows} rows'.format(**stats))
+        return stats
+
 
 class ExanteClient:
 
     @classmethod
-    def create(cls, status: str):
+    def create(cls, status: str, **kwargs):
         if status == "mock":
             return ExanteClientMock()
         elif status in ["live", "demo"]:
-            return ExanteClientHTTP(status=status)
+            return ExanteClientHTTP(status=status, **kwargs)
         else:
             raise TypeError('ExanteClient can have status in ["live", "demo", "mock"]')
 
-    def __init__(self):
-        self.pool = ThreadPoolExecutor()
+    MAX_WORKERS = 8
+
+    # quotes the subscriber has not confirmed for this long are polled again
+    QUOTE_MAX_AGE_S = 60
+
+    def __init__(self, max_workers=None, bar_cache: BarCache = None, quote_table: QuoteTable = None):
+        self.max_workers = self.MAX_WORKERS if max_workers is None else max_workers
+        self.pool = ThreadPoolExecutor(max_workers=self.max_workers)
+        self.bar_cache = bar_cache
+        self.quote_table = quote_table
+        self.last_download = None
 
     @staticmethod
     def remove_none_values(**params) -> dict:
@@ -34,21 +137,26 @@ class ExanteClient:
 
     @staticmethod
     def as_timestamp(x: [datetime, int]) -> int:
+        '''
+        :return: milliseconds since the epoch, integers are assumed to be in milliseconds already
+        '''
         if isinstance(x, datetime):
-            return int(x.timestamp())
+            return int(x.timestamp() * 1000)
         elif isinstance(x, int):
             return x
         else:
             return x
 
-    def OHLC(self, symbol: str, bar_length_seconds: int, number_of_bars: int = None,
-             end_time: [datetime, int] = None, start_time: [datetime, int] = None):
+    @staticmethod
+    def ohlc_params(number_of_bars: int = None, end_time: [datetime, int] = None, start_time: [datetime, int] = None):
         if (end_time is None and start_time is not None) or (end_time is not None and start_time is None):
             raise ValueError("start_time and end_time must either both be None or both be a time")
-        queryParams = ExanteClient.remove_none_values(**{"size": number_of_bars,
-                                                         "to": ExanteClient.as_timestamp(end_time),
-                                                         "from": ExanteClient.as_timestamp(start_time)})
-        data = self.api_request("ohlc", symbol, bar_length_seconds, **queryParams)
+        return ExanteClient.remove_none_values(**{"size": number_of_bars,
+                                                  "to": ExanteClient.as_timestamp(end_time),
+                                                  "from": ExanteClient.as_timestamp(start_time)})
+
+    @staticmethod
+    def ohlc_frame(data):
         if 'error' in data:
             df = DataFrame.from_records([data])
         else:
@@ -56,17 +164,92 @@ class ExanteClient:
             df.loc[:, "datetime"] = to_datetime(df["timestamp"], unit="ms")
         return df
 
-    def latest_price(self, symbol: str):
-        bar = self.OHLC(symbol, bar_length_seconds=60, number_of_bars=1)
+    @staticmethod
+    def latest_price_record(bar: DataFrame, symbol: str):
         bar.loc[:, 'symbol'] = symbol
         return bar[['symbol', 'datetime', 'close']].to_dict(orient='records')[0]
 
-    def crossrate(self, currency_from: str, currency_to: str):
-        data = self.api_request("crossrates", currency_from, currency_to)
+    @staticmethod
+    def crossrate_record(data, currency_from: str, currency_to: str):
         data['currency_from'] = currency_from
         data['currency_to'] = currency_to
         return data
 
+    def OHLC(self, symbol: str, bar_length_seconds: int, number_of_bars: int = None,
+             end_time: [datetime, int] = None, start_time: [datetime, int] = None):
+        queryParams = ExanteClient.ohlc_params(number_of_bars, end_time, start_time)
+        if self.bar_cache is not None and start_time is not None:
+            data = self.cached_ohlc(symbol, bar_length_seconds, number_of_bars, queryParams["from"], queryParams["to"])
+        else:
+            data = self.api_request("ohlc", symbol, bar_length_seconds, **queryParams)
+            if self.bar_cache is not None and 'error' not in data and len(data) > 0:
+                self.bar_cache.write(symbol, bar_length_seconds, data, *record_range(data))
+        return ExanteClient.ohlc_frame(data)
+
+    def cached_ohlc(self, symbol: str, bar_length_seconds: int, number_of_bars: int, start_ms: int, end_ms: int):
+        '''
+        Download only the parts of [start_ms, end_ms] missing from the bar cache, in windows the API accepts
+        :return: records latest first, or the API error
+        '''
+        fetched = []
+        for start, end in range_windows(self.bar_cache, symbol, bar_length_seconds, start_ms, end_ms,
+                                        MAX_BARS_PER_REQUEST):
+            data = self.api_request("ohlc", symbol, bar_length_seconds,
+                                    **{"from": start, "to": end, "size": MAX_BARS_PER_REQUEST})
+            if 'error' in data:
+                return data
+            cache_window(self.bar_cache, symbol, bar_length_seconds, data, start, end, MAX_BARS_PER_REQUEST)
+            fetched += data
+        records = merge_records(self.bar_cache.read(symbol, bar_length_seconds, start_ms, end_ms), fetched)
+        return records if number_of_bars is None else records[:number_of_bars]
+
+    def OHLC_range(self, symbol: str, bar_length_seconds: int, start_time: [datetime, int], end_time: [datetime, int],
+                   progress=None, max_bars_per_request: int = MAX_BARS_PER_REQUEST):
+        '''
+        Download every bar between start_time and end_time in windows the API accepts, max_workers at a time
+        :param progress: called with (windows done, windows, bars downloaded) after each window
+        :return: DataFrame sorted by time, or the first API error. Counts and throughput are kept in last_download
+        '''
+        start_ms, end_ms = ExanteClient.as_timestamp(start_time), ExanteClient.as_timestamp(end_time)
+        windows = range_windows(self.bar_cache, symbol, bar_length_seconds, start_ms, end_ms, max_bars_per_request)
+        tracker = DownloadProgress(symbol, len(windows), progress)
+        download = partial(self.download_window, symbol, bar_length_seconds, max_bars_per_request, tracker)
+        responses = self.batch_api_request(download, windows)
+        df = range_frame(self.bar_cache, symbol, bar_length_seconds, start_ms, end_ms, responses)
+        self.last_download = tracker.stats(len(df.index))
+        return df
+
+    def download_window(self, symbol, bar_length_seconds, max_bars, tracker, window):
+        start, end = window
+        data = self.api_request("ohlc", symbol, bar_length_seconds, **{"from": start, "to": end, "size": max_bars})
+        if self.bar_cache is not None and 'error' not in data:
+            cache_window(self.bar_cache, symbol, bar_length_seconds, data, start, end, max_bars)
+        tracker.update(data)
+        return data
+
+    def latest_price(self, symbol: str):
+        '''
+        :return: the price kept current by the quote subscriber, polled when it has none. The streamed close is the
+        bid/ask mid (a single side if only one is quoted), the polled one the last trade close of a one minute bar.
+        '''
+        quote = self.streamed_quote(symbol)
+        if quote is not None:
+            return latest_price_record(quote)
+        return self.poll_latest_price(symbol)
+
+    def streamed_quote(self, symbol: str):
+        if self.quote_table is None:
+            return None
+        return self.quote_table.get(symbol, max_age_s=self.QUOTE_MAX_AGE_S)
+
+    def poll_latest_price(self, symbol: str):
+        bar = self.OHLC(symbol, bar_length_seconds=60, number_of_bars=1)
+        return ExanteClient.latest_price_record(bar, symbol)
+
+    def crossrate(self, currency_from: str, currency_to: str):
+        data = self.api_request("crossrates", currency_from, currency_to)
+        return ExanteClient.crossrate_record(data, currency_from, currency_to)
+
     def gbp_rate(self, currency_from: str):
         return self.crossrate(currency_from, 'GBP')
 
@@ -82,7 +265,10 @@ class ExanteClient:
         return list(self.pool.map(method, *parameters))
 
 
-class ExanteClientHTTP(ExanteClient):
+class ExanteHTTPMixin:
+    '''
+    Hosts, credentials, timeouts, retry policy and per endpoint counters shared by the sync and async HTTP clients
+    '''
 
     BASE_URL_API = "/md/1.0"
 
@@ -94,17 +280,44 @@ class ExanteClientHTTP(ExanteClient):
 
     DEMO_AUTH = ("", "")
 
-    def __init__(self, status: str):
-        super().__init__()
+    # (connect, read) timeouts in seconds
+    TIMEOUTS = {"ohlc": (3.05, 30), "crossrates": (3.05, 10), "groups": (3.05, 10)}
+
+    DEFAULT_TIMEOUT = (3.05, 20)
+
+    RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+    MAX_RETRIES = 3
+
+    BACKOFF_S = 0.5
+
+    MAX_BACKOFF_S = 10
+
+    # endpoints sharing a rate limit, and the (requests per second, burst) allowed for each class and host
+    ENDPOINT_CLASSES = {"ohlc": "history", "crossrates": "reference", "groups": "reference"}
+
+    RATE_LIMITS = {"history": (5, 10), "reference": (10, 20)}
+
+    DEFAULT_RATE_LIMIT = (5, 10)
+
+    def configure(self, status: str, host: str = None, auth: tuple = None):
         if status == "live":
             self.auth = self.LIVE_AUTH
             self.url_host = self.LIVE_HOST
         elif status == "demo":
-            pass
+            self.auth = self.DEMO_AUTH
+            self.url_host = self.DEMO_HOST
         else:
             raise ValueError("status must be 'live' or 'demo'")
+        if host is not None:
+            self.url_host = host
+        if auth is not None:
+            self.auth = auth
 
         self.base_url = self.url_host + self.BASE_URL_API
+        self.stats = {}
+        self.stats_lock = Lock()
+        self.in_flight = {}
 
     def build_url(self, endpoint, *uriParams):
         url = self.base_url + "/" + quote(endpoint)
@@ -112,14 +325,133 @@ class ExanteClientHTTP(ExanteClient):
             url += "/" + unquote(str(param))
         return url
 
+    def rate_limiter(self, endpoint):
+        endpoint_class = self.ENDPOINT_CLASSES.get(endpoint, "default")
+        rate_per_s, capacity = self.RATE_LIMITS.get(endpoint_class, self.DEFAULT_RATE_LIMIT)
+        return rate_limiter(self.url_host, endpoint_class, rate_per_s, capacity)
+
+    @staticmethod
+    def request_key(endpoint, uriParams, queryParams):
+        return endpoint, tuple(str(p) for p in uriParams), tuple(sorted((k, str(v)) for k, v in queryParams.items()))
+
+    def endpoint_counters(self, endpoint):
+        return self.stats.setdefault(endpoint, {"requests": 0, "retries": 0, "errors": 0, "coalesced": 0,
+                                                "throttled_s": 0.0, "latency_s": 0.0, "max_latency_s": 0.0})
+
+    def record(self, endpoint, latency_s, retries, failed, throttled_s=0.0):
+        with self.stats_lock:
+            stats = self.endpoint_counters(endpoint)
+            stats["requests"] += 1
+            stats["retries"] += retries
+            stats["errors"] += int(failed)
+            stats["throttled_s"] += throttled_s
+            stats["latency_s"] += latency_s
+            stats["max_latency_s"] = max(stats["max_latency_s"], latency_s)
+
+    def record_coalesced(self, endpoint):
+        with self.stats_lock:
+            self.endpoint_counters(endpoint)["coalesced"] += 1
+
+    def endpoint_stats(self):
+        '''
+        :return: DataFrame indexed by endpoint with request, retry, error and coalesced counts, time spent waiting
+        for the rate limiter and latencies in seconds
+        '''
+        with self.stats_lock:
+            df = DataFrame.from_dict(self.stats, orient="index")
+        if len(df.index) > 0:
+            df.loc[:, "mean_latency_s"] = df["latency_s"] / df["requests"]
+        return df
+
+    def backoff(self, attempt, retry_after=None):
+        if retry_after is not None and retry_after.isdigit():
+            return min(float(retry_after), self.MAX_BACKOFF_S)
+        return uniform(0, min(self.MAX_BACKOFF_S, self.BACKOFF_S * 2 ** attempt))
+
+    def throttle_delay(self, limiter, status_code, attempt, retry_after):
+        delay = self.backoff(attempt, retry_after)
+        if status_code == 429:
+            limiter.pause(delay)
+        return delay
+
+    @staticmethod
+    def response_data(status_code, json, content):
+        if status_code == 200:
+            return json()
+        else:
+            return {"error": str(content),
+                    "status_code": status_code}
+
+
+class ExanteClientHTTP(ExanteClient, ExanteHTTPMixin):
+
+    def __init__(self, status: str, host: str = None, auth: tuple = None, max_workers: int = None,
+                 bar_cache: BarCache = None, quote_table: QuoteTable = None):
+        super().__init__(max_workers=max_workers, bar_cache=bar_cache, quote_table=quote_table)
+        self.configure(status, host, auth)
+        self.in_flight_lock = Lock()
+        self.session = self.create_session()
+
+    def create_session(self):
+        session = Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers, max_retries=0)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.auth = self.auth
+        return session
+
     def api_request(self, endpoint, *uriParams, **queryParams):
-        url = self.build_url(endpoint, *uriParams)
-        response = http_get(url, auth=self.auth, params=queryParams)
-        if response.status_code == 200:
-            return response.json()
+        key = self.request_key(endpoint, uriParams, queryParams)
+        with self.in_flight_lock:
+            future = self.in_flight.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = self.in_flight[key] = Future()
+        if is_leader:
+            try:
+                future.set_result(self.send(endpoint, *uriParams, **queryParams))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self.in_flight_lock:
+                    del self.in_flight[key]
         else:
-            return {"error": str(response.content),
-                    "status_code": response.status_code}
+            self.record_coalesced(endpoint)
+        status_code, content = future.result()
+        return self.response_data(status_code, lambda: json.loads(content), content)
+
+    def send(self, endpoint, *uriParams, **queryParams):
+        '''
+        :return: (status code, body) after waiting for the rate limiter and retrying throttled and failed requests
+        '''
+        url = self.build_url(endpoint, *uriParams)
+        timeout = self.TIMEOUTS.get(endpoint, self.DEFAULT_TIMEOUT)
+        limiter = self.rate_limiter(endpoint)
+        start = perf_counter()
+        attempt = 0
+        throttled_s = 0.0
+        while True:
+            delay = limiter.reserve()
+            if delay > 0:
+                throttled_s += delay
+                sleep(delay)
+            try:
+                response = self.session.get(url, params=queryParams, timeout=timeout)
+            except RequestException:
+                if attempt == self.MAX_RETRIES:
+                    self.record(endpoint, perf_counter() - start, attempt, failed=True, throttled_s=throttled_s)
+                    raise
+                sleep(self.backoff(attempt))
+                attempt += 1
+                continue
+            if response.status_code in self.RETRY_STATUS_CODES and attempt < self.MAX_RETRIES:
+                sleep(self.throttle_delay(limiter, response.status_code, attempt, response.headers.get("Retry-After")))
+                attempt += 1
+                continue
+            break
+        self.record(endpoint, perf_counter() - start, attempt, failed=response.status_code != 200,
+                    throttled_s=throttled_s)
+        return response.status_code, response.content
 
 
 class ExanteClientMock(ExanteClient):
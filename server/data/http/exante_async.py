@@ -0,0 +1,218 @@
+import asyncio
+import json
+from datetime import datetime
+from time import perf_counter
+
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, BasicAuth, ClientError
+
+from data.http.bar_cache import BarCache, merge_records, record_range
+from data.http.quotes import QuoteTable, latest_price_record
+from data.http.exante import ExanteClient, ExanteHTTPMixin, ExanteClientMock, DownloadProgress, \
+    MAX_BARS_PER_REQUEST, range_windows, range_frame, cache_window
+
+
+class AsyncExanteClient:
+    '''
+    asyncio version of ExanteClient with the same methods as coroutines
+    Use it inside "async with client:" or through run_sync from synchronous code such as Django views
+    '''
+
+    INDEX_SUFFIX = ExanteClient.INDEX_SUFFIX
+
+    CONNECTION_LIMIT = 16
+
+    connection_limit = CONNECTION_LIMIT
+
+    bar_cache = None
+
+    quote_table = None
+
+    last_download = None
+
+    @classmethod
+    def create(cls, status: str, **kwargs):
+        if status == "mock":
+            return AsyncExanteClientMock()
+        elif status in ["live", "demo"]:
+            return AsyncExanteClientHTTP(status=status, **kwargs)
+        else:
+            raise TypeError('AsyncExanteClient can have status in ["live", "demo", "mock"]')
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def api_request(self, endpoint, *uriParams, **queryParams):
+        raise NotImplementedError('use a specific base class')
+
+    async def OHLC(self, symbol: str, bar_length_seconds: int, number_of_bars: int = None,
+                   end_time: [datetime, int] = None, start_time: [datetime, int] = None):
+        queryParams = ExanteClient.ohlc_params(number_of_bars, end_time, start_time)
+        if self.bar_cache is not None and start_time is not None:
+            data = await self.cached_ohlc(symbol, bar_length_seconds, number_of_bars,
+                                          queryParams["from"], queryParams["to"])
+        else:
+            data = await self.api_request("ohlc", symbol, bar_length_seconds, **queryParams)
+            if self.bar_cache is not None and 'error' not in data and len(data) > 0:
+                self.bar_cache.write(symbol, bar_length_seconds, data, *record_range(data))
+        return ExanteClient.ohlc_frame(data)
+
+    async def cached_ohlc(self, symbol: str, bar_length_seconds: int, number_of_bars: int, start_ms: int, end_ms: int):
+        windows = range_windows(self.bar_cache, symbol, bar_length_seconds, start_ms, end_ms, MAX_BARS_PER_REQUEST)
+        responses = await self.gather(*[self.api_request("ohlc", symbol, bar_length_seconds,
+                                                         **{"from": start, "to": end, "size": MAX_BARS_PER_REQUEST})
+                                        for start, end in windows])
+        fetched = []
+        for (start, end), data in zip(windows, responses):
+            if 'error' in data:
+                return data
+            cache_window(self.bar_cache, symbol, bar_length_seconds, data, start, end, MAX_BARS_PER_REQUEST)
+            fetched += data
+        records = merge_records(self.bar_cache.read(symbol, bar_length_seconds, start_ms, end_ms), fetched)
+        return records if number_of_bars is None else records[:number_of_bars]
+
+    async def OHLC_range(self, symbol: str, bar_length_seconds: int, start_time: [datetime, int],
+                         end_time: [datetime, int], progress=None, max_bars_per_request: int = MAX_BARS_PER_REQUEST):
+        '''
+        Download every bar between start_time and end_time in windows the API accepts, connection_limit at a time
+        :param progress: called with (windows done, windows, bars downloaded) after each window
+        :return: DataFrame sorted by time, or the first API error. Counts and throughput are kept in last_download
+        '''
+        start_ms, end_ms = ExanteClient.as_timestamp(start_time), ExanteClient.as_timestamp(end_time)
+        windows = range_windows(self.bar_cache, symbol, bar_length_seconds, start_ms, end_ms, max_bars_per_request)
+        tracker = DownloadProgress(symbol, len(windows), progress)
+        semaphore = asyncio.Semaphore(self.connection_limit)
+
+        async def download(start, end):
+            async with semaphore:
+                data = await self.api_request("ohlc", symbol, bar_length_seconds,
+                                              **{"from": start, "to": end, "size": max_bars_per_request})
+            if self.bar_cache is not None and 'error' not in data:
+                cache_window(self.bar_cache, symbol, bar_length_seconds, data, start, end, max_bars_per_request)
+            tracker.update(data)
+            return data
+
+        responses = await self.gather(*[download(start, end) for start, end in windows])
+        df = range_frame(self.bar_cache, symbol, bar_length_seconds, start_ms, end_ms, responses)
+        self.last_download = tracker.stats(len(df.index))
+        return df
+
+    async def latest_price(self, symbol: str):
+        if self.quote_table is not None:
+            quote = self.quote_table.get(symbol, max_age_s=ExanteClient.QUOTE_MAX_AGE_S)
+            if quote is not None:
+                return latest_price_record(quote)
+        return await self.poll_latest_price(symbol)
+
+    async def poll_latest_price(self, symbol: str):
+        bar = await self.OHLC(symbol, bar_length_seconds=60, number_of_bars=1)
+        return ExanteClient.latest_price_record(bar, symbol)
+
+    async def crossrate(self, currency_from: str, currency_to: str):
+        data = await self.api_request("crossrates", currency_from, currency_to)
+        return ExanteClient.crossrate_record(data, currency_from, currency_to)
+
+    async def gbp_rate(self, currency_from: str):
+        return await self.crossrate(currency_from, 'GBP')
+
+    async def nearest(self, symbol):
+        return await self.api_request("groups", symbol, "nearest")
+
+    async def batch_api_request(self, method, *parameters):
+        return list(await asyncio.gather(*[method(*args) for args in zip(*parameters)]))
+
+    async def gather(self, *coroutines):
+        return list(await asyncio.gather(*coroutines))
+
+    def run_sync(self, method, *args, **kwargs):
+        '''
+        Run one coroutine method of the client, e.g. client.run_sync(client.batch_api_request, client.nearest, symbols)
+        '''
+        async def run():
+            async with self:
+                return await method(*args, **kwargs)
+        return asyncio.run(run())
+
+    def run_batch(self, calls):
+        '''
+        Run several calls as one concurrent batch
+        :param calls: list of (method, args) tuples
+        :return: list of results in the same order
+        '''
+        async def run():
+            async with self:
+                return await self.gather(*[method(*args) for method, args in calls])
+        return asyncio.run(run())
+
+
+class AsyncExanteClientHTTP(AsyncExanteClient, ExanteHTTPMixin):
+
+    def __init__(self, status: str, host: str = None, auth: tuple = None, connection_limit: int = None,
+                 bar_cache: BarCache = None, quote_table: QuoteTable = None):
+        self.configure(status, host, auth)
+        self.bar_cache = bar_cache
+        self.quote_table = quote_table
+        self.connection_limit = self.CONNECTION_LIMIT if connection_limit is None else connection_limit
+        self.session = None
+
+    async def __aenter__(self):
+        self.session = ClientSession(connector=TCPConnector(limit=self.connection_limit), auth=BasicAuth(*self.auth))
+        return self
+
+    async def __aexit__(self, *args):
+        await self.session.close()
+        self.session = None
+
+    async def api_request(self, endpoint, *uriParams, **queryParams):
+        if self.session is None:
+            raise RuntimeError('use "async with client:" or run_sync to open the connection pool')
+        key = self.request_key(endpoint, uriParams, queryParams)
+        task = self.in_flight.get(key)
+        if task is None:
+            task = self.in_flight[key] = asyncio.ensure_future(self.send(endpoint, *uriParams, **queryParams))
+            task.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        else:
+            self.record_coalesced(endpoint)
+        status_code, content = await asyncio.shield(task)
+        return self.response_data(status_code, lambda: json.loads(content), content)
+
+    async def send(self, endpoint, *uriParams, **queryParams):
+        url = self.build_url(endpoint, *uriParams)
+        connect, read = self.TIMEOUTS.get(endpoint, self.DEFAULT_TIMEOUT)
+        timeout = ClientTimeout(sock_connect=connect, sock_read=read)
+        limiter = self.rate_limiter(endpoint)
+        start = perf_counter()
+        attempt = 0
+        throttled_s = 0.0
+        while True:
+            delay = limiter.reserve()
+            if delay > 0:
+                throttled_s += delay
+                await asyncio.sleep(delay)
+            try:
+                async with self.session.get(url, params=queryParams, timeout=timeout) as response:
+                    status_code, content = response.status, await response.read()
+                    retry_after = response.headers.get("Retry-After")
+            except (ClientError, asyncio.TimeoutError):
+                if attempt == self.MAX_RETRIES:
+                    self.record(endpoint, perf_counter() - start, attempt, failed=True, throttled_s=throttled_s)
+                    raise
+                await asyncio.sleep(self.backoff(attempt))
+                attempt += 1
+                continue
+            if status_code in self.RETRY_STATUS_CODES and attempt < self.MAX_RETRIES:
+                await asyncio.sleep(self.throttle_delay(limiter, status_code, attempt, retry_after))
+                attempt += 1
+                continue
+            break
+        self.record(endpoint, perf_counter() - start, attempt, failed=status_code != 200, throttled_s=throttled_s)
+        return status_code, content
+
+
+class AsyncExanteClientMock(AsyncExanteClient):
+
+    async def api_request(self, endpoint, *uriParams, **queryParams):
+        key = tuple([endpoint] + list(uriParams))
+        return ExanteClientMock.MOCK_DATA[key]
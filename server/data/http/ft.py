@@ -1,43 +1,236 @@
-import requests
-from lxml.html import fromstring, tostring
-from pandas import read_html
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+from lxml.html import fromstring
+from pandas import DataFrame, Series, Timestamp, concat, to_datetime, to_numeric
+from requests import Session, RequestException
+from requests.adapters import HTTPAdapter
+
+from utils.cloud_logging import logger
 
 ticker_to_symbol = {'SMX Index': 'SMC:FSI',
                     'MCX Index': 'FTSM:FSI',
                     'INDEXEURO:CACMD': 'CACMD:PAR',
                     'CS90 Index': 'CACS:PAR'}
 
+FT_HOST = 'https://markets.ft.com'
+
+MAX_WORKERS = 8
+
+TIMEOUT = (3.05, 20)
+
+VALIDATORS_PREFIX = 'ft-validators:'
+
+VALIDATORS_TIMEOUT_S = 7 * 24 * 60 * 60
+
+SCRAPE_PREFIX = 'ft-scrape:'
+
+SCRAPE_TIMEOUT_S = 7 * 24 * 60 * 60
+
+session = None
+
 
-def url(symbol, currency, security_type):
+def url(symbol, currency, security_type, host=FT_HOST):
     if security_type == "index":
         symbol = ticker_to_symbol[symbol]
     elif security_type == "fund":
         symbol = symbol + ":" + currency
-    return 'https://markets.ft.com/data/indices/tearsheet/historical?s=' + symbol
+    return host + '/data/indices/tearsheet/historical?s=' + symbol
 
 
-def parse_table(df):
-    from pandas import to_datetime, to_numeric
-    df.loc[:, 'split'] = df['Date'].str.split(',')
-    df.loc[:, 'string'] = df['split'].str[-2] + df['split'].str[-1]
-    df.loc[:, 'Date'] = to_datetime(df['string'], format=' %b %d %Y')
-    df.loc[:, 'Close'] = to_numeric(df['Close'])
-    df = df.drop(['split', 'string'], axis=1).rename(columns={'Close': 'Price', 'Date': 'Time'})
-    df = df.set_index('Time')
-    df.index = df.index.tz_localize('UTC')
-    return df.reset_index()
+def get_session():
+    '''
+    :return: the pooled session shared by the scraper threads
+    '''
+    global session
+    if session is None:
+        session = Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MAX_WORKERS, max_retries=2)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+    return session
 
-    
-def extract_table(page):
-    tree = fromstring(page.content)
-    table = tree.xpath('//table')[0]
-    df = read_html(tostring(table))[0]
-    return df
+
+def parse_dates(strings: Series):
+    # the date cell holds a long and a short form, e.g. "Friday, June 05, 2020Fri, Jun 05, 2020"
+    split = strings.str.split(',')
+    return to_datetime(split.str[-2] + split.str[-1], format=' %b %d %Y').dt.tz_localize('UTC')
+
+
+def parse_page(content):
+    '''
+    Read the historical prices table straight from the parsed page
+    :return: DataFrame with Time and Price columns, latest first as on the page
+    '''
+    tree = fromstring(content)
+    tables = tree.xpath('//table')
+    if len(tables) == 0:
+        raise ValueError('ft: no price table on the page')
+    table = tables[0]
+    headers = [cell.text_content().strip() for cell in table.xpath('.//thead//th')]
+    date_column, close_column = headers.index('Date'), headers.index('Close')
+    rows = [row.xpath('./td') for row in table.xpath('.//tbody/tr')]
+    rows = [cells for cells in rows if len(cells) > max(date_column, close_column)]
+    dates = Series([cells[date_column].text_content() for cells in rows], dtype=object)
+    closes = Series([cells[close_column].text_content() for cells in rows], dtype=object)
+    return DataFrame({'Time': parse_dates(dates),
+                      'Price': to_numeric(closes.str.replace(',', '').str.strip())})
 
 
 def parse_daily(symbol, currency, security_type):
     url_ = url(symbol, currency, security_type)
-    page = requests.get(url_)
-    df = extract_table(page)
-    df = parse_table(df)
-    return df[['Time', 'Price']]
+    page = get_session().get(url_, timeout=TIMEOUT)
+    page.raise_for_status()
+    return parse_page(page.content)
+
+
+def validators_key(url_):
+    return VALIDATORS_PREFIX + url_
+
+
+def conditional_headers(url_):
+    from app.cache import get
+    validators = get(validators_key(url_)) or {}
+    headers = {}
+    if 'etag' in validators:
+        headers['If-None-Match'] = validators['etag']
+    if 'last_modified' in validators:
+        headers['If-Modified-Since'] = validators['last_modified']
+    return headers
+
+
+def remember_validators(url_, response):
+    from app.cache import set
+    validators = {}
+    if 'ETag' in response.headers:
+        validators['etag'] = response.headers['ETag']
+    if 'Last-Modified' in response.headers:
+        validators['last_modified'] = response.headers['Last-Modified']
+    if len(validators) > 0:
+        set(validators_key(url_), validators, VALIDATORS_TIMEOUT_S)
+
+
+def price_symbol(symbol, security_type):
+    '''
+    :return: the symbol Price rows are stored under, the Bloomberg symbol of a fund ISIN, e.g. "FR0007017488 ISIN"
+    '''
+    from app.asset import Fund
+    from app.enums import bloomberg, reyl
+    return Fund(symbol, source=reyl).to_symbol(bloomberg) if security_type == 'fund' else symbol
+
+
+def scrape_key(symbol):
+    # memcached keys cannot contain spaces
+    return SCRAPE_PREFIX + symbol.replace(' ', '_')
+
+
+def remember_scrape(symbol, error=None):
+    '''
+    Keep the time and error of the latest scrape of a stored symbol so readers of its prices can tell they are stale
+    '''
+    from app.cache import set
+    set(scrape_key(symbol), {'error': error, 'time': Timestamp.utcnow()}, SCRAPE_TIMEOUT_S)
+
+
+def last_scrape(symbol):
+    '''
+    :param symbol: stored symbol, see price_symbol
+    :return: dict of the time and error, None if it succeeded, of the latest scrape, None if there was none
+    '''
+    from app.cache import get
+    return get(scrape_key(symbol))
+
+
+def latest_stored_times(symbols):
+    '''
+    :return: dict of symbol: time of the latest daily FT close in the Price table
+    '''
+    from django.db.models import Max
+    from app.enums import ft, one_day, close
+    from app.models import Price
+    rows = Price.objects.filter(symbol__in=symbols, source=ft, resolution=one_day, aspect=close) \
+        .values('symbol').annotate(latest=Max('time')).values_list('symbol', 'latest')
+    return dict(rows)
+
+
+def price_rows(symbol, security_type, prices: DataFrame, as_of):
+    from app.enums import ft, one_day, close, fund, nav, equity_index, trade
+    df = DataFrame({'time': prices['Time'], 'value': prices['Price']})
+    return df.assign(as_of=as_of, source=ft, symbol=price_symbol(symbol, security_type), resolution=one_day,
+                     asset_type=fund if security_type == 'fund' else equity_index, aspect=close,
+                     price_type=nav if security_type == 'fund' else trade)
+
+
+def scrape_one(symbol, currency, security_type, latest, host, as_of):
+    '''
+    :param latest: time of the latest stored price, only later rows are returned
+    :return: (Price rows, True if the page was unchanged)
+    '''
+    url_ = url(symbol, currency, security_type, host)
+    headers = conditional_headers(url_) if latest is not None else {}
+    response = get_session().get(url_, headers=headers, timeout=TIMEOUT)
+    if response.status_code == 304:
+        return price_rows(symbol, security_type, DataFrame(columns=['Time', 'Price']), as_of), True
+    response.raise_for_status()
+    prices = parse_page(response.content)
+    if latest is not None:
+        prices = prices[prices['Time'] > Timestamp(latest)]
+    remember_validators(url_, response)
+    return price_rows(symbol, security_type, prices, as_of), False
+
+
+def scrape_daily(requests_, save=True, host=None, max_workers=MAX_WORKERS):
+    '''
+    Fetch the FT historical price pages of many securities concurrently and store the closes not already saved,
+    under price_symbol. The time and error of the scrape of each page are kept for last_scrape.
+    :param requests_: list of (symbol, currency, security_type)
+    :param save: upsert the new rows into Price
+    :param host: default FT_HOST
+    :return: (DataFrame of new Price rows, dict of counts and timings)
+    '''
+    start = perf_counter()
+    host = FT_HOST if host is None else host
+    latest = latest_stored_times([price_symbol(symbol, security_type) for symbol, _, security_type in requests_])
+    as_of = Timestamp.utcnow()
+
+    def scrape(request):
+        symbol, currency, security_type = request
+        stored_symbol = price_symbol(symbol, security_type)
+        try:
+            result = scrape_one(symbol, currency, security_type, latest.get(stored_symbol), host, as_of)
+        except (RequestException, ValueError) as e:
+            logger.warning('ft | scraping ' + symbol + ' failed: ' + str(e))
+            if save:
+                remember_scrape(stored_symbol, str(e))
+            return None
+        if save:
+            remember_scrape(stored_symbol)
+        return result
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = list(pool.map(scrape, requests_))
+    frames = [rows for rows, _ in filter(None, results)]
+    df = concat(frames, ignore_index=True, sort=False) if len(frames) > 0 else DataFrame()
+    stats = {'pages': len(requests_), 'failed': results.count(None),
+             'not_modified': sum(1 for result in results if result is not None and result[1]),
+             'new_rows': len(df.index), 'inserted': 0}
+    if save and len(df.index) > 0:
+        from app.dependencies import publish_changes, changed_ranges
+        from app.upsert import bulk_upsert
+        _, counts = bulk_upsert('Price', df, save_new=True, update_existing=False)
+        stats['inserted'] = counts['inserted']
+        publish_changes('Price', changed_ranges('Price', df))
+    stats['elapsed_s'] = perf_counter() - start
+    return df, stats
+
+
+def recent_prices(symbol, count=30):
+    '''
+    :param symbol: stored symbol, see price_symbol
+    :return: DataFrame with Time and Price columns of the latest stored daily FT closes, latest first
+    '''
+    from app.enums import ft, one_day, close
+    from app.models import Price
+    rows = Price.objects.filter(symbol=symbol, source=ft, resolution=one_day, aspect=close) \
+        .order_by('-time').values_list('time', 'value')[:count]
+    return DataFrame.from_records(list(rows), columns=['Time', 'Price'])
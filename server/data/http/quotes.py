@@ -0,0 +1,209 @@
+import json
+import os
+import sqlite3
+from os.path import dirname
+from threading import local
+from time import time, monotonic
+
+from pandas import DataFrame, to_datetime
+from requests import RequestException
+
+from utils.cloud_logging import logger
+
+FEED_CONTENT_TYPE = "application/x-json-stream"
+
+
+def best_price(levels):
+    '''
+    :param levels: a price, or the order book side of a quote as a list of {"price", "size"} levels
+    '''
+    if isinstance(levels, list):
+        return float(levels[0]["price"]) if len(levels) > 0 else None
+    return None if levels is None else float(levels)
+
+
+def parse_quote(message: dict):
+    '''
+    :param message: one line of the Exante quote or trade feed
+    :return: dict of symbol, timestamp in ms, bid, ask and price (the mid, else the side quoted, else the trade),
+    None for heartbeats and other events
+    '''
+    symbol = message.get("symbolId")
+    if symbol is None:
+        return None
+    bid, ask = best_price(message.get("bid")), best_price(message.get("ask"))
+    if bid is not None and ask is not None:
+        price = (bid + ask) / 2
+    else:
+        price = bid if bid is not None else ask
+    if price is None:
+        price = best_price(message.get("price"))
+    if price is None:
+        return None
+    timestamp = message.get("timestamp") or int(time() * 1000)
+    return {"symbol": symbol, "timestamp": int(timestamp), "bid": bid, "ask": ask, "price": price}
+
+
+def quote_from_record(record: dict):
+    '''
+    :param record: as returned by ExanteClient.poll_latest_price
+    '''
+    return {"symbol": record["symbol"], "timestamp": int(record["datetime"].value // 10 ** 6),
+            "bid": None, "ask": None, "price": float(record["close"])}
+
+
+def latest_price_record(quote: dict):
+    '''
+    :return: the quote in the format of ExanteClient.latest_price
+    '''
+    return {"symbol": quote["symbol"], "datetime": to_datetime(quote["timestamp"], unit="ms"), "close": quote["price"]}
+
+
+class QuoteTable:
+    '''
+    Last price of each symbol in a local SQLite file, written by the quote subscriber and read by every process
+    through ExanteClient.latest_price. updated_at is when the subscriber last confirmed the price, so quiet
+    symbols stay fresh while the feed is alive.
+    '''
+
+    def __init__(self, path=None):
+        if path is None:
+            from django.conf import settings
+            path = settings.EXANTE_QUOTE_TABLE
+        self.path = path
+        self.local = local()
+
+    @property
+    def connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            os.makedirs(dirname(self.path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS quote (symbol TEXT PRIMARY KEY, timestamp INTEGER, "
+                               "bid REAL, ask REAL, price REAL, updated_at REAL)")
+            self.local.connection = connection
+        return connection
+
+    def update(self, quotes):
+        '''
+        :param quotes: dicts as returned by parse_quote
+        '''
+        now = time()
+        self.connection.executemany("INSERT OR REPLACE INTO quote VALUES (?, ?, ?, ?, ?, ?)",
+                                    [(q["symbol"], q["timestamp"], q["bid"], q["ask"], q["price"], now)
+                                     for q in quotes])
+
+    def touch(self, symbols):
+        self.connection.executemany("UPDATE quote SET updated_at = ? WHERE symbol = ?",
+                                    [(time(), symbol) for symbol in symbols])
+
+    def get(self, symbol: str, max_age_s: float = None):
+        '''
+        :return: the last quote, None if there is none or it was last confirmed more than max_age_s ago
+        '''
+        row = self.connection.execute("SELECT symbol, timestamp, bid, ask, price, updated_at FROM quote "
+                                      "WHERE symbol = ?", (symbol,)).fetchone()
+        if row is None or (max_age_s is not None and row[5] < time() - max_age_s):
+            return None
+        return dict(zip(["symbol", "timestamp", "bid", "ask", "price", "updated_at"], row))
+
+    def read(self):
+        return DataFrame(self.connection.execute("SELECT * FROM quote").fetchall(),
+                         columns=["symbol", "timestamp", "bid", "ask", "price", "updated_at"])
+
+
+class QuoteSubscriber:
+    '''
+    Keeps a QuoteTable current from the Exante quote feed, polling 1 bar OHLC requests on a tight schedule
+    whenever the feed is unavailable
+    '''
+
+    READ_TIMEOUT_S = 30
+
+    TOUCH_INTERVAL_S = 1
+
+    RECONNECT_S = 1
+
+    def __init__(self, client, symbols, table: QuoteTable, poll_interval_s: float = 1, fallback_s: float = 60):
+        '''
+        :param client: ExanteClientHTTP
+        :param fallback_s: how long to poll after the feed failed before connecting to it again
+        '''
+        self.client = client
+        self.symbols = list(symbols)
+        self.table = table
+        self.poll_interval_s = poll_interval_s
+        self.fallback_s = fallback_s
+        self.stats = {"streamed": 0, "polled": 0, "connections": 0, "failures": 0}
+
+    def run(self, stop):
+        '''
+        :param stop: threading.Event ending the loop
+        '''
+        while not stop.is_set():
+            if self.stream(stop):
+                stop.wait(self.RECONNECT_S)
+            else:
+                self.poll(stop, self.fallback_s)
+
+    def stream(self, stop):
+        '''
+        :return: True if the feed delivered quotes before it closed
+        '''
+        url = self.client.build_url("feed", ",".join(self.symbols))
+        received = False
+        self.stats["connections"] += 1
+        try:
+            with self.client.session.get(url, stream=True, headers={"Accept": FEED_CONTENT_TYPE},
+                                         timeout=(3.05, self.READ_TIMEOUT_S)) as response:
+                if response.status_code != 200:
+                    logger.warning('quotes | feed returned ' + str(response.status_code) + ', polling instead')
+                    self.stats["failures"] += 1
+                    return False
+                touched = monotonic()
+                for line in response.iter_lines():
+                    if stop.is_set():
+                        break
+                    quote = parse_quote(json.loads(line)) if line else None
+                    if quote is not None:
+                        self.table.update([quote])
+                        self.stats["streamed"] += 1
+                        received = True
+                    if monotonic() - touched > self.TOUCH_INTERVAL_S:
+                        self.table.touch(self.symbols)
+                        touched = monotonic()
+        except (RequestException, ValueError) as e:
+            logger.warning('quotes | feed failed: ' + str(e))
+            self.stats["failures"] += 1
+        return received
+
+    def poll(self, stop, duration_s):
+        deadline = monotonic() + duration_s
+        while not stop.is_set() and monotonic() < deadline:
+            quotes = [quote for quote in self.client.batch_api_request(self.poll_quote, self.symbols)
+                      if quote is not None]
+            self.table.update(quotes)
+            self.stats["polled"] += len(quotes)
+            stop.wait(self.poll_interval_s)
+
+    def poll_quote(self, symbol):
+        try:
+            return quote_from_record(self.client.poll_latest_price(symbol))
+        except (RequestException, KeyError, IndexError) as e:
+            logger.warning('quotes | polling ' + symbol + ' failed: ' + str(e))
+            return None
+
+
+quote_table = None
+
+
+def get_quote_table():
+    '''
+    :return: the process wide table in settings.EXANTE_QUOTE_TABLE
+    '''
+    global quote_table
+    if quote_table is None:
+        quote_table = QuoteTable()
+    return quote_table
@@ -0,0 +1,55 @@
+from threading import Lock
+from time import monotonic
+
+
+class TokenBucket:
+    '''
+    Thread safe token bucket. Callers reserve a token and sleep for the returned delay, which lets the same
+    bucket throttle threads with time.sleep and coroutines with asyncio.sleep
+    '''
+
+    def __init__(self, rate_per_s: float, capacity: float):
+        self.rate_per_s = rate_per_s
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+        self.lock = Lock()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate_per_s)
+        self.updated = now
+
+    def reserve(self, tokens: float = 1) -> float:
+        '''
+        :return: seconds to wait before the reserved tokens may be used
+        '''
+        with self.lock:
+            now = monotonic()
+            self.refill(now)
+            self.tokens -= tokens
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate_per_s
+
+    def pause(self, seconds: float):
+        '''
+        Hold back every caller for at least this long, e.g. after the server answered 429 with Retry-After
+        '''
+        with self.lock:
+            self.refill(monotonic())
+            self.tokens = min(self.tokens, -seconds * self.rate_per_s)
+
+
+buckets = {}
+buckets_lock = Lock()
+
+
+def rate_limiter(host: str, endpoint_class: str, rate_per_s: float, capacity: float) -> TokenBucket:
+    '''
+    :return: the bucket shared by every client in the process talking to this host and endpoint class
+    '''
+    key = (host, endpoint_class)
+    with buckets_lock:
+        if key not in buckets:
+            buckets[key] = TokenBucket(rate_per_s, capacity)
+        return buckets[key]
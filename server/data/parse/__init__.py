@@ -8,8 +8,9 @@ from pandas import DataFrame, Series
 
 from app.asset import Asset
 from app.enums import bloomberg
-from app.models import to_models, update_unique, field_names
-import app.models
+from app.models import field_names
+from app.dependencies import publish_changes, changed_ranges
+from app.upsert import bulk_upsert
 
 
 class FileParser(ABC):
@@ -31,16 +32,16 @@ class FileParser(ABC):
     @classmethod
     def save(cls, data, save_new=False, update_existing=False):
         all_objs = []
+        counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
         for model_cls_name, df in data.items():
-            model_cls = getattr(app.models, model_cls_name)
-            objs, fields = to_models(model_cls, df)
-            if save_new:
-                model_cls.objects.bulk_create(objs, ignore_conflicts=True, batch_size=5000)
-            if update_existing:
-                for obj in df.to_dict(orient='records'):
-                    update_unique(model_cls_name, obj)
+            objs, model_counts = bulk_upsert(model_cls_name, df, save_new=save_new, update_existing=update_existing)
+            if model_counts['inserted'] + model_counts['updated'] > 0:
+                publish_changes(model_cls_name, changed_ranges(model_cls_name, df))
+            for name, count in model_counts.items():
+                counts[name] += count
             all_objs += objs
-        return all_objs, 'Successfully created ' + str(len(all_objs)) + ' models'
+        return all_objs, 'Successfully created ' + str(len(all_objs)) + ' models (' + \
+            ', '.join(str(count) + ' ' + name for name, count in counts.items()) + ')'
 
     @classmethod
     def create_parser(cls, file):
@@ -13,7 +13,7 @@ class Portaracqg5mParser(FileParser, ABC):
 
     UNUSED_COLUMNS = []
     HEADER_ROW = None
-    MODEL_CLASS = 'Price'
+    MODEL_CLASS = 'Bar'
     SOURCE = portaracqg
     SYMBOL = ''
 
@@ -34,18 +34,7 @@ class Portaracqg5mParser(FileParser, ABC):
         else:
             raise Exception('Unknown asset type')
         df['price_type'] = trade
-
-        aspects = ['open', 'high', 'low', 'close', 'volume']
-        list_of_dfs = []
-        for aspect in aspects:
-            df['value'] = df[aspect]
-            df['aspect'] = aspect
-            temp_df = df.drop(aspects, axis='columns')
-            list_of_dfs.append(temp_df)
-        result = concat(list_of_dfs)
-        result = result.reset_index()
-        result = result.drop('index', axis='columns')
-        self.data = {'Price': result}
+        return {'Bar': df}
 
 
 class Dukescopy5mParser(FileParser, ABC):
@@ -58,7 +47,7 @@ class Dukescopy5mParser(FileParser, ABC):
 
     UNUSED_COLUMNS = []
     HEADER_ROW = 0
-    MODEL_CLASS = 'Price'
+    MODEL_CLASS = 'Bar'
     SOURCE = dukascopy
     SYMBOL = ''
 
@@ -76,15 +65,7 @@ class Dukescopy5mParser(FileParser, ABC):
         df['resolution'] = five_minutes
         df['asset_type'] = fx_spot
         df['price_type'] = price_type
-        aspects = ['open', 'high', 'low', 'close', 'volume']
-        list_of_dfs = []
-        for aspect in aspects:
-            df['value'] = df[aspect]
-            df['aspect'] = aspect
-            temp_df = df.drop(aspects, axis='columns')
-            list_of_dfs.append(temp_df)
-        result = concat(list_of_dfs)
-        self.data = {'Price': result}
+        return {'Bar': df}
 
 
 class DailyPriceParser(FileParser, ABC):
@@ -133,7 +114,7 @@ class Monthly5mBarPriceParser(FileParser, ABC):
 
     UNUSED_COLUMNS = []
     HEADER_ROW = None
-    MODEL_CLASS = 'Price'
+    MODEL_CLASS = 'Bar'
     SOURCE = bloomberg
     SYMBOL = ''
 
@@ -149,31 +130,22 @@ class Monthly5mBarPriceParser(FileParser, ABC):
         df.columns = multi_index
         aspects = {'Open': open, 'Close': close, 'High': high, 'Low': low}
         result_dfs = []
-        cols = ['as_of', 'time', 'symbol', 'source', 'value', 'resolution', 'asset_type',
-                'price_type', 'aspect']
         for asset, price_df in df.groupby(level=0, axis='columns'):
             price_df = price_df[asset].copy()
             price_df['Dates'] = to_datetime(price_df['Dates'], format='%d/%m/%Y %H:%M').dt.floor('s')
             price_df = price_df.set_index('Dates')
             price_df.index = price_df.index.tz_localize('Europe/London')
             price_df.index = price_df.index.tz_convert('UTC')
-            price_df = price_df.dropna(how='all')
-            list_of_aspect_price_dfs = []
-            for aspect_name, aspect in aspects.items():
-                new_price_df = DataFrame(columns=cols)
-                new_price_df.loc[:, 'time'] = price_df.index
-                new_price_df.loc[:, 'as_of'] = today
-                new_price_df.loc[:, 'value'] = price_df[aspect_name].values
-                new_price_df.loc[:, 'symbol'] = asset
-                new_price_df.loc[:, 'source'] = self.SOURCE
-                new_price_df.loc[:, 'resolution'] = five_minutes
-                new_price_df.loc[:, 'asset_type'] = asset_type_map[asset]
-                new_price_df.loc[:, 'price_type'] = trade
-                new_price_df.loc[:, 'aspect'] = aspect
-                list_of_aspect_price_dfs.append(new_price_df)
-            result_df = concat(list_of_aspect_price_dfs, ignore_index=True)
-            result_dfs.append(result_df)
+            price_df = price_df.rename(columns=aspects).dropna(how='all')
+            bar_df = price_df[list(aspects.values())].astype(float)
+            bar_df.index.name = 'time'
+            bar_df = bar_df.reset_index()
+            bar_df.loc[:, 'as_of'] = today
+            bar_df.loc[:, 'symbol'] = asset
+            bar_df.loc[:, 'source'] = self.SOURCE
+            bar_df.loc[:, 'resolution'] = five_minutes
+            bar_df.loc[:, 'asset_type'] = asset_type_map[asset]
+            bar_df.loc[:, 'price_type'] = trade
+            result_dfs.append(bar_df)
         result = concat(result_dfs, ignore_index=True)
-        result = result.dropna(how='any', axis='index')
-        return {'Price': result}
-
+        return {'Bar': result}
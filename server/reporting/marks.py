@@ -3,7 +3,8 @@ from datetime import datetime
 from app.asset import Asset
 from app.enums import buy, sell, fund, fx_forward, future, fx_spot, reyl, cash, interest, exante, bloomberg
 from app.models import Price, to_dataframe
-from data.http.exante import ExanteClient
+from data.http.bar_cache import get_bar_cache
+from data.http.exante_async import AsyncExanteClient
 from pandas import concat, DataFrame
 
 
@@ -62,13 +63,14 @@ def get_gbp_exchange_rates(positions, as_of=None, source=None):
 
 
 def exante_futures_marks(as_of, df):
-    exante_client = ExanteClient.create(status='live')
+    exante_client = AsyncExanteClient.create(status='live', bar_cache=get_bar_cache())
     bbg_symbols = symbols(df, [future])
+    exante_symbols = [Asset.convert_symbol(bbg_symbol, future, bloomberg, exante) for bbg_symbol in bbg_symbols]
+    n = len(exante_symbols)
     bars = []
-    for bbg_symbol in bbg_symbols:
-        exante_symbol = Asset.convert_symbol(bbg_symbol, future, bloomberg, exante)
-        bar = exante_client.OHLC(exante_symbol, 24*60*60, 1, as_of, as_of)
-        bars.append(bar)
+    if n > 0:
+        bars = exante_client.run_sync(exante_client.batch_api_request, exante_client.OHLC, exante_symbols,
+                                      [24*60*60] * n, [1] * n, [as_of] * n, [as_of] * n)
     if len(bars) > 0:
         return concat(bars)
     else:
@@ -142,6 +142,31 @@ CACHES = {
     }
 }
 
+CACHE_L1_MAX_BYTES = int(os.environ.get('CACHE_L1_MAX_BYTES', 256 * 1024 * 1024))
+
+PRICE_ARCHIVE_DIR = os.environ.get('PRICE_ARCHIVE_DIR', os.path.join(BASE_DIR, 'opps', 'price_archive'))
+
+EXANTE_BAR_CACHE_DIR = os.environ.get('EXANTE_BAR_CACHE_DIR', os.path.join(BASE_DIR, 'opps', 'exante_bars'))
+
+CALENDAR_CACHE_DIR = os.environ.get('CALENDAR_CACHE_DIR', os.path.join(BASE_DIR, 'opps', 'calendars'))
+
+EXANTE_QUOTE_TABLE = os.environ.get('EXANTE_QUOTE_TABLE', os.path.join(BASE_DIR, 'opps', 'exante_quotes.sqlite3'))
+
+# indexes whose index and nearest future quotes the subscriber follows, and other symbols it follows
+EXANTE_QUOTE_INDEXES = ['SPX', 'TOPIX', 'HSI', 'RTY']
+
+EXANTE_QUOTE_SYMBOLS = ['VIX.INDEX']
+
+# MFT signal snapshots: indexes produced, seconds between snapshots, UTC weekday hours when the producer runs
+# and how old the latest snapshot may be before a request computes the signals itself
+SIGNAL_INDEXES = ['SPX', 'TOPIX', 'HSI']
+
+SIGNAL_SNAPSHOT_INTERVAL_S = int(os.environ.get('SIGNAL_SNAPSHOT_INTERVAL_S', 30))
+
+SIGNAL_MARKET_HOURS_UTC = ('00:00', '21:00')
+
+SIGNAL_SNAPSHOT_MAX_AGE_S = int(os.environ.get('SIGNAL_SNAPSHOT_MAX_AGE_S', 300))
+
 LOGGING_CONFIG = None
 
 REST_FRAMEWORK = {
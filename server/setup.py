@@ -32,5 +32,8 @@ setup(
         'sqlalchemy',
         'django-pandas',
         'behave-django',
-        'google-cloud-logging'
+        'google-cloud-logging',
+        'pyarrow',
+        'aiohttp',
+        'sortedcontainers'
     ])
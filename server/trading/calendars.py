@@ -0,0 +1,137 @@
+import os
+from os.path import join, isfile
+from threading import Lock
+
+import pandas_market_calendars as market_calendars
+from numpy import arange, asarray, busdaycalendar, busday_offset, busday_count, cumsum, datetime64, is_busday, isin, \
+    load, save, unique
+
+from utils.cloud_logging import logger
+
+# the range pandas holiday calendars cover by default
+CALENDAR_START = datetime64('1970-01-01', 'D')
+
+CALENDAR_END = datetime64('2200-12-31', 'D')
+
+
+class BusinessCalendar:
+    '''
+    Business days of one exchange, weekdays other than its regular holidays, with lookup tables from each day
+    between CALENDAR_START and CALENDAR_END to the position of the business day on or before and on or after it.
+    Shifting or counting business days is then integer arithmetic on those positions, for any number of dates at once.
+    '''
+
+    def __init__(self, holidays):
+        '''
+        :param holidays: dates of the regular holidays, e.g. as datetime64[D]
+        '''
+        self.holidays = unique(asarray(holidays, dtype='datetime64[D]'))
+        self.busdaycalendar = busdaycalendar(holidays=self.holidays)
+        days = arange(CALENDAR_START, CALENDAR_END + 1, dtype='datetime64[D]')
+        is_open = is_busday(days, busdaycal=self.busdaycalendar)
+        self.business_days = days[is_open]
+        self.before = cumsum(is_open) - 1
+        self.after = self.before + ~is_open
+
+    def positions(self, dates):
+        '''
+        :return: (datetime64[D] array of the dates, their day numbers in the lookup tables, True if all are covered)
+        '''
+        dates = asarray(dates, dtype='datetime64[D]')
+        days = (dates - CALENDAR_START).astype(int)
+        return dates, days, days.size == 0 or (days.min() >= 0 and days.max() < len(self.before) - 1)
+
+    def shift(self, dates, n: int):
+        '''
+        dates + CustomBusinessDay(n, holidays=self.holidays): a date which is not a business day first rolls
+        forward when n <= 0 and backward when n > 0
+        :param dates: dates, e.g. DatetimeIndex.date or a datetime64 array
+        :return: datetime64[D] array
+        '''
+        dates, days, covered = self.positions(dates)
+        if not covered:
+            return busday_offset(dates, n, roll='forward' if n <= 0 else 'backward', busdaycal=self.busdaycalendar)
+        return self.business_days[(self.after if n <= 0 else self.before)[days] + n]
+
+    def count(self, begin_dates, end_dates):
+        '''
+        numpy.busday_count: business days from each begin date included to its end date excluded, or minus those
+        after the end date up to the begin date included when the end date is earlier
+        '''
+        begin_dates, begin_days, begin_covered = self.positions(begin_dates)
+        end_dates, end_days, end_covered = self.positions(end_dates)
+        if not begin_covered or not end_covered:
+            return busday_count(begin_dates, end_dates, busdaycal=self.busdaycalendar)
+        reversed_ = (end_days < begin_days).astype(int)
+        return self.after[end_days + reversed_] - self.after[begin_days + reversed_]
+
+    def is_holiday(self, dates):
+        '''
+        :return: boolean array, True for the regular holidays whether or not they fall on a weekday
+        '''
+        return isin(asarray(dates, dtype='datetime64[D]'), self.holidays)
+
+
+class CalendarStore:
+    '''
+    BusinessCalendar of each exchange, built once per process from pandas_market_calendars and kept on disk as the
+    holiday dates so other processes skip building the holiday calendar too. Files are named after the
+    pandas_market_calendars version, which drops them when it is upgraded.
+    '''
+
+    def __init__(self, root=None):
+        if root is None:
+            from django.conf import settings
+            root = settings.CALENDAR_CACHE_DIR
+        self.root = root
+        self.calendars = {}
+        self.lock = Lock()
+
+    def path(self, name):
+        return join(self.root, name + '-' + market_calendars.__version__ + '.npy')
+
+    def get(self, name=None):
+        '''
+        :param name: pandas_market_calendars name, e.g. 'LSE', None for weekdays without holidays
+        '''
+        calendar = self.calendars.get(name)
+        if calendar is None:
+            with self.lock:
+                calendar = self.calendars.get(name)
+                if calendar is None:
+                    calendar = self.calendars[name] = BusinessCalendar(self.holidays(name))
+        return calendar
+
+    def holidays(self, name):
+        if name is None:
+            return []
+        path = self.path(name)
+        if isfile(path):
+            try:
+                return load(path)
+            except (OSError, ValueError) as e:
+                logger.warning('calendars | reading ' + path + ' failed: ' + str(e))
+        holidays = market_calendars.get_calendar(name).regular_holidays.holidays().values.astype('datetime64[D]')
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            # write to a temporary file first so readers in other processes never see a partial file
+            temporary_path = path + '.' + str(os.getpid()) + '.tmp.npy'
+            save(temporary_path, holidays)
+            os.replace(temporary_path, path)
+        except OSError as e:
+            logger.warning('calendars | writing ' + path + ' failed: ' + str(e))
+        return holidays
+
+
+calendar_store = None
+
+
+def get_calendar(name=None):
+    '''
+    :param name: pandas_market_calendars name, e.g. 'LSE', None for weekdays without holidays
+    :return: the process wide BusinessCalendar, from the store in settings.CALENDAR_CACHE_DIR
+    '''
+    global calendar_store
+    if calendar_store is None:
+        calendar_store = CalendarStore()
+    return calendar_store.get(name)
@@ -1,14 +1,26 @@
-from pandas import DataFrame, concat, date_range, DatetimeIndex, to_datetime, Timedelta
-import pandas_market_calendars as market_calendars
-from pandas.tseries.offsets import CustomBusinessDay
+from concurrent.futures import ProcessPoolExecutor
+from datetime import time
+from functools import reduce
+from itertools import product
+from operator import or_
+
+from pandas import DataFrame, Series, Timestamp, concat, date_range, DatetimeIndex, to_datetime, Timedelta
 from numpy import nan, arange
 from bokeh.plotting import figure
 from bokeh.transform import dodge
 from bokeh.models import ColumnDataSource, NumeralTickFormatter, HoverTool
-from app.models import Price, Universe
+from app.models import Price, Universe, FundClassification, bulk_update_fields
+from app.bars import read_bars
+from app.time_slices import time_slices, time_of_day_q
 from django_pandas.io import read_frame
 from app.cache import cache_result
+from app.dependencies import dependency
+from trading.spreads import daily_fair_spreads
+from trading.calendars import get_calendar
+from trading.rolling_regression import rolling_regression, stack_statistics
 from app.enums import one_day, five_minutes, close, mid, ask, bid, index_future, equity_index, trade
+from app.enums import fund as fund_asset_type
+from utils.cloud_logging import logger
 
 GEO_MAPPING = {
     'SPX Index': 'US',
@@ -26,29 +38,42 @@ FUTURE_MAPPING = {
 
 INDEX_TO_FUTURE_PREFIX = {'SPX Index': 'ES', 'TPX Index': 'TP'}
 
+# hedging fx and index day offset of each index, as on the fund classifier forms
+INDEX_FX = {'SPX Index': 'GBPUSD Curncy', 'TPX Index': 'GBPJPY Curncy'}
+
+INDEX_OFFSET = {'SPX Index': -1, 'TPX Index': 0}
+
 holiday_aliases = {'TP1 Index': 'JPX', 'NK1 Index': 'JPX', 'TPX Index': 'JPX', 'SPX Index': 'NYSE',
                    'ES1 Index': 'NYSE', 'HI1 Index': 'HKEX', 'HSI Index': 'HKEX'}
 
 
-def get_time_slices(start_date, end_date, time_or_times, timezone='Europe/London'):
-    dt_range = date_range(start_date, end_date, tz=timezone, freq='5min')
-    df = dt_range.to_frame()
+def time_window(time_or_times):
+    '''
+    :param time_or_times: a time, or an iterable of start and end time
+    :return: (start_time, end_time), end_time None for a single time
+    '''
     if isinstance(time_or_times, str):
-        idx = df.at_time(time_or_times).index.tz_convert('UTC')
-    else:
-        try:
-            leng = len(time_or_times)
-        except Exception:
-            idx = df.at_time(time_or_times).index.tz_convert('UTC')
-        else:
-            if leng == 2:
-                idx = df.between_time(time_or_times[0], time_or_times[1]).index.tz_convert('UTC')
-            else:
-                raise AttributeError('fx_time must be a datetime.time type or an iterable of start_time and end_time')
-
-    idx = idx.tz_localize(None)
-    datetime_list = idx.strftime('%Y-%m-%d %H:%M:%S').tolist()
-    return datetime_list
+        return time_or_times, None
+    try:
+        leng = len(time_or_times)
+    except Exception:
+        return time_or_times, None
+    if leng == 2:
+        return time_or_times[0], time_or_times[1]
+    raise AttributeError('fx_time must be a datetime.time type or an iterable of start_time and end_time')
+
+
+def get_time_slices(start_date, end_date, time_or_times, timezone='Europe/London'):
+    idx = time_slices(start_date, end_date, *time_window(time_or_times), timezone=timezone)
+    return idx.tz_localize(None).strftime('%Y-%m-%d %H:%M:%S').tolist()
+
+
+def time_slices_q(start_date, end_date, time_or_times, timezone='Europe/London'):
+    '''
+    :return: Q object selecting the times of get_time_slices with range predicates instead of a list of them
+    '''
+    return time_of_day_q(start_date, end_date, *time_window(time_or_times), timezone=timezone)
+
 
 def read_prices(**filter_criteria):
     query_set = Price.objects.filter(**filter_criteria)
@@ -75,15 +100,13 @@ def remove_holidays(df, holidays=None):
 
 def get_fund_idx_fx_p_dic(price_dic, fund, index, fx):
     fx_prices = price_dic['bar_price'][(price_dic['bar_price']['symbol'].eq(fx))]
-    pivot_p_dic = {'pivot_idx_fund_p': price_dic['daily_price'], 'pivot_fx_p': fx_prices}
-    for name, price in pivot_p_dic.items():
-        pivot_p_dic[name] = price.pivot_table(index='time', columns='symbol', values='value')
+    pivot_idx_fund_p = price_dic['daily_price'].pivot_table(index='time', columns='symbol', values='value')
     for asset in [fund, index]:
-        pivot_p_dic['pivot_idx_fund_p'][asset].index = pivot_p_dic['pivot_idx_fund_p'][asset].index.tz_localize(None)
-    pivot_p_dic['pivot_fx_p'].name = fx
+        pivot_idx_fund_p[asset].index = pivot_idx_fund_p[asset].index.tz_localize(None)
+    fx_p = fx_prices['close'].sort_index()
+    fx_p.name = fx
 
-    data_dic = {'fx': pivot_p_dic['pivot_fx_p'], 'fund': pivot_p_dic['pivot_idx_fund_p'][fund],
-                'index': pivot_p_dic['pivot_idx_fund_p'][index]}
+    data_dic = {'fx': fx_p, 'fund': pivot_idx_fund_p[fund], 'index': pivot_idx_fund_p[index]}
     return data_dic
 
 def get_formatted_daily_p_dic(fund_idx_fx_p, start_dt, end_dt, index_offset_days, include_holidays):
@@ -114,36 +137,15 @@ def get_formatted_daily_p_dic(fund_idx_fx_p, start_dt, end_dt, index_offset_days
 
 
 def get_offset_date_index(df, index, index_offset_days,  include_holidays):
-    regular_holidays_local = market_calendars.get_calendar(holiday_aliases[index]).regular_holidays.holidays()
-    regular_holidays_local_array = regular_holidays_local.values.astype('<M8[D]')
-    regular_holidays_lse = market_calendars.get_calendar('LSE').regular_holidays.holidays()
-    df = remove_holidays(df, holidays=regular_holidays_lse)
-    if include_holidays:
-        custom_bus_days = CustomBusinessDay(index_offset_days, holidays=regular_holidays_local_array)
-    else:
-        custom_bus_days = CustomBusinessDay(index_offset_days)
-    local_date_index = to_datetime(df.index.date + custom_bus_days)
+    df = remove_holidays(df, holidays=get_calendar('LSE').holidays)
+    local_calendar = get_calendar(holiday_aliases[index] if include_holidays else None)
+    local_date_index = DatetimeIndex(local_calendar.shift(df.index.date, index_offset_days))
     return local_date_index, df
 
 
 def get_spreads_by_date(bar_data_df: DataFrame, index: str):
-    und_index = index
     future = FUTURE_MAPPING[index]
-    spreads = bar_data_df[future] - bar_data_df[und_index]
-    spreads.name = 'spreads'
-    start_time = (to_datetime(reference_price_time_utc[future]) - Timedelta(minutes=50)).time()
-    spread_df = spreads.between_time(start_time, reference_price_time_utc[future]).to_frame()
-    spread_df['trading_date_utc'] = spread_df.index.date
-    trading_day_index = DatetimeIndex(spread_df['trading_date_utc'])
-    spread_df['25% quantile'] = spread_df.groupby('trading_date_utc').quantile(0.25).reindex(index=trading_day_index)[
-        'spreads'].values
-    spread_df['75% quantile'] = spread_df.groupby('trading_date_utc').quantile(0.75).reindex(index=trading_day_index)[
-        'spreads'].values
-    spread_df['eligible_spreads'] = (spread_df['spreads'] > spread_df['25% quantile']) & \
-                                    (spread_df['spreads'] < spread_df['75% quantile'])
-    spread_df['spreads'] = spread_df['spreads'].where(spread_df['eligible_spreads'], nan)
-    eligible_spreads_by_date = spread_df.groupby('trading_date_utc').mean()['spreads']
-    return eligible_spreads_by_date
+    return daily_fair_spreads(bar_data_df[future] - bar_data_df[index], reference_price_time_utc[future])
 
 
 def append_signals(bar_data_df: DataFrame, idx_daily_p: DataFrame, index, include_holidays, index_offset_days):
@@ -227,33 +229,49 @@ def plot_residual_returns_and_signal(return_df):
     return fig
 
 
-@cache_result(timeout_s=24*60*60)
+def daily_price_dependencies(start_dt, end_dt, fund, index):
+    return [dependency('Price', symbols=[fund, index], start=start_dt, end=to_datetime(end_dt) + Timedelta(days=1))]
+
+
+@cache_result(timeout_s=7*24*60*60, local=True, local_timeout_s=60*60, dependencies=daily_price_dependencies)
 def get_daily_prices(start_dt, end_dt, fund, index):
     daily_prices = read_prices(time__gte=start_dt, time__lte=end_dt, resolution=one_day, aspect=close,
                                symbol__in=[fund, index])
     return daily_prices
 
 
-@cache_result(timeout_s=24*60*60)
+def bar_price_dependencies(start_dt, end_dt, index, fx, fx_time):
+    end_dt = to_datetime(end_dt) + Timedelta(days=6)
+    return [dependency('Bar', symbols=[fx, index], prefixes=[INDEX_TO_FUTURE_PREFIX[index]], start=start_dt,
+                       end=end_dt)]
+
+
+def read_fx_prices(start_dt, end_dt, fx, fx_time):
+    fx_prices = read_bars(time_slices_q(start_dt, end_dt, fx_time), resolution=five_minutes, symbol=fx,
+                          price_type__in=[mid, trade])
+    return fx_prices.groupby(['symbol', 'time']).mean(numeric_only=True).reset_index(level='symbol')
+
+
+@cache_result(timeout_s=7*24*60*60, local=True, local_timeout_s=60*60, dependencies=bar_price_dependencies)
 def get_bar_prices(start_dt, end_dt, index, fx, fx_time):
-    val_time_time_slice = get_time_slices(start_dt, end_dt, fx_time)
-    fx_prices = read_prices(time__in=val_time_time_slice, resolution=five_minutes, aspect=close, symbol=fx,
-                            price_type__in=[mid, trade])
-    fx_prices = fx_prices.groupby(['symbol', 'time']).mean().reset_index()
+    fx_prices = read_fx_prices(start_dt, end_dt, fx, fx_time)
     end_dt_timestamp = to_datetime(end_dt) + Timedelta(days=5)
     new_end_dt = end_dt_timestamp.strftime('%Y-%m-%d')
     future_symbol_prefix = INDEX_TO_FUTURE_PREFIX[index]
     end_time_spread = reference_price_time_utc[index]
-    val_time_time_slice = get_time_slices(start_dt, new_end_dt, fx_time)
+    val_time_time_slice = time_slices_q(start_dt, new_end_dt, fx_time)
     start_time_spread = (to_datetime(end_time_spread) - Timedelta(minutes=60)).time().strftime('%H:%M:%S')
-    spread_time_slice = get_time_slices(start_dt, new_end_dt, [start_time_spread, end_time_spread], timezone='UTC')
-    fut_bar_time_slice = list(set(val_time_time_slice + spread_time_slice))
-    fut_5m_p = read_prices(time__in=fut_bar_time_slice, resolution=five_minutes,
-                           asset_type=index_future, symbol__startswith=future_symbol_prefix)
-    idx_5m_p = read_prices(time__in=spread_time_slice, symbol=index, resolution=five_minutes)
+    spread_time_slice = time_slices_q(start_dt, new_end_dt, [start_time_spread, end_time_spread], timezone='UTC')
+    fut_5m_p = read_bars(val_time_time_slice | spread_time_slice, resolution=five_minutes,
+                         asset_type=index_future, symbol__startswith=future_symbol_prefix)
+    idx_5m_p = read_bars(spread_time_slice, symbol=index, resolution=five_minutes)
     return concat([fx_prices, fut_5m_p, idx_5m_p], sort=True)
 
-@cache_result(timeout_s=24*60*60)
+def universe_dependencies(index):
+    return [dependency('Universe', prefixes=[INDEX_TO_FUTURE_PREFIX[index]])]
+
+
+@cache_result(timeout_s=7*24*60*60, local=True, local_timeout_s=60*60, dependencies=universe_dependencies)
 def get_universe(index):
     future_prefix = INDEX_TO_FUTURE_PREFIX[index]
     df = read_universe(symbol__startswith=future_prefix)
@@ -301,31 +319,348 @@ def get_signal(bar_p, daily_p, index, include_holidays, index_offset_days, val_t
     df = df.at_time(val_time_london)
     df.index = df.index.tz_localize(None)
     return df['Signal at val time']
-#
+
+
+def residual_return_and_signal(structured_p, return_df_dic, index, fx_hedged, include_holidays, index_offset_days,
+                               val_time_london):
+    structured_bar_p, daily_idx_p = structured_p['signal_data']
+    residual_return = get_residual_return(return_df_dic, fx_hedged)
+    signal = get_signal(structured_bar_p, daily_idx_p, index, include_holidays, index_offset_days, val_time_london)
+    signal.index = signal.index.date
+    residual_return.index = residual_return.index.date
+    signal_reindex = signal.reindex(index=residual_return.index)
+    return concat([residual_return, signal_reindex], axis='columns')
+
+
 def get_residual_return_and_signal_df(fund, index, fx, start_dt, end_dt,
-                                   val_time_london, index_offset_days, fx_hedged, include_holidays):
-    pass
+                                      val_time_london, index_offset_days, fx_hedged, include_holidays):
+    '''
+    :return: DataFrame of the fund's daily residual return and the signal at the valuation time by date
+    '''
+    price_dic = get_prices(start_dt, end_dt, fund, index, fx, val_time_london)
+    structured_p = get_structured_prices(price_dic, start_dt, end_dt, fund, index, fx, index_offset_days,
+                                         include_holidays)
+    return_df_dic = get_returns(structured_p['residual_return_data'])
+    return residual_return_and_signal(structured_p, return_df_dic, index, fx_hedged, include_holidays,
+                                      index_offset_days, val_time_london)
+
+def get_formatted_daily_p_frame(daily_prices, fx_prices, funds, index, start_dt, end_dt, index_offset_days,
+                                include_holidays):
+    '''
+    get_formatted_daily_p_dic for many funds at once
+    :return: (DataFrame of fund prices with a column per fund, index prices, fx prices) on the same dates
+    '''
+    sliced_fx_p = fx_prices.copy()
+    if sliced_fx_p.index.tz is None:
+        sliced_fx_p.index = sliced_fx_p.index.tz_localize('UTC')
+    sliced_fx_p.index = to_datetime(sliced_fx_p.index.tz_convert('Europe/London').date)
+    sliced_fx_p = sliced_fx_p[start_dt:end_dt]
+
+    dt_range = date_range(start=start_dt, end=end_dt)
+    local_offset_index, df = get_offset_date_index(DataFrame(index=dt_range), index, index_offset_days,
+                                                   include_holidays)
+    pivot = daily_prices.pivot_table(index='time', columns='symbol', values='value').reindex(
+        columns=list(funds) + [index])
+    pivot.index = pivot.index.tz_localize(None)
+    fund_p = pivot[list(funds)].reindex(df.index)
+    index_p = Series(pivot[index].reindex(dt_range).fillna(method='ffill').reindex(local_offset_index).values,
+                     index=df.index, name=index)
+    fx_p = sliced_fx_p.reindex(df.index)
+    return fund_p.iloc[1:], index_p.iloc[1:], fx_p.iloc[1:]
+
+
+def fund_statistics(fund_returns: DataFrame, index_returns: Series, fx_returns: Series, fx_hedged):
+    '''
+    get_correlation, get_beta and the residual statistics of every fund column in one vectorized pass
+    Each fund only uses the dates where both it and the hedge have a return, like Series.corr and Series.cov
+    :return: DataFrame of correlation, beta, residual_mean, residual_std and observations by fund
+    '''
+    hedging_return = index_returns if fx_hedged else index_returns - fx_returns
+    hedge = DataFrame({fund: hedging_return for fund in fund_returns.columns}, index=fund_returns.index)
+    valid = fund_returns.notna() & hedge.notna()
+    funds, hedges = fund_returns.where(valid), hedge.where(valid)
+    observations = valid.sum()
+    fund_deviations, hedge_deviations = funds - funds.mean(), hedges - hedges.mean()
+    covariance = (fund_deviations * hedge_deviations).sum() / (observations - 1)
+    fund_variance = (fund_deviations ** 2).sum() / (observations - 1)
+    hedge_variance = (hedge_deviations ** 2).sum() / (observations - 1)
+    residual_return = fund_returns.sub(index_returns, axis='index')
+    if not fx_hedged:
+        residual_return = residual_return.add(fx_returns, axis='index')
+    residual_return = residual_return.iloc[1:]
+    return DataFrame({'correlation': covariance / (fund_variance * hedge_variance) ** 0.5,
+                      'beta': covariance / hedging_return.var(),
+                      'residual_mean': residual_return.mean(),
+                      'residual_std': residual_return.std(),
+                      'observations': observations})
+
+
+def read_fund_returns(funds, index, fx, fx_time, start_date, end_date, index_offset, include_holidays):
+    '''
+    get_returns for many funds at once, loading the index and fx prices once
+    :return: (DataFrame of fund returns with a column per fund, index returns, fx returns)
+    '''
+    funds = list(funds)
+    daily_prices = read_prices(time__gte=start_date, time__lte=end_date, resolution=one_day, aspect=close,
+                               symbol__in=funds + [index])
+    fx_prices = read_fx_prices(start_date, end_date, fx, fx_time)['close'].sort_index()
+    fund_p, index_p, fx_p = get_formatted_daily_p_frame(daily_prices, fx_prices, funds, index, start_date, end_date,
+                                                        index_offset, include_holidays)
+    return fund_p.pct_change(), index_p.pct_change(), fx_p.pct_change()
+
+
+def classify_funds(funds, index, fx, fx_time, start_date, end_date, index_offset, has_currency_hedge,
+                   include_holidays):
+    '''
+    Statistics of many funds against one index and fx, loading the index and fx prices once
+    :return: DataFrame as returned by fund_statistics
+    '''
+    fund_r, index_r, fx_r = read_fund_returns(funds, index, fx, fx_time, start_date, end_date, index_offset,
+                                              include_holidays)
+    return fund_statistics(fund_r, index_r, fx_r, has_currency_hedge)
+
+
+def fund_candidates(funds=None):
+    '''
+    :return: DataFrame of the latest Universe row of every fund with the index it is classified against
+    '''
+    df = read_universe(asset_type=fund_asset_type)
+    if funds is not None:
+        df = df[df['symbol'].isin(funds)]
+    df = df.sort_values('as_of', ascending=False).drop_duplicates(subset='symbol', keep='first')
+    geo_index = {geo: index for index, geo in GEO_MAPPING.items()}
+    df.loc[:, 'index'] = df['underlying_index'].where(df['underlying_index'].isin(INDEX_FX.keys()),
+                                                      df['geo'].map(geo_index))
+    return df[df['index'].notna()]
+
+
+def classification_rows(stats: DataFrame, index, fx, start_date, end_date, include_holidays):
+    '''
+    :param stats: fund_statistics with fund, has_currency_hedge, index_offset and fx_time columns
+    :return: FundClassification rows, with the residual statistics and observations kept alongside
+    '''
+    # rsq holds the correlation, as saved from the fund classifier form
+    return DataFrame({'fund': stats['fund'].values, 'index': index, 'fx': fx,
+                      'has_currency_hedge': stats['has_currency_hedge'].values,
+                      'index_offset': stats['index_offset'].values, 'fx_time': stats['fx_time'].values,
+                      'start_date': to_datetime(start_date).date(), 'end_date': to_datetime(end_date).date(),
+                      'include_holidays': include_holidays, 'rsq': stats['correlation'].values,
+                      'beta': stats['beta'].values, 'approved': False,
+                      'residual_mean': stats['residual_mean'].values, 'residual_std': stats['residual_std'].values,
+                      'observations': stats['observations'].values})
+
+
+def save_fund_classifications(df: DataFrame):
+    '''
+    Insert the rows with an rsq and a beta into FundClassification. Every other column is part of the unique key,
+    so an existing row could only differ by as_of, which stays the time the classification was first saved.
+    :return: counts of the upsert
+    '''
+    classified = df[df['rsq'].notna() & df['beta'].notna()] if len(df.index) > 0 else df
+    if len(classified.index) == 0:
+        return {'inserted': 0, 'updated': 0, 'unchanged': 0}
+    from app.upsert import bulk_upsert
+    rows = classified[bulk_update_fields['FundClassification']]
+    _, counts = bulk_upsert('FundClassification', rows.assign(as_of=Timestamp.utcnow()), save_new=True,
+                            update_existing=False)
+    return counts
+
+
+def batch_fund_classification(start_date, end_date, funds=None, fx_time=time(12), index_offset=None,
+                              has_currency_hedge=False, include_holidays=False, save=True):
+    '''
+    Classify every fund of the Universe, one classify_funds pass per index
+    :param funds: symbols to classify, every fund of the Universe by default
+    :param index_offset: index day offset, INDEX_OFFSET of the fund's index by default
+    :param save: upsert the classifications into FundClassification
+    :return: (DataFrame of FundClassification rows with the residual statistics, counts of the upsert)
+    '''
+    frames = []
+    for index, candidates in fund_candidates(funds).groupby('index'):
+        fx = INDEX_FX[index]
+        offset = INDEX_OFFSET[index] if index_offset is None else index_offset
+        try:
+            stats = classify_funds(candidates['symbol'], index, fx, fx_time, start_date, end_date, offset,
+                                   has_currency_hedge, include_holidays)
+        except (KeyError, ValueError) as e:
+            logger.warning('fund_classifier | classifying the ' + index + ' funds failed: ' + repr(e))
+            continue
+        stats = stats.rename_axis('fund').reset_index().assign(has_currency_hedge=has_currency_hedge,
+                                                               index_offset=offset, fx_time=fx_time)
+        frames.append(classification_rows(stats, index, fx, start_date, end_date, include_holidays))
+    df = concat(frames, ignore_index=True) if len(frames) > 0 else DataFrame()
+    counts = save_fund_classifications(df) if save else {'inserted': 0, 'updated': 0, 'unchanged': 0}
+    return df, counts
+
+
+GRID_INDEX_OFFSETS = (-2, -1, 0, 1)
+
+GRID_FX_TIMES = tuple(time(hour) for hour in range(8, 17))
+
+GRID_HEDGES = (False, True)
+
+# prices of the running grid search, set once per worker process
+grid_data = {}
+
+
+def set_grid_data(data):
+    grid_data.clear()
+    grid_data.update(data)
+
+
+def read_fx_fixes(start_dt, end_dt, fx, fx_times):
+    '''
+    :return: dict of fx_time: fx close Series, from a single query for all the London times
+    '''
+    fx_prices = read_bars(reduce(or_, [time_slices_q(start_dt, end_dt, fx_time) for fx_time in fx_times]),
+                          resolution=five_minutes, symbol=fx, price_type__in=[mid, trade])
+    if len(fx_prices.index) == 0:
+        return {fx_time: Series(dtype='float64', index=DatetimeIndex([], tz='UTC')) for fx_time in fx_times}
+    fx_p = fx_prices.groupby('time')['close'].mean().sort_index()
+    london = DatetimeIndex(fx_p.index)
+    london = (london.tz_localize('UTC') if london.tz is None else london).tz_convert('Europe/London')
+    return {fx_time: fx_p[london.time == fx_time] for fx_time in fx_times}
+
+
+def evaluate_combination(combination):
+    '''
+    :param combination: (index_offset, fx_time)
+    :return: fund_statistics of every fund and hedge setting for the combination
+    '''
+    index_offset, fx_time = combination
+    data = grid_data
+    fund_p, index_p, fx_p = get_formatted_daily_p_frame(data['daily_prices'], data['fx_fixes'][fx_time],
+                                                        data['funds'], data['index'], data['start_dt'],
+                                                        data['end_dt'], index_offset, data['include_holidays'])
+    fund_r, index_r, fx_r = fund_p.pct_change(), index_p.pct_change(), fx_p.pct_change()
+    return concat([fund_statistics(fund_r, index_r, fx_r, hedged).rename_axis('fund').reset_index().assign(
+        index_offset=index_offset, fx_time=fx_time, has_currency_hedge=hedged) for hedged in data['hedges']],
+        ignore_index=True)
+
+
+def grid_search(funds, index, fx, start_dt, end_dt, index_offsets=GRID_INDEX_OFFSETS, fx_times=GRID_FX_TIMES,
+                hedges=GRID_HEDGES, include_holidays=False, max_workers=None):
+    '''
+    Evaluate every index_offset, fx_time and has_currency_hedge combination for many funds. The prices are loaded
+    once and handed to each worker process once, each combination only realigns them.
+    :param max_workers: size of the process pool, 0 to evaluate in this process
+    :return: FundClassification rows of every fund and combination ranked by rsq within each fund
+    '''
+    funds = list(funds)
+    daily_prices = read_prices(time__gte=start_dt, time__lte=end_dt, resolution=one_day, aspect=close,
+                               symbol__in=funds + [index])
+    data = {'daily_prices': daily_prices, 'fx_fixes': read_fx_fixes(start_dt, end_dt, fx, fx_times), 'funds': funds,
+            'index': index, 'start_dt': start_dt, 'end_dt': end_dt, 'include_holidays': include_holidays,
+            'hedges': list(hedges)}
+    combinations = list(product(index_offsets, fx_times))
+    if max_workers == 0 or len(combinations) == 1:
+        set_grid_data(data)
+        results = [evaluate_combination(combination) for combination in combinations]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=set_grid_data, initargs=(data,)) as pool:
+            results = list(pool.map(evaluate_combination, combinations))
+    df = classification_rows(concat(results, ignore_index=True), index, fx, start_dt, end_dt, include_holidays)
+    df.loc[:, 'rank'] = df.groupby('fund')['rsq'].rank(ascending=False, method='first', na_option='bottom').astype(int)
+    return df.sort_values(['fund', 'rank']).reset_index(drop=True)
+
+
+def val_time_search_by_correlation(fund, index, fx, start_dt, end_dt, include_holidays=False, save=True,
+                                   max_workers=None, **grid):
+    '''
+    Find the index_offset, fx_time and has_currency_hedge which correlate the fund best with its hedge
+    :param grid: index_offsets, fx_times or hedges to search instead of the GRID_ defaults
+    :param save: upsert the winning combination into FundClassification
+    :return: DataFrame of every combination, best first
+    '''
+    ranked = grid_search([fund], index, fx, start_dt, end_dt, include_holidays=include_holidays,
+                         max_workers=max_workers, **grid)
+    if save:
+        save_fund_classifications(ranked[ranked['rank'] == 1])
+    return ranked
+
+
+def search_fund_classifications(start_date, end_date, funds=None, include_holidays=False, save=True,
+                                max_workers=None):
+    '''
+    grid_search every fund of the Universe, one search per index
+    :return: (DataFrame of the winning combination of each fund, counts of the upsert)
+    '''
+    frames = []
+    for index, candidates in fund_candidates(funds).groupby('index'):
+        ranked = grid_search(candidates['symbol'], index, INDEX_FX[index], start_date, end_date,
+                             include_holidays=include_holidays, max_workers=max_workers)
+        frames.append(ranked[ranked['rank'] == 1])
+    df = concat(frames, ignore_index=True) if len(frames) > 0 else DataFrame()
+    counts = save_fund_classifications(df) if save else {'inserted': 0, 'updated': 0, 'unchanged': 0}
+    return df, counts
+
+
+REGRESSION_SETTINGS = ['index', 'fx', 'fx_time', 'index_offset', 'has_currency_hedge']
+
+
+def rolling_fund_statistics(funds, index, fx, fx_time, start_date, end_date, index_offset, has_currency_hedge,
+                            include_holidays=False, window=None):
+    '''
+    Rolling or expanding beta, r squared and residual volatility of many funds against their hedge
+    :param window: number of return dates in each window, expanding from start_date if None
+    :return: dict of statistic: DataFrame by date with a column per fund, as returned by rolling_regression
+    '''
+    fund_r, index_r, fx_r = read_fund_returns(funds, index, fx, fx_time, start_date, end_date, index_offset,
+                                              include_holidays)
+    hedging_return = index_r if has_currency_hedge else index_r - fx_r
+    return rolling_regression(fund_r, hedging_return, window)
+
+
+def latest_classifications(funds=None):
+    '''
+    :return: DataFrame of the latest FundClassification of every fund
+    '''
+    qs = FundClassification.objects.all() if funds is None else FundClassification.objects.filter(fund__in=funds)
+    df = read_frame(qs.order_by('-as_of'))
+    return df.drop_duplicates(subset='fund', keep='first')
+
+
+def batch_fund_regressions(start_date, end_date, window=None, funds=None, include_holidays=False, save=True):
+    '''
+    Rolling statistics of every classified fund with the settings of its latest classification, one
+    rolling_fund_statistics pass per group of funds sharing them
+    :param window: number of return dates in each window, expanding if None
+    :param funds: symbols to regress, every classified fund by default
+    :param save: upsert the statistics into FundRegression
+    :return: (DataFrame of FundRegression rows, counts of the upsert)
+    '''
+    classifications = latest_classifications(funds)
+    frames = []
+    for settings, group in classifications.groupby(REGRESSION_SETTINGS):
+        settings = dict(zip(REGRESSION_SETTINGS, settings))
+        try:
+            statistics = rolling_fund_statistics(group['fund'], start_date=start_date, end_date=end_date,
+                                                 include_holidays=include_holidays, window=window, **settings)
+        except (KeyError, ValueError) as e:
+            logger.warning('fund_classifier | regressing the ' + settings['index'] + ' funds failed: ' + repr(e))
+            continue
+        frames.append(stack_statistics(statistics).assign(window=0 if window is None else window, **settings))
+    df = concat(frames, ignore_index=True) if len(frames) > 0 else DataFrame()
+    if not save or len(df.index) == 0:
+        return df, {'inserted': 0, 'updated': 0, 'unchanged': 0}
+    from app.upsert import bulk_upsert
+    rows = df.assign(date=to_datetime(df['date']).dt.date, as_of=Timestamp.utcnow())
+    rows = rows.astype(object).where(rows.notnull(), None)
+    _, counts = bulk_upsert('FundRegression', rows, save_new=True, update_existing=True)
+    return df, counts
 
-def val_time_search_by_correlation(fund, index, fx, start_dt, end_dt):
-    pass
 
 def calculate_fund_classification(fund, index, fx, has_currency_hedge, index_offset, fx_time, start_date,
                                   end_date, include_holidays, **kwargs):
 
     price_dic = get_prices(start_date, end_date, fund, index, fx, fx_time)
     structured_p = get_structured_prices(price_dic, start_date, end_date, fund, index, fx, index_offset, include_holidays)
-    structured_bar_p, daily_idx_p = structured_p['signal_data']
     return_df_dic = get_returns(structured_p['residual_return_data'])
 
-    residual_return = get_residual_return(return_df_dic, has_currency_hedge)
     correlation = get_correlation(return_df_dic, has_currency_hedge)
     beta = get_beta(return_df_dic, has_currency_hedge)
-    # std_residual = get_std_residuals(residual_return)
-    signal = get_signal(structured_bar_p, daily_idx_p, index, include_holidays, index_offset, fx_time)
-    signal.index = signal.index.date
-    residual_return.index = residual_return.index.date
-    signal_reindex = signal.reindex(index=residual_return.index)
-    residual_and_signal_df = concat([residual_return, signal_reindex], axis='columns')
+    residual_and_signal_df = residual_return_and_signal(structured_p, return_df_dic, index, has_currency_hedge,
+                                                        include_holidays, index_offset, fx_time)
     bokeh_fig = plot_residual_returns_and_signal(residual_and_signal_df)
 
     return correlation, beta, bokeh_fig
@@ -1,24 +1,42 @@
+from datetime import datetime, time, timedelta
 from functools import partial
-from math import nan
+from math import nan, ceil
 
-from pandas import DataFrame, merge, concat, to_datetime
+from django.conf import settings
+from django.utils import timezone
+
+from numpy import where
+from pandas import DataFrame, Series, Timestamp, Timedelta, merge, to_datetime
 
 from data.http.exante import ExanteClient
+from data.http.exante_async import AsyncExanteClient
+from data.http.bar_cache import get_bar_cache
+from data.http.quotes import get_quote_table
 from app.asset import Future
-from utils import swallow_and_log_exception
+from trading.spreads import RollingSpread, get_spread_estimator
+from utils import StageTimer
+from utils.cloud_logging import logger
 from app.cache import cache_result
 
 status = 'live'
+CONTRACTS_TIMEOUT_S = 60
+# fair spreads are the trimmed mean of the latest SPREAD_WINDOW five minute bars
+SPREAD_WINDOW = 20
+SPREAD_BAR_LENGTH_S = 300
 exante_client = None
 
 
 def get_exante_client():
     global exante_client
     if exante_client is None:
-        exante_client = ExanteClient.create(status=status)
+        exante_client = ExanteClient.create(status=status, bar_cache=get_bar_cache(), quote_table=get_quote_table())
     return exante_client
 
 
+def get_async_exante_client():
+    return AsyncExanteClient.create(status=status, bar_cache=get_bar_cache(), quote_table=get_quote_table())
+
+
 def estimate_cost(info, price):
     fx_costs = 2 / 10000
     futures_costs = info['mpi'] / price['close']
@@ -27,94 +45,176 @@ def estimate_cost(info, price):
     return fx_costs + futures_costs + fund_costs + interest
 
 
-def start_and_end_timestamps(df):
-    return df.iloc[-1]["timestamp"], df.iloc[0]["timestamp"]
-
-
-@swallow_and_log_exception(default=float('nan'))
-@cache_result(3*60*60, validate=lambda x: isinstance(x, float))
-def fair_spread(index_symbol, future_symbol):
-    exante_client = get_exante_client()
-    index_bars = exante_client.OHLC(index_symbol, bar_length_seconds=300,
-                                    number_of_bars=20)  # OHLC("SPX.INDEX", 60, 2)
-    start_time, end_time = start_and_end_timestamps(index_bars)
-    future_bars = exante_client.OHLC(future_symbol, bar_length_seconds=300, number_of_bars=20,
-                                     start_time=start_time, end_time=end_time)
-    df = merge(future_bars, index_bars, on="datetime")
-    df = df.rename(columns={"close_x": "future_close", "close_y": "index_close"})
-    df.loc[:, "spread"] = df["future_close"] - df["index_close"]
-    df = df.sort_values(by="spread")
-    quartile = int(df["spread"].count() / 4)
-    df = df.iloc[quartile:-quartile]
-    spread = df["spread"].mean()
-    return spread
-
-
-signal_cols = ['index', 'future', 'future price', 'index price', 'fair spread', 'time', 'gross_signal', 'net_signal']
+def bars_needed(estimator: RollingSpread, now: Timestamp):
+    '''
+    :return: how many of the latest bars to download to bring the estimator up to date, the whole window when
+    it is new or far behind
+    '''
+    if len(estimator) < SPREAD_WINDOW:
+        return SPREAD_WINDOW
+    behind = (now - to_datetime(estimator.last_time, utc=True)) / Timedelta(seconds=SPREAD_BAR_LENGTH_S)
+    return int(min(SPREAD_WINDOW, max(0, ceil(behind)) + 1))
 
 
-def signal_error():
-    vals = ['n/a', 'n/a', nan, nan, nan, nan, nan, nan]
-    return DataFrame([vals], columns=signal_cols)
+def fair_spreads(pairs, index_bars, future_bars):
+    '''
+    Feed the future minus index closes of the bars both legs have into each pair's rolling estimator
+    :param pairs: list of (index, future symbol)
+    :param index_bars: OHLC DataFrames of the indexes in the order of pairs, None where the request failed
+    :param future_bars: the same for the futures
+    :return: Series of fair spread by index, the last estimate where no new bars arrived
+    '''
+    spreads = {}
+    for (index, future), index_df, future_df in zip(pairs, index_bars, future_bars):
+        estimator = get_spread_estimator(index, future, SPREAD_WINDOW)
+        if all(df is not None and 'close' in df.columns and 'datetime' in df.columns for df in (index_df, future_df)):
+            df = merge(future_df[['datetime', 'close']], index_df[['datetime', 'close']], on='datetime',
+                       suffixes=('_future', '_index')).sort_values('datetime')
+            for time_, spread in zip(df['datetime'], df['close_future'] - df['close_index']):
+                estimator.update(time_, spread)
+        spreads[index] = estimator.fair_spread(median_when_tied=True)
+    return Series(spreads, dtype='float64')
 
 
-@cache_result(24*60*60)
+@cache_result(24*60*60, validate=lambda x: 'error' not in x, local=True, stale_while_revalidate_s=24*60*60)
 def get_nearest(index):
     exante_client = get_exante_client()
     return exante_client.nearest(index)
 
 
-@cache_result(60*60)
+# short fallback for deployments where run_quote_subscriber is not running and every call polls Exante
+@cache_result(ExanteClient.QUOTE_MAX_AGE_S, local=True, local_timeout_s=10)
 def get_latest_index(symbol):
+    '''
+    :return: latest_price record, whose close is the bid/ask mid while the quote subscriber streams the symbol and
+    the last one minute bar close otherwise
+    '''
     exante_client = get_exante_client()
     return exante_client.latest_price(symbol)
 
 
-@swallow_and_log_exception(default=signal_error())
-def calculate_signal(index: str):
-    exante_client = get_exante_client()
-    index_symbol = index + exante_client.INDEX_SUFFIX
-    info = get_nearest(index)
-    future_symbol = info["id"]
-    spread = fair_spread(index_symbol, future_symbol)
-    future_price = exante_client.latest_price(future_symbol)
-    index_price = get_latest_index(index_symbol)
-    start_price = index_price["close"] + spread
-    gross_signal = (future_price["close"] - start_price) / start_price
-    cost = estimate_cost(info, future_price)
-    if gross_signal > 0:
-        net_signal = max(gross_signal - cost, 0)
-    else:
-        net_signal = min(gross_signal + cost, 0)
-    data = [{"Index": index_symbol,
-             "Future": future_symbol,
-             "Future Price": future_price["close"],
-             "Index Price": index_price["close"],
-             "Fair Spread": spread,
-             "Time": future_price["datetime"],
-             "Gross Signal": gross_signal,
-             'Net Signal': net_signal}]
-    return DataFrame(data)
+# last signal computation's seconds per stage: nearest, market_data, spreads, signals, total
+signal_timings = {}
+
+
+def bar_time_range(bars):
+    '''
+    :return: (first, last) bar timestamps in milliseconds, None if there are no bars
+    '''
+    if bars is None or 'timestamp' not in bars.columns or len(bars.index) == 0:
+        return None
+    return int(bars['timestamp'].min()), int(bars['timestamp'].max())
+
+
+async def fetch_market_data(client, pairs, number_of_bars):
+    '''
+    Request the bars and latest prices of every index as one concurrent batch, then the bars of every future over
+    its index bars' time window as a second one, so that outside the cash session both legs cover the same times
+    :param pairs: list of (index symbol, future symbol)
+    :param number_of_bars: list of how many of the latest index bars to download per pair
+    :return: (index bars, future bars, index prices, future prices) lists in the order of pairs, None where a
+    request failed or the index has no bars to align the future with
+    '''
+    async def safely(coroutine, symbol):
+        try:
+            return await coroutine
+        except Exception as e:
+            logger.warning('mft | market data for ' + str(symbol) + ' failed: ' + repr(e))
+            return None
+
+    async def nothing():
+        return None
+
+    index_symbols, future_symbols = [p[0] for p in pairs], [p[1] for p in pairs]
+    calls = [safely(client.OHLC(s, bar_length_seconds=SPREAD_BAR_LENGTH_S, number_of_bars=n), s)
+             for s, n in zip(index_symbols, number_of_bars)] + \
+            [safely(client.latest_price(s), s) for s in index_symbols + future_symbols]
+    results = await client.gather(*calls)
+    n = len(pairs)
+    index_bars, prices = results[:n], results[n:]
+    ranges = [bar_time_range(bars) for bars in index_bars]
+    future_bars = await client.gather(*[
+        nothing() if time_range is None else
+        safely(client.OHLC(s, bar_length_seconds=SPREAD_BAR_LENGTH_S, number_of_bars=bars,
+                           start_time=time_range[0], end_time=time_range[1]), s)
+        for s, bars, time_range in zip(future_symbols, number_of_bars, ranges)])
+    return index_bars, future_bars, prices[:n], prices[n:]
+
+
+def nearest_info(index):
+    try:
+        return get_nearest(index)
+    except Exception as e:
+        logger.warning('mft | nearest future of ' + index + ' failed: ' + repr(e))
+        return {}
+
+
+def price_column(prices, field):
+    return [nan if price is None else price.get(field, nan) for price in prices]
+
+
+def compute_signals(indexes):
+    '''
+    Signals for all indexes from a single concurrent batch of bar and quote requests, computed in one pass
+    :return: DataFrame with one row per index, 'n/a' futures where the nearest contract is unknown
+    '''
+    timer = StageTimer()
+    client = get_async_exante_client()
+    infos = [nearest_info(index) for index in indexes]
+    known = [i for i, info in enumerate(infos) if 'id' in info]
+    timer('nearest')
+    pairs = [(indexes[i] + client.INDEX_SUFFIX, infos[i]['id']) for i in known]
+    known_indexes = [indexes[i] for i in known]
+    now = Timestamp.utcnow()
+    number_of_bars = [bars_needed(get_spread_estimator(index, infos[i]['id'], SPREAD_WINDOW), now)
+                      for index, i in zip(known_indexes, known)]
+    index_bars, future_bars, index_prices, future_prices = \
+        client.run_sync(fetch_market_data, client, pairs, number_of_bars) if len(pairs) > 0 else ([], [], [], [])
+    timer('market_data')
+    spreads = fair_spreads([(index, infos[i]['id']) for index, i in zip(known_indexes, known)],
+                           index_bars, future_bars)
+    timer('spreads')
+    df = DataFrame({'index': indexes,
+                    'Index': [index + client.INDEX_SUFFIX for index in indexes],
+                    'Future': [info.get('id', 'n/a') for info in infos],
+                    'mpi': [info.get('mpi', nan) for info in infos]})
+    known_prices = DataFrame({'index': known_indexes,
+                              'Future Price': price_column(future_prices, 'close'),
+                              'Index Price': price_column(index_prices, 'close'),
+                              'Time': price_column(future_prices, 'datetime')}, columns=[
+        'index', 'Future Price', 'Index Price', 'Time'])
+    df = df.merge(known_prices, on='index', how='left')
+    df.loc[:, 'Fair Spread'] = df['index'].map(spreads).astype(float)
+    start_price = df['Index Price'] + df['Fair Spread']
+    gross_signal = (df['Future Price'] - start_price) / start_price
+    cost = estimate_cost({'mpi': df['mpi']}, {'close': df['Future Price']})
+    df.loc[:, 'Gross Signal'] = gross_signal
+    df.loc[:, 'Net Signal'] = where(gross_signal > 0, (gross_signal - cost).clip(lower=0),
+                                    (gross_signal + cost).clip(upper=0))
+    timer('signals')
+    signal_timings.clear()
+    signal_timings.update(timer.finish())
+    logger.debug('mft | signal timings ' + str(signal_timings))
+    return df[['Index', 'Future', 'Future Price', 'Index Price', 'Fair Spread', 'Time', 'Gross Signal', 'Net Signal']]
 
 
 def calculate_signals(*indexes):
-    signals = []
-    for index in indexes:
-        signal = calculate_signal(index)
-        signals.append(signal)
-    return concat(signals)
+    return compute_signals(list(indexes))
+
+
+async def fetch_contracts(client, symbols):
+    infos = await client.batch_api_request(client.nearest, symbols)
+    ids = [info['id'] for info in infos]
+    currencies = list({info['currency'] for info in infos})
+    prices, crossrates = await client.gather(client.batch_api_request(client.latest_price, ids),
+                                             client.batch_api_request(client.gbp_rate, currencies))
+    return infos, prices, crossrates
 
 
 def contract_information():
-    exante_client = get_exante_client()
+    client = get_async_exante_client()
     symbols = ['SPX', 'TOPIX', 'HSI', 'RTY']
-    infos = exante_client.batch_api_request(exante_client.nearest, symbols)
-    currencies, ids = set(), list()
-    for info in infos:
-        ids.append(info['id'])
-        currencies.add(info['currency'])
-    prices = exante_client.batch_api_request(exante_client.latest_price, ids)
-    crossrates = exante_client.batch_api_request(exante_client.gbp_rate, currencies)
+    infos, prices, crossrates = client.run_sync(fetch_contracts, client, symbols)
     df = DataFrame(infos)
     prices = DataFrame(prices)
     df = df.merge(prices, left_on='id', right_on='symbol', how='left')
@@ -128,8 +228,101 @@ def contract_information():
     return df
 
 
+@cache_result(CONTRACTS_TIMEOUT_S, local=True)
+def cached_contract_information():
+    '''
+    Contract sizes shared by the contracts page and every live feed, recomputed at most once a minute
+    '''
+    return contract_information()
+
+
+SNAPSHOT_FIELDS = {'Index': 'index', 'Future': 'future', 'Future Price': 'future_price',
+                   'Index Price': 'index_price', 'Fair Spread': 'fair_spread', 'Time': 'quote_time',
+                   'Gross Signal': 'gross_signal', 'Net Signal': 'net_signal'}
+
+
+def in_market_hours(now: datetime):
+    '''
+    :param now: UTC time
+    :return: True on weekdays between the hours in settings.SIGNAL_MARKET_HOURS_UTC
+    '''
+    start, end = [time.fromisoformat(t) for t in settings.SIGNAL_MARKET_HOURS_UTC]
+    return now.weekday() < 5 and start <= now.time() < end
+
+
+def save_signal_snapshot(df: DataFrame, as_of: datetime = None):
+    '''
+    :param df: as returned by compute_signals
+    :return: the snapshot time
+    '''
+    from app.models import SignalSnapshot
+    as_of = Timestamp.utcnow() if as_of is None else as_of
+    records = df.rename(columns=SNAPSHOT_FIELDS)[list(SNAPSHOT_FIELDS.values())].copy()
+    records.loc[:, 'quote_time'] = to_datetime(records['quote_time'], utc=True)
+    records = records.astype(object).where(records.notnull(), None)
+    SignalSnapshot.objects.bulk_create([SignalSnapshot(time=as_of, **record)
+                                        for record in records.to_dict(orient='records')])
+    return as_of
+
+
+def snapshot_frame(rows):
+    df = DataFrame.from_records(list(rows), columns=['time'] + list(SNAPSHOT_FIELDS.values()))
+    df = df.rename(columns={field: column for column, field in SNAPSHOT_FIELDS.items()})
+    floats = ['Future Price', 'Index Price', 'Fair Spread', 'Gross Signal', 'Net Signal']
+    df.loc[:, floats] = df[floats].astype(float)
+    return df
+
+
+def latest_signal_snapshot(max_age_s: float = None):
+    '''
+    :return: the signals of the latest snapshot in the columns of compute_signals,
+    None if there is none or it is more than max_age_s old
+    '''
+    from app.models import SignalSnapshot
+    latest = SignalSnapshot.objects.order_by('-time').values_list('time', flat=True).first()
+    if latest is None or (max_age_s is not None and latest < timezone.now() - timedelta(seconds=max_age_s)):
+        return None
+    rows = SignalSnapshot.objects.filter(time=latest).order_by('id').values_list('time', *SNAPSHOT_FIELDS.values())
+    return snapshot_frame(rows).drop(columns=['time'])
+
+
+def signal_history(index: str, start: datetime = None, end: datetime = None):
+    '''
+    :param index: e.g. "SPX.INDEX"
+    :return: every snapshot of the index between start and end, with the snapshot time in the time column
+    '''
+    from app.models import SignalSnapshot
+    rows = SignalSnapshot.objects.filter(index=index)
+    if start is not None:
+        rows = rows.filter(time__gte=start)
+    if end is not None:
+        rows = rows.filter(time__lte=end)
+    return snapshot_frame(rows.order_by('time').values_list('time', *SNAPSHOT_FIELDS.values()))
+
+
+def produce_signal_snapshot(indexes=None):
+    indexes = settings.SIGNAL_INDEXES if indexes is None else indexes
+    df = compute_signals(list(indexes))
+    save_signal_snapshot(df)
+    return df
+
+
+@cache_result(CONTRACTS_TIMEOUT_S, local=True)
+def cached_signals():
+    '''
+    Signals of settings.SIGNAL_INDEXES computed on request, shared by every request for a minute and not saved:
+    only the produce_signal_snapshots command writes snapshots
+    '''
+    return compute_signals(list(settings.SIGNAL_INDEXES))
+
+
 def signal_data():
-    return calculate_signals("SPX", "TOPIX", "HSI")
+    '''
+    Signals from the latest snapshot written by the produce_signal_snapshots command, computed here only when
+    the producer has not written one recently, e.g. outside market hours
+    '''
+    snapshot = latest_signal_snapshot(settings.SIGNAL_SNAPSHOT_MAX_AGE_S)
+    return cached_signals() if snapshot is None else snapshot
 
 
 if __name__ == "__main__":
@@ -142,10 +335,9 @@ if __name__ == "__main__":
     index_symbol = index + exante_client.INDEX_SUFFIX
     info = exante_client.nearest(index)
     future_symbol = info["id"]
-    #spread = fair_spread(index_symbol, future_symbol)
 
     index_bars = exante_client.OHLC(index_symbol, bar_length_seconds=300,
                                     number_of_bars=20)
     #data = exante_client.OHLC(index_symbol, bar_length_seconds=300, number_of_bars=20)
-    data = calculate_signal(index)
+    data = calculate_signals(index)
     print(data)
@@ -1,7 +1,6 @@
 from pandas import Series, to_timedelta, to_datetime, DatetimeIndex, DataFrame, date_range, concat, Timedelta, isnull, NaT
-from pandas.tseries.offsets import BDay, CustomBusinessDay
-import pandas_market_calendars as market_calendars
-from numpy import nan, busday_count, concatenate, datetime64
+from pandas.tseries.offsets import BDay
+from numpy import nan, concatenate, datetime64
 from app.enums import index_future, one_day, close, trade, nav, equity_index, fx_spot, open, high, low
 from django.db.models import Q
 from functools import reduce
@@ -9,7 +8,11 @@ from operator import or_
 from django_pandas.io import read_frame
 from app.models import Price, Universe, SimResult
 from trading.fund_classifier import read_prices
+from app.bars import read_bars
+from data.archive import read_archived_prices, read_archived_bars
 from app.cache import cache_result
+from trading.spreads import daily_fair_spreads
+from trading.calendars import get_calendar
 
 # ============================================ Default Configs ======================================================
 
@@ -41,8 +44,6 @@ day_offset = {'TP1 Index': 0, 'NK1 Index': 0, 'ES1 Index': -1, 'HI1 Index': 0,
               'GBPJPY Curncy': 0, 'GBPUSD Curncy': 0, 'GBPHKD Curncy': 0, 'TPX Index': 0, 'SPX Index': -1,
               'HSI Index': 0}
 
-regular_holidays_lse = market_calendars.get_calendar('LSE').regular_holidays.holidays()
-lse_holidays_array = regular_holidays_lse.values.astype('<M8[D]')
 INDEX_TO_FUTURE_PREFIX = {'SPX Index': 'ES', 'TPX Index': 'TP'}
 INDEX_TO_VOL_MAP = {'SPX Index': 'VIX Index', 'TPX Index': 'VNKY Index'}
 
@@ -116,30 +117,22 @@ def get_stitched_future_series(fut_bar_price, start_dt, end_dt, underlying_index
     end_dt = end_dt_timestamp.strftime('%Y-%m-%d')
     data_dt_range_idx = date_range(start=start_dt, end=end_dt, freq='5min', tz='UTC')
 
-    regular_holidays_local = market_calendars.get_calendar(
-        holiday_aliases[underlying_index]).regular_holidays.holidays()
-    regular_holidays_local_array = regular_holidays_local.values.astype('<M8[D]')
     fut_ex_dt = fut_universe.set_index('expiry_date')['symbol']
-    n_days_before_expiry_index = to_datetime(fut_ex_dt.index.date - CustomBusinessDay(roll_days, holidays=regular_holidays_local_array))
+    n_days_before_expiry_index = DatetimeIndex(get_calendar(holiday_aliases[underlying_index]).shift(
+        fut_ex_dt.index.date, -roll_days))
 
     fut_ex_dt.index = n_days_before_expiry_index
     fut_ex_dt.index = fut_ex_dt.index.tz_localize(tz='UTC')
     mapped_futures = fut_ex_dt.reindex(data_dt_range_idx).fillna(method='bfill').to_frame().dropna(how='all', axis='index').sort_index()
 
-    aspects = ['open', 'high', 'low', 'close']
-    stitched_price_dic = {}
-    for aspect in aspects:
-        p_df = (fut_bar_price[fut_bar_price['aspect'].eq(aspect) & fut_bar_price['underlying_index'].eq(underlying_index)])[['time', 'value', 'symbol']]
-        p_df = p_df.pivot_table(index='time', columns='symbol', values='value').sort_index()
-        # if p_df.index.tz is None:
-        #     p_df.index = p_df.index.tz_localize('UTC')
-        p_df.index = p_df.index.tz_convert(tz='UTC')
-        p_df = p_df.reindex(mapped_futures.index)
-        p_df['mapped_contract'] = mapped_futures['symbol']
-        stitched_price_dic[aspect] = get_masked_values(p_df, 'mapped_contract')
-
-    avg_price = (stitched_price_dic['open'] + stitched_price_dic['high'] + stitched_price_dic['low'] +
-                       stitched_price_dic['close']) / 4
+    fut_bar_price = fut_bar_price[fut_bar_price['underlying_index'].eq(underlying_index)]
+    avg_bar_price = (fut_bar_price[open] + fut_bar_price[high] + fut_bar_price[low] + fut_bar_price[close]) / 4
+    p_df = avg_bar_price.to_frame('value').assign(symbol=fut_bar_price['symbol'])
+    p_df = p_df.pivot_table(index='time', columns='symbol', values='value').sort_index()
+    p_df.index = p_df.index.tz_convert(tz='UTC')
+    p_df = p_df.reindex(mapped_futures.index)
+    p_df['mapped_contract'] = mapped_futures['symbol']
+    avg_price = get_masked_values(p_df, 'mapped_contract')
 
     return avg_price
 
@@ -155,7 +148,7 @@ def get_avg_price_series(bar_price_5m, start_dt, end_dt, asset_symbol, trade_p=T
 
     for quote in quotes:
         quote_price = bar_price_5m[bar_price_5m['price_type'].eq(quote)]
-        quote_price = quote_price.pivot_table(index='time', columns='aspect', values='value').mean(axis='columns')
+        quote_price = quote_price[[open, high, low, close]].mean(axis='columns').groupby(level='time').mean()
         quote_price.index = quote_price.index.tz_convert('UTC')
         quote_price = quote_price.reindex(index=data_dt_range_idx)
         aspect_price_dic[quote] = quote_price
@@ -211,15 +204,11 @@ def consolidate_bar_data(df, tz_of_data: str = 'Europe/London'):
         reference_price_index = to_datetime(dfs_dic[asset].index.date
                                             ) + BDay(day_offset[asset]
                                                      ) + to_timedelta(reference_price_time_utc[asset])
-        try:
-            regular_holidays_local = market_calendars.get_calendar(
-                holiday_aliases[asset]).regular_holidays.holidays()
-            regular_holidays_local_array = regular_holidays_local.values.astype('<M8[D]')
-        except KeyError:
-            pass
+        # currencies have no exchange and keep the calendar of the asset before them
+        if asset in holiday_aliases:
+            local_calendar = get_calendar(holiday_aliases[asset])
 
-        equity_trade_date_index = to_datetime(dfs_dic[asset].index.date + CustomBusinessDay(
-            day_offset[asset] + 1, holidays=regular_holidays_local_array))
+        equity_trade_date_index = DatetimeIndex(local_calendar.shift(dfs_dic[asset].index.date, day_offset[asset] + 1))
 
         df_result = dfs_dic[asset].to_frame()
         if 'Curncy' in asset:
@@ -237,13 +226,10 @@ def consolidate_bar_data(df, tz_of_data: str = 'Europe/London'):
             df_result['ref_future_timestamp'] = DatetimeIndex(temp_masked_ref)
             df_result['ref_future_price'] = dfs_dic[asset].reindex(reference_price_index).values
 
-        try:
-            local_holiday_bool = DatetimeIndex(reference_price_index.date).isin(regular_holidays_local)
-        except KeyError:
-            pass
+        local_holiday_bool = local_calendar.is_holiday(reference_price_index.date)
 
         # add two boolean columns which indicate whether they are UK or local trading holidays
-        uk_holiday_bool = DatetimeIndex(dfs_dic[asset].index.date).isin(regular_holidays_lse)
+        uk_holiday_bool = get_calendar('LSE').is_holiday(dfs_dic[asset].index.date)
         df_result.loc[:, 'lse_holiday'] = uk_holiday_bool
 
         if 'Index' in asset:
@@ -258,20 +244,7 @@ def get_spreads_by_date(dic_of_bar_data: dict, future: str):
     und_index = underlying_index[future]
     spreads = dic_of_bar_data[future]['avg_trade'] - dic_of_bar_data[und_index].reindex(dic_of_bar_data[future].index)[
         'avg_trade']
-    spreads.name = 'spreads'
-    start_time = (to_datetime(reference_price_time_utc[future]) - Timedelta(minutes=50)).time()
-    spread_df = spreads.between_time(start_time, reference_price_time_utc[future]).to_frame()
-    spread_df['trading_date_utc'] = spread_df.index.date
-    trading_day_index = DatetimeIndex(spread_df['trading_date_utc'])
-    spread_df['25% quantile'] = spread_df.groupby('trading_date_utc').quantile(0.25).reindex(index=trading_day_index)[
-        'spreads'].values
-    spread_df['75% quantile'] = spread_df.groupby('trading_date_utc').quantile(0.75).reindex(index=trading_day_index)[
-        'spreads'].values
-    spread_df['eligible_spreads'] = (spread_df['spreads'] > spread_df['25% quantile']) & \
-                                    (spread_df['spreads'] < spread_df['75% quantile'])
-    spread_df['spreads'] = spread_df['spreads'].where(spread_df['eligible_spreads'], nan)
-    eligible_spreads_by_date = spread_df.groupby('trading_date_utc').mean()['spreads']
-    return eligible_spreads_by_date
+    return daily_fair_spreads(spreads, reference_price_time_utc[future])
 
 
 def add_index_closing_price_based_signals(dic_of_bar_data: dict, daily_price_df: DataFrame,
@@ -486,7 +459,7 @@ def get_no_of_trading_days(bktest_df: DataFrame, col_name_suffix: str, open_sign
     opn_signal_days[opn_signal_days.isnull()] = dates_numpy[opn_signal_days.isnull()]
     opn_signal_days = opn_signal_days.values.astype('<M8[D]')
 
-    no_of_tdays_between_opn_sig_array = busday_count(opn_signal_days, dates_numpy, holidays=lse_holidays_array)
+    no_of_tdays_between_opn_sig_array = get_calendar('LSE').count(opn_signal_days, dates_numpy)
     result = Series(no_of_tdays_between_opn_sig_array, index=bktest_df.index)
     return result.replace(0, nan)
 
@@ -513,7 +486,7 @@ def no_of_days_since_prev_opn(df, t):
     else:
         start_dt = df['prev_opn_signal_dt'][t].to_numpy().astype('<M8[D]')
         end_dt = datetime64(df.index.date[t])
-        result = busday_count(start_dt, end_dt, holidays=lse_holidays_array)
+        result = get_calendar('LSE').count(start_dt, end_dt)
         return result
 
 def position_at_end_geo(df, t, opn_signal_cols):
@@ -616,7 +589,7 @@ def append_position_signals_vec(bktest_df: DataFrame, geo_settings: dict = geo_s
                             close_txs_signal_mask.eq(i).values.argmax()].to_numpy().astype('<M8[D]')
                         numpy_day_end = close_txs_signal_mask.index[
                             close_txs_signal_mask.eq(i + 1).values.argmax()].to_numpy().astype('<M8[D]')
-                        no_of_tdays_between_opn_sig = busday_count(numpy_day_start, numpy_day_end, holidays=lse_holidays_array)
+                        no_of_tdays_between_opn_sig = get_calendar('LSE').count(numpy_day_start, numpy_day_end)
                         opn_sig_mask = no_of_trade_days_since.le(
                             no_of_tdays_between_opn_sig + minimum_holding_period_days - 1) & \
                                        no_of_trade_days_since.gt(minimum_holding_period_days - 1)
@@ -1001,7 +974,7 @@ def construct_q_object(fut_prefix, other_symbols, price=False, start_dt=None, en
     others_q = Q(symbol__in=other_symbols)
     future_startswith_q = reduce(or_, [Q(symbol__startswith=pref) for pref in fut_prefix])
     if price:
-        general_q = Q(time__range=[start_dt, end_dt], aspect__in=[open, high, low, close], resolution='5m')
+        general_q = Q(time__range=[start_dt, end_dt], resolution='5m')
         q_query = general_q & (future_startswith_q | others_q)
     else:
         q_query = future_startswith_q | others_q
@@ -1022,16 +995,23 @@ def get_query_symbols(configs):
 def get_bar_price(symbol_dic, start_dt, end_dt, **configs):
     future_prefix = symbol_dic['future_prefix']
     idx_fx_symbols = symbol_dic['fx'] + symbol_dic['index']
+    if configs.get('use_archive', False):
+        bar_prices = [read_archived_bars(symbol__startswith=pref, time__range=[start_dt, end_dt], resolution='5m')
+                      for pref in future_prefix]
+        bar_prices.append(read_archived_bars(symbol__in=idx_fx_symbols, time__range=[start_dt, end_dt],
+                                             resolution='5m'))
+        return concat(bar_prices).sort_index()
     bar_price_query_set = construct_q_object(future_prefix, idx_fx_symbols, price=True,
                                              start_dt=start_dt, end_dt=end_dt)
-    bar_price = read_frame(Price.objects.filter(bar_price_query_set))
+    bar_price = read_bars(bar_price_query_set)
     return bar_price
 
 # @cache_result(timeout_s=24*60*60)
 def get_daily_price(symbol_dic, start_dt, end_dt, **configs):
     list_of_daily_symbols = symbol_dic['index'] + symbol_dic['vol'] + symbol_dic['fund']
-    df = read_prices(time__range=[start_dt, end_dt], symbol__in=list_of_daily_symbols,
-                     aspect = close, resolution=one_day, price_type__in=[trade, nav])
+    read = read_archived_prices if configs.get('use_archive', False) else read_prices
+    df = read(time__range=[start_dt, end_dt], symbol__in=list_of_daily_symbols,
+              aspect = close, resolution=one_day, price_type__in=[trade, nav])
     df = df.pivot_table(index='time', columns='symbol', values='value')
     return df
 
@@ -0,0 +1,69 @@
+from numpy import isnan, nanmean, where, zeros, vstack, arange, maximum, sqrt, nan, errstate
+from pandas import DataFrame, Series, concat
+
+STATISTICS = ['beta', 'r_squared', 'residual_vol', 'observations']
+
+
+def running_sums(fund_returns: DataFrame, hedging_return: Series):
+    '''
+    Cumulative sums of the observations where both the fund and the hedge have a return, with a leading row of
+    zeros so that the sums of rows i to j are sums[j + 1] - sums[i]
+    Returns are centred on their full sample mean first: windowed (co)variances do not change and the differences
+    of the sums keep their precision over long histories
+    :return: dict of n, x, y, xx, yy, xy arrays of shape (dates + 1, funds)
+    '''
+    y = fund_returns.to_numpy(dtype=float)
+    x = hedging_return.reindex(fund_returns.index).to_numpy(dtype=float)[:, None].repeat(y.shape[1], axis=1)
+    valid = ~isnan(y) & ~isnan(x)
+    with errstate(invalid='ignore'):
+        y = where(valid, y - nanmean(where(valid, y, nan), axis=0), 0)
+        x = where(valid, x - nanmean(where(valid, x, nan), axis=0), 0)
+    terms = {'n': valid.astype(float), 'x': x, 'y': y, 'xx': x * x, 'yy': y * y, 'xy': x * y}
+    return {name: vstack([zeros((1, y.shape[1])), term.cumsum(axis=0)]) for name, term in terms.items()}
+
+
+def window_sums(sums: dict, window: int = None):
+    '''
+    :param window: number of dates in each window, an expanding window from the first date if None
+    :return: dict of the sums over the window ending at each date
+    '''
+    end = arange(1, len(sums['n']))
+    start = zeros(len(end), dtype=int) if window is None else maximum(end - window, 0)
+    return {name: values[end] - values[start] for name, values in sums.items()}
+
+
+def rolling_regression(fund_returns: DataFrame, hedging_return: Series, window: int = None, min_periods: int = None):
+    '''
+    Regression of every fund column on the hedging return over a rolling or expanding window, in one O(dates x funds)
+    pass over running sums instead of one fit per window
+    :param fund_returns: DataFrame of returns with a column per fund
+    :param hedging_return: returns of the hedge on the same dates, e.g. the index return less the fx return
+    :param window: number of dates in each window, expanding if None
+    :param min_periods: fewest observations for a value, the window or 3 if expanding
+    :return: dict of statistic: DataFrame like fund_returns, with beta, r_squared (the squared correlation), residual_vol
+    (standard deviation of the regression residuals, with 2 degrees of freedom for the fit) and observations
+    '''
+    min_periods = (3 if window is None else window) if min_periods is None else min_periods
+    s = window_sums(running_sums(fund_returns, hedging_return), window)
+    n = s['n']
+    with errstate(divide='ignore', invalid='ignore'):
+        sxx = s['xx'] - s['x'] ** 2 / n
+        syy = s['yy'] - s['y'] ** 2 / n
+        sxy = s['xy'] - s['x'] * s['y'] / n
+        enough = (n >= max(min_periods, 2)) & (sxx > 0)
+        beta = where(enough, sxy / sxx, nan)
+        r_squared = where(enough & (syy > 0), sxy ** 2 / (sxx * syy), nan)
+        residual_vol = where(enough & (n > 2), sqrt(maximum(syy - sxy ** 2 / sxx, 0) / (n - 2)), nan)
+    return {name: DataFrame(values, index=fund_returns.index, columns=fund_returns.columns)
+            for name, values in zip(STATISTICS, [beta, r_squared, residual_vol, n.astype(int)])}
+
+
+def stack_statistics(statistics: dict):
+    '''
+    :param statistics: as returned by rolling_regression
+    :return: DataFrame of date, fund and one column per statistic, without the dates lacking a beta
+    '''
+    frames = [statistics[name].rename_axis(index='date', columns='fund').stack(dropna=False).rename(name)
+              for name in STATISTICS]
+    df = concat(frames, axis=1).reset_index()
+    return df[df['beta'].notna()].reset_index(drop=True)
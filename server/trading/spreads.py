@@ -0,0 +1,117 @@
+from collections import deque
+from math import nan, isnan
+
+from pandas import Series, Index, to_datetime, Timedelta
+from sortedcontainers import SortedList
+
+
+def quantile(values: SortedList, q: float):
+    '''
+    :return: the q quantile of the sorted values, interpolated linearly like pandas
+    '''
+    position = (len(values) - 1) * q
+    lower = int(position)
+    if lower + 1 >= len(values):
+        return values[lower]
+    return values[lower] + (values[lower + 1] - values[lower]) * (position - lower)
+
+
+class RollingSpread:
+    '''
+    Future minus index spread observations of one (index, future) pair, kept in time order and in an order
+    statistics list. Adding a bar costs O(log n) and the fair spread is the mean of the spreads strictly between
+    the lower and upper quantiles, as the backtests have always computed it.
+    '''
+
+    def __init__(self, window: int = None, trim: float = 0.25):
+        '''
+        :param window: number of latest observations kept, all of them if None
+        :param trim: share of observations cut from each tail
+        '''
+        self.window = window
+        self.trim = trim
+        self.observations = deque()
+        self.sorted = SortedList()
+
+    def __len__(self):
+        return len(self.observations)
+
+    @property
+    def last_time(self):
+        return self.observations[-1][0] if len(self.observations) > 0 else None
+
+    def update(self, time_, spread: float):
+        '''
+        Add the spread of a bar. A bar at the time of the last one replaces it, as the forming bar changes until
+        it closes, and older bars are ignored.
+        :return: True if the observation was used
+        '''
+        if spread is None or isnan(spread):
+            return False
+        last_time = self.last_time
+        if last_time is not None and time_ < last_time:
+            return False
+        if last_time is not None and time_ == last_time:
+            self.sorted.remove(self.observations.pop()[1])
+        self.observations.append((time_, spread))
+        self.sorted.add(spread)
+        if self.window is not None and len(self.observations) > self.window:
+            self.sorted.remove(self.observations.popleft()[1])
+        return True
+
+    def clear(self):
+        self.observations.clear()
+        self.sorted.clear()
+
+    def fair_spread(self, median_when_tied=False):
+        '''
+        :param median_when_tied: return the median instead of nan when ties leave nothing strictly between the
+        quantiles, which is the tied spread the live signals' positional trimmed mean used to give
+        :return: trimmed mean of the spreads, nan without observations or when ties leave nothing strictly between
+        the quantiles, as the backtests did
+        '''
+        if len(self.sorted) == 0:
+            return nan
+        lower, upper = quantile(self.sorted, self.trim), quantile(self.sorted, 1 - self.trim)
+        kept = self.sorted[self.sorted.bisect_right(lower):self.sorted.bisect_left(upper)]
+        if len(kept) == 0:
+            return quantile(self.sorted, 0.5) if median_when_tied else nan
+        return sum(kept) / len(kept)
+
+
+# index: (future, estimator), one entry per index however often its future rolls
+spread_estimators = {}
+
+
+def get_spread_estimator(index: str, future: str, window: int):
+    '''
+    :return: the process wide estimator of the index, a new one when its future rolls
+    '''
+    current = spread_estimators.get(index)
+    if current is None or current[0] != future:
+        current = spread_estimators[index] = (future, RollingSpread(window))
+    return current[1]
+
+
+def daily_fair_spreads(spreads: Series, reference_time: str, minutes: int = 50):
+    '''
+    Fair spread of each trading day from the bars in the minutes up to the reference price time, in one pass
+    :param spreads: future minus index spreads with a UTC DatetimeIndex
+    :param reference_time: e.g. '06:00:00' UTC
+    :return: Series named spreads by trading_date_utc
+    '''
+    start_time = (to_datetime(reference_time) - Timedelta(minutes=minutes)).time()
+    window = spreads.between_time(start_time, reference_time).sort_index()
+    estimator = RollingSpread()
+    dates, values = [], []
+    for timestamp, spread in zip(window.index, window.values):
+        date = timestamp.date()
+        if len(dates) == 0 or dates[-1] != date:
+            if len(dates) > 0:
+                values.append(estimator.fair_spread())
+            estimator.clear()
+            dates.append(date)
+        estimator.update(timestamp, spread)
+    if len(dates) > 0:
+        values.append(estimator.fair_spread())
+    return Series(values, index=Index(dates, name='trading_date_utc'), name='spreads', dtype='float64')
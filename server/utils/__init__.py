@@ -1,6 +1,8 @@
 import string
+from collections import OrderedDict
 from datetime import datetime
 from random import choice, choices
+from time import perf_counter
 
 from django.http import HttpResponse, JsonResponse
 from pandas import DataFrame
@@ -165,6 +167,25 @@ class Message:
         return HttpResponse(self.__dict__)
 
 
+class StageTimer(OrderedDict):
+    '''
+    Seconds spent in each stage of a computation, timer('stage') ends the stage started by the previous call
+    '''
+
+    def __init__(self):
+        super().__init__()
+        self.start = self.last = perf_counter()
+
+    def __call__(self, stage):
+        now = perf_counter()
+        self[stage] = now - self.last
+        self.last = now
+
+    def finish(self):
+        self['total'] = self.last - self.start
+        return dict(self)
+
+
 if __name__ == '__main__':
     from utils.test import CapturingStdOut
     from utils.cloud_logging import Logger
@@ -1,6 +1,10 @@
 from os.path import dirname, abspath, join
 from os import walk
 from io import StringIO
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread
+from urllib.parse import urlsplit, parse_qs
+import json
 import sys
 
 test_user_name = 'test_user_name'
@@ -68,3 +72,58 @@ def list_files(path, mask_include=None, mask_exclude=None):
 def test_files(dir_name, mask_include=None, mask_exclude=None):
     path = join(test_data_dir, dir_name)
     return list_files(path, mask_include, mask_exclude)
+
+
+class StubServer:
+    '''
+    Local HTTP server for tests. Each path maps to a list of (status, body, headers) responses
+    served in order, the last one is repeated. Bodies which are not bytes or str are sent as JSON.
+    A body, or a whole response, can be a callable of (path, query, headers).
+    '''
+
+    def __init__(self, routes=None):
+        self.routes = {} if routes is None else routes
+        self.requests = []
+        self.client_ports = set()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                stub.requests.append((url.path, parse_qs(url.query), dict(self.headers)))
+                stub.client_ports.add(self.client_address[1])
+                responses = stub.routes.get(url.path, [(404, {'error': 'not found'}, {})])
+                response = responses.pop(0) if len(responses) > 1 else responses[0]
+                if callable(response):
+                    response = response(url.path, parse_qs(url.query), dict(self.headers))
+                status, body, headers = response
+                if callable(body):
+                    body = body(url.path, parse_qs(url.query), dict(self.headers))
+                if not isinstance(body, (bytes, str)):
+                    body = json.dumps(body)
+                    headers = dict({'Content-Type': 'application/json'}, **headers)
+                if isinstance(body, str):
+                    body = body.encode()
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:' + str(self.server.server_address[1])
+
+    def __enter__(self):
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()